@@ -0,0 +1,232 @@
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+import matcher # UNKNOWN
+
+# --- Parâmetros do Controle de Acesso ---
+CONFIRM_MATCHES = 3 # Reconhecimentos seguidos da mesma pessoa para liberar
+CONFIRM_WINDOW_S = 1.5 # ... dentro desta janela
+COOLDOWN_S = 3.0 # Intervalo mínimo entre duas liberações da mesma pessoa
+QUEUE_SIZE = 16 # Eventos aguardando o atuador; com a fila cheia o evento é descartado
+RELAY_PORT = os.environ.get("RECOG_RELAY_PORT") # Ex.: "COM7" ou "/dev/ttyUSB0"; sem porta usa FakeRelay
+RELAY_BAUD = int(os.environ.get("RECOG_RELAY_BAUD", "9600"))
+
+class AccessEvent(NamedTuple):
+    nome: str
+    perfil: Optional[str]
+    distancia: float
+    timestamp: float # time.monotonic() do frame que confirmou o acesso
+
+class AccessDecider:
+    """
+    Transforma os reconhecimentos de cada frame em eventos de acesso: uma
+    pessoa precisa ser reconhecida em `confirmacoes` frames seguidos dentro de
+    `janela` segundos, e depois de liberada só gera outro evento passado o
+    `cooldown`. Um frame sem a pessoa (ou com ela como desconhecida) zera a contagem.
+    """
+
+    def __init__(self, confirmacoes: int = CONFIRM_MATCHES, janela: float = CONFIRM_WINDOW_S,
+                 cooldown: float = COOLDOWN_S):
+        self.confirmacoes = confirmacoes
+        self.janela = janela
+        self.cooldown = cooldown
+        self._sequencias: Dict[str, List[float]] = {} # nome -> [inicio, contagem]
+        self._liberados: Dict[str, float] = {}
+        self._ultimo_seq: Optional[int] = None
+
+    def observe(self, matches: Sequence[Optional[matcher.Match]], seq: Optional[int] = None,
+                timestamp: Optional[float] = None) -> List[AccessEvent]:
+        """
+        Registra os matches de um frame processado. `seq` evita contar duas
+        vezes o mesmo resultado (a exibição lê o último resultado a cada frame).
+        """
+        if seq is not None:
+            if self._ultimo_seq is not None and seq <= self._ultimo_seq:
+                return []
+            self._ultimo_seq = seq
+        agora = time.monotonic() if timestamp is None else timestamp
+        vistos = {m.nome: m for m in matches if m is not None and m.nome != matcher.UNKNOWN}
+        for nome in list(self._sequencias):
+            if nome not in vistos:
+                del self._sequencias[nome]
+
+        eventos = []
+        for nome, m in vistos.items():
+            seqc = self._sequencias.get(nome)
+            if seqc is None or agora - seqc[0] > self.janela:
+                seqc = self._sequencias[nome] = [agora, 0]
+            seqc[1] += 1
+            if seqc[1] < self.confirmacoes:
+                continue
+            del self._sequencias[nome]
+            if agora - self._liberados.get(nome, float("-inf")) < self.cooldown:
+                continue
+            self._liberados[nome] = agora
+            eventos.append(AccessEvent(nome, m.perfil, m.distancia, agora))
+        return eventos
+
+# --- Atuadores ---
+
+class Relay:
+    """Interface do atuador da porta. `open` pode demorar: roda só na thread do ActuatorWorker."""
+
+    def open(self, evento: AccessEvent):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class SerialRelay(Relay):
+    """Relé na porta serial (Arduino): envia `comando` a cada liberação. Requer o pyserial."""
+
+    def __init__(self, porta: str, baud: int = RELAY_BAUD, comando: bytes = b"O", timeout: float = 0.5):
+        import serial # Dependência opcional: só quem usa o relé serial precisa dela
+        self.comando = comando
+        self.ser = serial.Serial(porta, baud, timeout=timeout, write_timeout=timeout)
+        time.sleep(2) # O Arduino reinicia ao abrir a porta
+
+    def open(self, evento: AccessEvent):
+        self.ser.write(self.comando)
+
+    def close(self):
+        self.ser.close()
+
+class FakeRelay(Relay):
+    """Substituto local do relé: guarda os eventos e, opcionalmente, simula uma porta lenta."""
+
+    def __init__(self, atraso: float = 0.0, verbose: bool = True):
+        self.atraso = atraso
+        self.verbose = verbose
+        self.eventos: List[AccessEvent] = []
+
+    def open(self, evento: AccessEvent):
+        if self.atraso:
+            time.sleep(self.atraso)
+        self.eventos.append(evento)
+        if self.verbose:
+            print(f"[relé simulado] Porta liberada para {evento.nome}")
+
+class ActuatorWorker:
+    """
+    Fila limitada de eventos consumida por uma thread própria. `submit` nunca
+    bloqueia: com o atuador lento ou travado a fila enche e os eventos novos
+    são descartados (contados em `dropped`), sem atrasar o reconhecimento.
+    """
+
+    def __init__(self, relay: Relay, maxsize: int = QUEUE_SIZE):
+        self.relay = relay
+        self.enviados = 0
+        self.dropped = 0
+        self.falhas = 0
+        self._fila: "queue.Queue[Optional[AccessEvent]]" = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run, name="atuador", daemon=True)
+        self._thread.start()
+
+    def submit(self, evento: AccessEvent) -> bool:
+        try:
+            self._fila.put_nowait(evento)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        while True:
+            evento = self._fila.get()
+            if evento is None:
+                break
+            try:
+                self.relay.open(evento)
+                self.enviados += 1
+            except Exception as e:
+                self.falhas += 1
+                print(f"Erro no atuador: {e}")
+
+    def stop(self, timeout: float = 1.0):
+        try:
+            self._fila.put_nowait(None)
+        except queue.Full:
+            pass # Atuador travado: a thread é daemon e termina com o processo
+        self._thread.join(timeout)
+        self.relay.close()
+
+class AccessControl:
+    """Decisor + atuador. `process` recebe o resultado do pipeline e retorna os eventos gerados."""
+
+    def __init__(self, relay: Optional[Relay] = None, decider: Optional[AccessDecider] = None,
+                 maxsize: int = QUEUE_SIZE):
+        self.decider = decider or AccessDecider()
+        self.worker = ActuatorWorker(relay or FakeRelay(), maxsize)
+        self._listeners: List[Callable[[AccessEvent], None]] = []
+
+    def on_grant(self, callback: Callable[[AccessEvent], None]):
+        self._listeners.append(callback)
+
+    def process(self, result: Any) -> List[AccessEvent]:
+        """`result` é um pipeline.FrameResult (só os matches e o seq são usados)."""
+        if result is None or not result.matches:
+            return []
+        eventos = self.decider.observe(result.matches, result.seq, result.timestamp)
+        for evento in eventos:
+            self.worker.submit(evento)
+            for callback in self._listeners:
+                callback(evento)
+        return eventos
+
+    def stats(self) -> Dict[str, int]:
+        return {"acessos_enviados": self.worker.enviados, "acessos_descartados": self.worker.dropped,
+                "falhas_atuador": self.worker.falhas}
+
+    def stop(self):
+        self.worker.stop()
+
+def from_env() -> AccessControl:
+    """Relé serial em RECOG_RELAY_PORT (se definido e disponível), senão o relé simulado."""
+    relay: Relay
+    if RELAY_PORT:
+        try:
+            relay = SerialRelay(RELAY_PORT, RELAY_BAUD)
+        except Exception as e: # pyserial ausente ou porta indisponível
+            print(f"Relé serial indisponível ({e}); usando o relé simulado.")
+            relay = FakeRelay()
+    else:
+        relay = FakeRelay()
+    return AccessControl(relay)
+
+# --- Verificação ---
+
+def stall_check(atraso: float = 5.0, frames: int = 300) -> Dict[str, float]:
+    """
+    Simula o reconhecimento contínuo de três pessoas com um relé travado por
+    `atraso` segundos: mede o pior tempo de process() (não deve passar de
+    milissegundos) e confere a deduplicação dos eventos.
+    """
+    relay = FakeRelay(atraso=atraso, verbose=False)
+    controle = AccessControl(relay, AccessDecider(cooldown=1.0), maxsize=4)
+    pior = 0.0
+    eventos = 0
+    pessoas = [matcher.Match(n, 0.3, "Conservador") for n in ("ana", "bruno", "carla")]
+
+    class _Resultado(NamedTuple):
+        seq: int
+        timestamp: float
+        matches: list
+
+    for i in range(frames):
+        t0 = time.perf_counter()
+        eventos += len(controle.process(_Resultado(i + 1, i / 30.0, pessoas)))
+        pior = max(pior, time.perf_counter() - t0)
+    controle.worker.stop(timeout=0)
+    return {"pior_process_ms": pior * 1000, "eventos": eventos, "descartados": controle.worker.dropped,
+            "esperado": 3 * (int((frames - 1) / 30.0) + 1)}
+
+if __name__ == "__main__":
+    r = stall_check()
+    print(f"Pior process(): {r['pior_process_ms']:.3f} ms | eventos {r['eventos']} (esperado {r['esperado']}) | "
+          f"descartados pela fila cheia {r['descartados']}")
+    if r["pior_process_ms"] > 10 or r["eventos"] != r["esperado"]:
+        raise SystemExit("FALHA")
+    print("OK: um relé travado não atrasa o reconhecimento.")
@@ -0,0 +1,570 @@
+import os
+import pickle
+import threading
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+
+import db_operations # Galeria de reconhecimento e notificação de alterações
+import matcher # Distâncias vetorizadas e THRESH
+
+# --- Parâmetros do Índice IVF ---
+# O espaço dos descritores é dividido em `nlist` células (k-means). Cada busca
+# compara a consulta só com os vetores das `nprobe` células mais próximas:
+# nprobe maior = mais recall e mais latência; nprobe = nlist equivale à busca exata.
+DEFAULT_NPROBE = 8
+KMEANS_ITERS = 20
+KMEANS_SAMPLE_PER_LIST = 64 # Amostra de treino por célula (limita o custo do k-means)
+RETRAIN_GROWTH = 4.0 # Retreina quando a galeria cresce 4x desde o último treino
+JOURNAL_COMPACT_RATIO = 0.1 # Reescreve o snapshot quando o diário passa de 10% de N
+SEARCH_BATCH = 32 # A partir de quantas consultas a busca agrupa por célula (mais rápido só em lotes grandes)
+KEY_CHUNK_ROWS = 8192 # Linhas por bloco no cálculo das assinaturas (limita a memória temporária)
+# Pesos fixos da assinatura de um vetor: soma dos bits de cada componente vezes um peso ímpar (mod 2^64)
+_KEY_WEIGHTS = np.random.default_rng(0x1F0).integers(1, 2 ** 63, db_operations.DESCRIPTOR_DIM, dtype=np.uint64) | np.uint64(1)
+
+def index_path() -> str:
+    """Arquivo do índice, salvo ao lado do DB de usuários (ex.: db.ivf.pkl)."""
+    return os.path.splitext(db_operations.DB_FILE)[0] + ".ivf.pkl"
+
+def journal_path() -> str:
+    """Diário de alterações incrementais aplicadas depois do último snapshot."""
+    return os.path.splitext(db_operations.DB_FILE)[0] + ".ivf.log"
+
+def default_nlist(n: int) -> int:
+    """Número de células recomendado para uma galeria com n vetores."""
+    return int(max(1, min(n, round(4 * np.sqrt(n)))))
+
+def kmeans(vetores: np.ndarray, k: int, iters: int = KMEANS_ITERS, seed: int = 0) -> np.ndarray:
+    """k-means (Lloyd) em NumPy puro. Retorna os centróides (k, d) float32."""
+    rng = np.random.default_rng(seed)
+    n = vetores.shape[0]
+    amostra = vetores
+    if n > k * KMEANS_SAMPLE_PER_LIST:
+        amostra = vetores[rng.choice(n, k * KMEANS_SAMPLE_PER_LIST, replace=False)]
+    centroids = amostra[rng.choice(amostra.shape[0], k, replace=False)].copy()
+
+    for _ in range(iters):
+        dono = np.argmin(matcher.pairwise_distances(amostra, centroids), axis=1)
+        somas = np.zeros_like(centroids)
+        np.add.at(somas, dono, amostra)
+        contagem = np.bincount(dono, minlength=k)
+        vazias = contagem == 0
+        centroids[~vazias] = somas[~vazias] / contagem[~vazias, np.newaxis]
+        # Células vazias recebem pontos aleatórios da amostra
+        if vazias.any():
+            centroids[vazias] = amostra[rng.choice(amostra.shape[0], int(vazias.sum()), replace=False)]
+    return centroids.astype(np.float32)
+
+def _row_keys(vetores: np.ndarray) -> np.ndarray:
+    """Assinatura uint64 de cada linha, calculada sobre os bits exatos dos float32."""
+    chaves = np.empty(vetores.shape[0], dtype=np.uint64)
+    for i in range(0, vetores.shape[0], KEY_CHUNK_ROWS):
+        bloco = np.ascontiguousarray(vetores[i:i + KEY_CHUNK_ROWS], dtype=np.float32).view(np.uint32)
+        chaves[i:i + KEY_CHUNK_ROWS] = (bloco.astype(np.uint64) * _KEY_WEIGHTS).sum(axis=1, dtype=np.uint64)
+    return chaves
+
+def _user_keys(nomes: np.ndarray, perfis: np.ndarray, vetores: np.ndarray,
+               donos: Optional[np.ndarray] = None) -> Dict[str, Tuple[int, Optional[str]]]:
+    """
+    {nome: (assinatura, perfil)} de cada usuário. A assinatura é a soma das
+    assinaturas dos templates, então não depende da ordem das linhas. Tudo é
+    vetorizado: o sync compara dois destes dicionários com operações de conjunto.
+    """
+    if not len(nomes):
+        return {}
+    if donos is None:
+        donos = np.unique(np.asarray(nomes, dtype=object), return_inverse=True)[1]
+    donos = np.asarray(donos).ravel()
+    ids, primeiras, grupo = np.unique(donos, return_index=True, return_inverse=True)
+    somas = np.zeros(len(ids), dtype=np.uint64)
+    np.add.at(somas, grupo.ravel(), _row_keys(vetores))
+    return dict(zip(np.asarray(nomes, dtype=object)[primeiras].tolist(),
+                    zip(somas.tolist(), np.asarray(perfis, dtype=object)[primeiras].tolist())))
+
+class _InvertedList:
+    """Vetores de uma célula do IVF em um buffer contíguo que cresce sob demanda."""
+
+    def __init__(self, dim: int):
+        self.vetores = np.empty((0, dim), dtype=np.float32)
+        self.normas2 = np.empty(0, dtype=np.float32)
+        self.nomes: List[str] = []
+        self.perfis: List[Optional[str]] = []
+
+    def __len__(self):
+        return len(self.nomes)
+
+    def append(self, nome: str, vec: np.ndarray, perfil: Optional[str]) -> int:
+        n = len(self.nomes)
+        if n >= self.vetores.shape[0]:
+            cap = max(8, 2 * self.vetores.shape[0])
+            vetores = np.empty((cap, self.vetores.shape[1]), dtype=np.float32)
+            normas2 = np.empty(cap, dtype=np.float32)
+            vetores[:n] = self.vetores[:n]
+            normas2[:n] = self.normas2[:n]
+            self.vetores, self.normas2 = vetores, normas2
+        self.vetores[n] = vec
+        self.normas2[n] = np.dot(vec, vec)
+        self.nomes.append(nome)
+        self.perfis.append(perfil)
+        return n
+
+    def remove(self, pos: int) -> Optional[str]:
+        """Remove a posição `pos` trazendo a última para o lugar; retorna o nome de quem foi movido."""
+        last = len(self.nomes) - 1
+        moved = None
+        if pos != last:
+            self.vetores[pos] = self.vetores[last]
+            self.normas2[pos] = self.normas2[last]
+            self.nomes[pos] = self.nomes[last]
+            self.perfis[pos] = self.perfis[last]
+            moved = self.nomes[pos]
+        self.nomes.pop()
+        self.perfis.pop()
+        return moved
+
+class IVFIndex:
+    """
+    Índice aproximado IVF (inverted file) com quantização grosseira por k-means.
+    Mantido em sincronia com a galeria de db_operations e persistido em disco
+    como snapshot + diário de alterações incrementais.
+    """
+
+    def __init__(self, nprobe: int = DEFAULT_NPROBE):
+        self.nprobe = nprobe
+        self.centroids = np.empty((0, db_operations.DESCRIPTOR_DIM), dtype=np.float32)
+        self.lists: List[_InvertedList] = []
+        self._where: Dict[str, List[Tuple[int, int]]] = {} # nome -> [(célula, posição)] por template
+        self._keys: Dict[str, Tuple[int, Optional[str]]] = {} # nome -> (assinatura dos templates, perfil)
+        self.trained_n = 0
+        self.version = None # Versão da galeria refletida pelo índice
+        self._journal_ops = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._where)
+
+    # --- Construção e atualização ---
+
+    def build(self, gallery: db_operations.Gallery, nlist: Optional[int] = None):
+        """Treina os centróides e indexa toda a galeria."""
+        with self._lock:
+            n = gallery.vetores.shape[0]
+            nlist = nlist or default_nlist(n)
+            if n:
+                self.centroids = kmeans(gallery.vetores, nlist)
+            else:
+                self.centroids = np.empty((0, db_operations.DESCRIPTOR_DIM), dtype=np.float32)
+            self.lists = [_InvertedList(db_operations.DESCRIPTOR_DIM) for _ in range(self.centroids.shape[0])]
+            self._where = {}
+            self._keys = _user_keys(gallery.nomes, gallery.perfis, gallery.vetores, gallery.donos)
+            if n:
+                celulas = self._assign(gallery.vetores)
+                for i, nome in enumerate(gallery.nomes):
+                    self._add(nome, gallery.vetores[i], gallery.perfis[i], int(celulas[i]))
+            self.trained_n = len(self._where) # Usuários, como __len__
+
+    def _assign(self, vetores: np.ndarray) -> np.ndarray:
+        return np.argmin(matcher.pairwise_distances(vetores, self.centroids), axis=1)
+
+    def _add(self, nome: str, vec: np.ndarray, perfil: Optional[str], celula: Optional[int] = None):
+        if celula is None:
+            celula = int(self._assign(vec[np.newaxis, :])[0])
+        pos = self.lists[celula].append(nome, vec, perfil)
+        self._where.setdefault(nome, []).append((celula, pos))
+
+    def add(self, nome: str, vetor: Any, perfil: Optional[str]):
+        """Indexa um usuário; cada template (linha de `vetor`) vai para a sua célula."""
+        vecs = db_operations._as_templates(vetor)
+        with self._lock:
+            if vecs is None or nome in self._where:
+                return
+            if not self.lists:
+                # Primeiro vetor de um índice vazio vira o único centróide
+                self.centroids = vecs[:1].copy()
+                self.lists = [_InvertedList(db_operations.DESCRIPTOR_DIM)]
+            for vec in vecs:
+                self._add(nome, vec, perfil)
+            self._keys[nome] = (int(_row_keys(vecs).sum(dtype=np.uint64)), perfil)
+            self._journal(("add", nome, vecs, perfil))
+
+    def remove(self, nome: str):
+        with self._lock:
+            locs = self._where.pop(nome, None)
+            if locs is None:
+                return
+            self._keys.pop(nome, None)
+            # Da maior posição para a menor: a última posição de uma célula
+            # nunca é outro template ainda não removido deste usuário
+            for celula, pos in sorted(locs, key=lambda loc: loc[1], reverse=True):
+                last = len(self.lists[celula]) - 1
+                moved = self.lists[celula].remove(pos)
+                if moved is not None:
+                    movidas = self._where[moved]
+                    movidas[movidas.index((celula, last))] = (celula, pos)
+            self._journal(("remove", nome))
+
+    def update_profile(self, nome: str, perfil: Optional[str]):
+        with self._lock:
+            locs = self._where.get(nome)
+            if locs is None:
+                return
+            for celula, pos in locs:
+                self.lists[celula].perfis[pos] = perfil
+            self._keys[nome] = (self._keys[nome][0], perfil)
+            self._journal(("update", nome, perfil))
+
+    def needs_retrain(self) -> bool:
+        return len(self) > RETRAIN_GROWTH * max(self.trained_n, 1) and len(self) > 1
+
+    def sync(self, gallery: db_operations.Gallery, version: int):
+        """
+        Ajusta o índice à galeria (fonte da verdade) aplicando só as diferenças.
+        Usado ao carregar do disco e quando outro processo altera o DB.
+        """
+        with self._lock:
+            if self.needs_retrain() or (not self.lists and gallery.vetores.shape[0]):
+                self.build(gallery)
+                self.save()
+            else:
+                # Assinaturas e perfis comparados como conjuntos: sem laço em Python
+                # sobre toda a galeria, só sobre os usuários que mudaram
+                atuais = _user_keys(gallery.nomes, gallery.perfis, gallery.vetores, gallery.donos)
+                removidos = self._keys.keys() - atuais.keys()
+                mudados = atuais.items() - self._keys.items()
+                for nome in removidos:
+                    self.remove(nome)
+                if mudados:
+                    # Linhas só dos usuários alterados
+                    linhas_de: Dict[str, List[int]] = {}
+                    for i in np.flatnonzero(np.isin(gallery.nomes, [nome for nome, _ in mudados])):
+                        linhas_de.setdefault(gallery.nomes[i], []).append(int(i))
+                    for nome, (chave, perfil) in mudados:
+                        if nome in self._keys and self._keys[nome][0] == chave:
+                            self.update_profile(nome, perfil)
+                        else:
+                            # Usuário novo ou recriado com outro vetor
+                            self.remove(nome)
+                            self.add(nome, gallery.vetores[linhas_de[nome]], perfil)
+                if self.version is None and (removidos or mudados):
+                    # Diferenças aplicadas durante o carregamento não passam pelo diário
+                    self.save()
+            self.version = version
+
+    # --- Busca ---
+
+    def search(self, q: np.ndarray, k: int = 1, nprobe: Optional[int] = None) -> List[List[Tuple[str, float, Optional[str]]]]:
+        """
+        Busca aproximada dos k usuários mais próximos de cada consulta (F, d).
+        Retorna, por consulta, uma lista [(nome, distancia, perfil)] em ordem
+        crescente, com a distância do template mais próximo de cada usuário.
+        """
+        nprobe = nprobe or self.nprobe
+        with self._lock:
+            if not self._where:
+                return [[] for _ in range(q.shape[0])]
+            nprobe = min(nprobe, len(self.lists))
+            dc = matcher.pairwise_distances(q, self.centroids)
+            if nprobe < len(self.lists):
+                probes = np.argpartition(dc, nprobe - 1, axis=1)[:, :nprobe]
+            else:
+                probes = np.broadcast_to(np.arange(len(self.lists)), dc.shape)
+
+            kk = k if k == 1 else k * db_operations.MAX_TEMPLATES
+            if q.shape[0] >= SEARCH_BATCH:
+                return self._search_by_cell(q, probes, k, kk)
+            results = []
+            for f in range(q.shape[0]):
+                celulas = [c for c in probes[f] if len(self.lists[c])]
+                if not celulas:
+                    results.append([])
+                    continue
+                inicios = np.cumsum([0] + [len(self.lists[c]) for c in celulas])
+                vetores = np.concatenate([self.lists[c].vetores[:len(self.lists[c])] for c in celulas])
+                normas2 = np.concatenate([self.lists[c].normas2[:len(self.lists[c])] for c in celulas])
+                dist = matcher.pairwise_distances(q[f:f + 1], vetores, normas2)[0]
+
+                def onde(i):
+                    # Nome e perfil só das linhas vencedoras: posição na concatenação -> (célula, posição)
+                    j = int(np.searchsorted(inicios, i, "right")) - 1
+                    return celulas[j], i - inicios[j]
+
+                results.append(self._top_users(dist, onde, k, kk))
+            return results
+
+    def _search_by_cell(self, q: np.ndarray, probes: np.ndarray, k: int, kk: int) -> List[List[Tuple[str, float, Optional[str]]]]:
+        """
+        Busca em lote: as consultas são agrupadas por célula sondada, e cada
+        célula é comparada com todas as suas consultas em uma só multiplicação
+        de matrizes, direto no buffer dela. Cada célula contribui com as suas kk
+        melhores linhas para cada consulta.
+        """
+        por_celula: Dict[int, List[int]] = {}
+        for f, celulas in enumerate(probes):
+            for c in celulas:
+                if len(self.lists[c]):
+                    por_celula.setdefault(int(c), []).append(f)
+        partes: List[List[Tuple[np.ndarray, int, np.ndarray]]] = [[] for _ in range(q.shape[0])]
+        for c, consultas in por_celula.items():
+            lista = self.lists[c]
+            n = len(lista)
+            dist = matcher.pairwise_distances(q[consultas], lista.vetores[:n], lista.normas2[:n])
+            if kk < n:
+                pos = np.argpartition(dist, kk - 1, axis=1)[:, :kk]
+                dist = np.take_along_axis(dist, pos, axis=1)
+            else:
+                pos = np.broadcast_to(np.arange(n), dist.shape)
+            for linha, f in enumerate(consultas):
+                partes[f].append((dist[linha], c, pos[linha]))
+
+        results = []
+        for f in range(q.shape[0]):
+            if not partes[f]:
+                results.append([])
+                continue
+            dist = np.concatenate([d for d, _, _ in partes[f]])
+            celulas = np.concatenate([np.full(len(d), c) for d, c, _ in partes[f]])
+            posicoes = np.concatenate([p for _, _, p in partes[f]])
+            results.append(self._top_users(dist, lambda i: (celulas[i], posicoes[i]), k, kk))
+        return results
+
+    def _top_users(self, dist: np.ndarray, onde, k: int, kk: int) -> List[Tuple[str, float, Optional[str]]]:
+        """Os k usuários mais próximos entre as kk melhores linhas; `onde(i)` -> (célula, posição) da linha i."""
+        kk = min(kk, dist.shape[0])
+        top = np.argpartition(dist, kk - 1)[:kk] if kk < dist.shape[0] else np.arange(dist.shape[0])
+        top = top[np.argsort(dist[top])]
+        vistos, candidatos = set(), []
+        for i in top:
+            c, pos = onde(i)
+            nome = self.lists[c].nomes[pos]
+            if nome not in vistos:
+                vistos.add(nome)
+                candidatos.append((nome, float(dist[i]), self.lists[c].perfis[pos]))
+                if len(candidatos) == k:
+                    break
+        return candidatos
+
+    # --- Persistência ---
+
+    def save(self):
+        """Grava o snapshot completo e zera o diário."""
+        with self._lock:
+            estado = {
+                "centroids": self.centroids,
+                "lists": [(c.vetores[:len(c)].copy(), list(c.nomes), list(c.perfis)) for c in self.lists],
+                "trained_n": self.trained_n,
+            }
+            tmp = index_path() + ".tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump(estado, f)
+            os.replace(tmp, index_path())
+            if os.path.exists(journal_path()):
+                os.remove(journal_path())
+            self._journal_ops = 0
+
+    def _journal(self, registro: tuple):
+        """Acrescenta uma alteração ao diário (O(1)); compacta quando ele cresce demais."""
+        if self.version is None:
+            return # Índice em construção/carregamento, ainda não persistido
+        with open(journal_path(), "ab") as f:
+            pickle.dump(registro, f)
+        self._journal_ops += 1
+        if self._journal_ops > max(1000, JOURNAL_COMPACT_RATIO * len(self)):
+            self.save()
+
+    @classmethod
+    def load(cls, nprobe: int = DEFAULT_NPROBE) -> Optional["IVFIndex"]:
+        """Carrega snapshot + diário do disco, ou None se não houver índice salvo."""
+        if not os.path.exists(index_path()):
+            return None
+        index = cls(nprobe)
+        try:
+            with open(index_path(), "rb") as f:
+                estado = pickle.load(f)
+        except (EOFError, pickle.UnpicklingError):
+            return None
+        index.centroids = estado["centroids"]
+        index.trained_n = estado["trained_n"]
+        index.lists = [_InvertedList(db_operations.DESCRIPTOR_DIM) for _ in range(index.centroids.shape[0])]
+        for celula, (vetores, nomes, perfis) in enumerate(estado["lists"]):
+            for vec, nome, perfil in zip(vetores, nomes, perfis):
+                index._add(nome, vec, perfil, celula)
+        if estado["lists"]:
+            index._keys = _user_keys(np.concatenate([np.asarray(nomes, dtype=object) for _, nomes, _ in estado["lists"]]),
+                                     np.concatenate([np.asarray(perfis, dtype=object) for _, _, perfis in estado["lists"]]),
+                                     np.concatenate([vetores for vetores, _, _ in estado["lists"]]))
+
+        if os.path.exists(journal_path()):
+            with open(journal_path(), "rb") as f:
+                while True:
+                    try:
+                        registro = pickle.load(f)
+                    except (EOFError, pickle.UnpicklingError):
+                        break # Fim do diário (ou último registro incompleto)
+                    if registro[0] == "add":
+                        index.add(*registro[1:])
+                    elif registro[0] == "remove":
+                        index.remove(registro[1])
+                    elif registro[0] == "update":
+                        index.update_profile(*registro[1:])
+                    index._journal_ops += 1
+        return index
+
+# --- Instância do Processo ---
+
+_index: Optional[IVFIndex] = None
+_index_lock = threading.Lock()
+_retrainer: Optional[threading.Thread] = None
+
+def _on_change(alteracoes: List[db_operations.Change]):
+    """Aplica incrementalmente no índice as alterações feitas por db_operations."""
+    index = _index
+    if index is None:
+        return
+    with index._lock:
+        versao = db_operations.get_gallery_version()
+        if index.version != versao - 1:
+            return # Fora de sincronia; o próximo get_index() faz o sync completo
+        for operacao, nome, vetor, perfil in alteracoes:
+            if operacao == "create":
+                index.add(nome, vetor, perfil)
+            elif operacao == "update":
+                index.update_profile(nome, perfil)
+            elif operacao == "delete":
+                index.remove(nome)
+        index.version = versao
+        if index.needs_retrain():
+            _start_retrain()
+
+def _start_retrain():
+    """
+    Retreina em uma thread: o k-means de uma galeria grande leva segundos e não
+    pode segurar o cadastro. Enquanto isso as buscas usam o índice atual, que
+    continua recebendo as alterações (só com as células desbalanceadas).
+    """
+    global _retrainer
+    if _retrainer is None or not _retrainer.is_alive():
+        _retrainer = threading.Thread(target=_retrain, name="retreino-ivf", daemon=True)
+        _retrainer.start()
+
+def _retrain():
+    global _index
+    antigo = _index
+    if antigo is None:
+        return
+    novo = IVFIndex(antigo.nprobe)
+    versao = db_operations.get_gallery_version()
+    novo.build(db_operations.get_recognition_gallery())
+    with _index_lock, antigo._lock:
+        if _index is not antigo:
+            return # Índice descartado (reset_index) durante o treino
+        atual = db_operations.get_gallery_version()
+        if atual != versao:
+            novo.sync(db_operations.get_recognition_gallery(), atual) # Alterações feitas durante o treino
+        novo.version = atual
+        novo.save()
+        antigo.version = None # Para de gravar no diário, que agora é do novo índice
+        _index = novo
+
+def get_index(nprobe: Optional[int] = None) -> IVFIndex:
+    """Retorna o índice do processo, carregando/construindo e sincronizando se preciso."""
+    global _index
+    with _index_lock:
+        gallery = db_operations.get_recognition_gallery()
+        versao = db_operations.get_gallery_version()
+        if _index is None:
+            _index = IVFIndex.load() or IVFIndex()
+            db_operations.add_change_listener(_on_change)
+            if not os.path.exists(index_path()):
+                _index.build(gallery)
+                _index.version = versao
+                _index.save()
+        if nprobe is not None:
+            _index.nprobe = nprobe
+        if _index.version != versao:
+            _index.sync(gallery, versao)
+        return _index
+
+def reset_index():
+    """Descarta o índice do processo (ex.: após trocar DB_FILE)."""
+    global _index
+    with _index_lock:
+        if _index is not None:
+            db_operations.remove_change_listener(_on_change)
+        _index = None
+
+# --- Relatório de Recall ---
+
+def synthetic_gallery(n: int, seed: int = 0) -> np.ndarray:
+    """
+    Descritores sintéticos com a escala dos vetores do Dlib: pessoas diferentes
+    ficam a ~0.9 de distância e amostras da mesma pessoa bem abaixo de THRESH.
+    """
+    rng = np.random.default_rng(seed)
+    return (rng.standard_normal((n, db_operations.DESCRIPTOR_DIM)) * (0.9 / np.sqrt(2 * db_operations.DESCRIPTOR_DIM))).astype(np.float32)
+
+def recall_report(n_usuarios: int = 20000, n_consultas: int = 1000, ruido: float = 0.4,
+                  nprobes=(1, 2, 4, 8, 16, 32), threshold: float = matcher.THRESH, seed: int = 0) -> List[Dict[str, float]]:
+    """
+    Compara o IVF com a busca exata em uma galeria sintética. As consultas são
+    novas amostras de pessoas cadastradas (distância ~`ruido` do vetor salvo).
+    Para cada nprobe informa o recall@1 e a taxa de falsa rejeição (FRR) em
+    `threshold`, do IVF puro e com o fallback exato, comparada com a FRR da busca exata.
+    """
+    import time
+
+    vetores = synthetic_gallery(n_usuarios, seed)
+    nomes = np.array([f"u{i}" for i in range(n_usuarios)], dtype=object)
+    perfis = np.full(n_usuarios, "Usuário", dtype=object)
+    gallery = db_operations.Gallery(nomes, perfis, vetores, np.einsum("ij,ij->i", vetores, vetores))
+
+    rng = np.random.default_rng(seed + 1)
+    alvo = rng.choice(n_usuarios, n_consultas, replace=False)
+    ruido_vec = rng.standard_normal((n_consultas, vetores.shape[1])).astype(np.float32)
+    ruido_vec *= ruido / np.linalg.norm(ruido_vec, axis=1, keepdims=True)
+    q = vetores[alvo] + ruido_vec
+
+    t0 = time.perf_counter()
+    idx, dist = matcher.nearest(q, gallery, 1)
+    t_exato = (time.perf_counter() - t0) / n_consultas
+    exato = [(nomes[i[0]] if d[0] <= threshold else None) for i, d in zip(idx, dist)]
+    frr_exato = float(np.mean([e != nomes[a] for e, a in zip(exato, alvo)]))
+
+    index = IVFIndex()
+    index.build(gallery)
+    linhas = []
+    for nprobe in nprobes:
+        t0 = time.perf_counter()
+        res = index.search(q, 1, nprobe)
+        t_ivf = (time.perf_counter() - t0) / n_consultas
+        aprox = [(r[0][0] if r and r[0][1] <= threshold else None) for r in res]
+        # Com matcher.IVF_EXACT_FALLBACK, as rejeições do IVF são refeitas na busca exata
+        com_fallback = [a if a is not None else e for a, e in zip(aprox, exato)]
+        linhas.append({
+            "nprobe": nprobe,
+            "nlist": len(index.lists),
+            "recall_at_1": float(np.mean([bool(r) and r[0][0] == nomes[i[0]] for r, i in zip(res, idx)])),
+            "frr_exato": frr_exato,
+            "frr_ivf": float(np.mean([a != nomes[t] for a, t in zip(aprox, alvo)])),
+            "frr_ivf_fallback": float(np.mean([a != nomes[t] for a, t in zip(com_fallback, alvo)])),
+            "taxa_fallback": float(np.mean([a is None for a in aprox])),
+            "decisoes_iguais": float(np.mean([a == e for a, e in zip(com_fallback, exato)])),
+            "ms_por_consulta_exato": t_exato * 1000,
+            "ms_por_consulta_ivf": t_ivf * 1000,
+        })
+    return linhas
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Relatório de recall do índice IVF contra a busca exata.")
+    parser.add_argument("--usuarios", type=int, default=20000)
+    parser.add_argument("--consultas", type=int, default=1000)
+    parser.add_argument("--ruido", type=float, default=0.4, help="Distância entre a consulta e o vetor cadastrado.")
+    args = parser.parse_args()
+
+    print(f"--- IVF vs Exato ({args.usuarios} usuários, {args.consultas} consultas, THRESH={matcher.THRESH}) ---")
+    for linha in recall_report(args.usuarios, args.consultas, args.ruido):
+        print(f"nprobe={linha['nprobe']:>3}/{linha['nlist']} | recall@1={linha['recall_at_1']:.4f} | "
+              f"FRR exato={linha['frr_exato']:.4f} IVF={linha['frr_ivf']:.4f} "
+              f"IVF+fallback={linha['frr_ivf_fallback']:.4f} (fallback em {linha['taxa_fallback']:.1%}) | "
+              f"decisões iguais={linha['decisoes_iguais']:.4f} | "
+              f"{linha['ms_por_consulta_exato']:.3f} ms -> {linha['ms_por_consulta_ivf']:.3f} ms")
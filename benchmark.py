@@ -0,0 +1,332 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+import db_operations # Backends de armazenamento e cache de reconhecimento
+import matcher # Busca exata/IVF
+
+# --- Parâmetros dos Benchmarks ---
+GALLERY_SIZES = (10, 100, 1000, 10000, 100000) # 1_000_000 via --usuarios
+QUERIES = 200 # Frames consultados por tamanho de galeria
+FACES_PER_FRAME = 2
+CRUD_BASE = 10000 # Usuários já cadastrados antes de medir o CRUD
+CRUD_OPS = 50 # Operações medidas por tipo
+QUERY_NOISE = 0.4 # Distância entre a consulta e o vetor cadastrado
+REGRESSION_TOLERANCE = 0.2 # Piora relativa do p95 reportada por compare()
+
+# --- Medidas ---
+
+def latency_stats(amostras_s: Sequence[float]) -> Dict[str, float]:
+    """p50/p95/p99 e média em milissegundos."""
+    if not len(amostras_s):
+        return {"n": 0}
+    ms = np.asarray(amostras_s, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"n": int(len(ms)), "p50_ms": round(float(p50), 4), "p95_ms": round(float(p95), 4),
+            "p99_ms": round(float(p99), 4), "media_ms": round(float(ms.mean()), 4)}
+
+def peak_rss_mb() -> Optional[float]:
+    """Pico de memória residente do processo (MB), ou None se a plataforma não informar."""
+    try:
+        import resource
+    except ImportError: # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return round(psutil.Process().memory_info().peak_wset / 2**20, 1)
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa em KB; macOS em bytes
+    return round(pico / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+def _timed(funcao: Callable[[], Any]) -> float:
+    t0 = time.perf_counter()
+    funcao()
+    return time.perf_counter() - t0
+
+class _TempStore:
+    """DB_FILE temporário com o backend pedido; restaura a configuração ao sair."""
+
+    def __init__(self, backend: str):
+        self.backend = backend
+
+    def __enter__(self):
+        self._dir = tempfile.TemporaryDirectory(prefix="bench_")
+        self._anterior = (db_operations.DB_FILE, db_operations.DB_BACKEND, db_operations.CHANGE_LOG)
+        db_operations.CHANGE_LOG = False # O log de replicação não faz parte do que é medido
+        db_operations.DB_FILE = os.path.join(self._dir.name, "bench.pkl")
+        db_operations.set_backend(self.backend)
+        return self
+
+    def __exit__(self, *exc):
+        db_operations.set_backend(self._anterior[1])
+        db_operations.DB_FILE = self._anterior[0]
+        db_operations.CHANGE_LOG = self._anterior[2]
+        self._dir.cleanup()
+
+    def size_bytes(self) -> int:
+        return sum(os.path.getsize(p) for p in db_operations.get_store_paths() if os.path.exists(p))
+
+def _populate(n: int, seed: int = 0) -> np.ndarray:
+    """Cadastra n usuários sintéticos (u0..u{n-1}) em uma única transação."""
+    import ann_index
+    vetores = ann_index.synthetic_gallery(n, seed)
+    for inicio in range(0, n, 100000): # Lotes limitam a memória de objetos Python
+        fim = min(n, inicio + 100000)
+        db_operations.create_users((f"u{i}", vetores[i], "Usuário") for i in range(inicio, fim))
+    return vetores
+
+def _queries(vetores: np.ndarray, n: int, faces: int, seed: int = 1) -> np.ndarray:
+    """n frames com `faces` consultas cada: metade de cadastrados (com ruído), metade desconhecidos."""
+    import ann_index
+    rng = np.random.default_rng(seed)
+    total = n * faces
+    q = ann_index.synthetic_gallery(total, seed + 1000)
+    conhecidos = rng.random(total) < 0.5
+    alvo = rng.integers(0, len(vetores), total)
+    ruido = rng.standard_normal((total, vetores.shape[1])).astype(np.float32)
+    ruido *= QUERY_NOISE / np.linalg.norm(ruido, axis=1, keepdims=True)
+    q[conhecidos] = vetores[alvo[conhecidos]] + ruido[conhecidos]
+    return q.reshape(n, faces, -1)
+
+# --- Galeria Sintética ---
+
+def gallery_benchmark(sizes: Sequence[int] = GALLERY_SIZES, queries: int = QUERIES, faces: int = FACES_PER_FRAME,
+                      backend: str = "pickle", search: str = "exact") -> List[Dict[str, Any]]:
+    """
+    Para cada tamanho: tempo para popular o DB, carga a frio da galeria
+    (get_recognition_gallery e get_db_for_recognition após invalidar o cache)
+    e latência da busca (matcher.search) por frame. Os tamanhos rodam em ordem
+    crescente, então o pico de RSS de cada linha corresponde ao seu tamanho.
+    """
+    busca_anterior = matcher.SEARCH_BACKEND
+    matcher.set_search_backend(search)
+    linhas = []
+    try:
+        for n in sorted(sizes):
+            with _TempStore(backend) as store:
+                t_pop = _timed(lambda: _populate(n))
+                vetores = db_operations.get_recognition_gallery().vetores.copy()
+                q = _queries(vetores, queries, faces)
+
+                db_operations.invalidate_recognition_cache()
+                t_galeria = _timed(db_operations.get_recognition_gallery)
+                db_operations.invalidate_recognition_cache()
+                t_dict = _timed(db_operations.get_db_for_recognition)
+
+                if search == "ivf":
+                    import ann_index
+                    ann_index.reset_index()
+                    t_indice = _timed(ann_index.get_index)
+                # search(): mede a busca na galeria, sem o cache de resultados do match()
+                matcher.search(q[0]) # Aquecimento (cache e índice já carregados)
+                tempos = [_timed(lambda f=f: matcher.search(f)) for f in q]
+                linha = {
+                    "usuarios": n, "backend": backend, "busca": search, "faces_por_frame": faces,
+                    "popular_s": round(t_pop, 4), "carga_galeria_s": round(t_galeria, 4),
+                    "carga_dict_s": round(t_dict, 4), "match": latency_stats(tempos),
+                    "matches_por_s": round(len(tempos) * faces / sum(tempos), 1),
+                    "disco_mb": round(store.size_bytes() / 2**20, 2), "pico_rss_mb": peak_rss_mb(),
+                }
+                if search == "ivf":
+                    linha["construir_indice_s"] = round(t_indice, 4)
+                    ann_index.reset_index()
+                linhas.append(linha)
+                print(f"[galeria] {n:>8} usuários | match p95 {linha['match']['p95_ms']:.3f} ms | "
+                      f"carga {t_galeria:.3f} s", file=sys.stderr)
+    finally:
+        matcher.set_search_backend(busca_anterior)
+    return linhas
+
+# --- CRUD por Backend ---
+
+def crud_benchmark(backends: Sequence[str] = db_operations.DB_BACKENDS, base: int = CRUD_BASE,
+                   ops: int = CRUD_OPS) -> List[Dict[str, Any]]:
+    """
+    Latência de cada operação CRUD, com `base` usuários já cadastrados, em cada
+    backend; inclui a releitura completa (invalidate + galeria) e a criação em lote.
+    """
+    import ann_index
+    linhas = []
+    for backend in backends:
+        with _TempStore(backend) as store:
+            t_lote = _timed(lambda: _populate(base))
+            db_operations.get_recognition_gallery()
+            novos = ann_index.synthetic_gallery(ops, seed=99)
+            nomes = [f"novo{i}" for i in range(ops)]
+            existentes = [f"u{i}" for i in np.random.default_rng(2).choice(base, ops, replace=False)] if base else nomes
+
+            criar = [_timed(lambda i=i: db_operations.create_user(nomes[i], novos[i], "Usuário")) for i in range(ops)]
+            ler = [_timed(lambda nome=nome: db_operations.read_user(nome)) for nome in existentes]
+            atualizar = [_timed(lambda nome=nome: db_operations.update_user_profile(nome, "Nutricionista"))
+                         for nome in existentes]
+            remover = [_timed(lambda nome=nome: db_operations.delete_user(nome)) for nome in nomes]
+            ler_todos = [_timed(db_operations.read_all_users) for _ in range(min(ops, 5))]
+            recarga = []
+            for _ in range(min(ops, 5)):
+                db_operations.invalidate_recognition_cache()
+                recarga.append(_timed(db_operations.get_recognition_gallery))
+
+            linha = {
+                "backend": backend, "usuarios": base,
+                "criar_lote_s": round(t_lote, 4),
+                "create": latency_stats(criar), "read": latency_stats(ler),
+                "update": latency_stats(atualizar), "delete": latency_stats(remover),
+                "read_all": latency_stats(ler_todos), "recarga_galeria": latency_stats(recarga),
+                "disco_mb": round(store.size_bytes() / 2**20, 2), "pico_rss_mb": peak_rss_mb(),
+            }
+            linhas.append(linha)
+            print(f"[crud] {backend:<7} create p95 {linha['create']['p95_ms']:.3f} ms | "
+                  f"delete p95 {linha['delete']['p95_ms']:.3f} ms", file=sys.stderr)
+    return linhas
+
+# --- Reprodução de Vídeo ---
+
+def _frames(fonte: str, limite: Optional[int]) -> Iterator[np.ndarray]:
+    """Frames BGR de um arquivo de vídeo ou de uma pasta de imagens (ordem alfabética)."""
+    import cv2
+    if os.path.isdir(fonte):
+        from bulk_enroll import IMAGE_EXTS
+        arquivos = sorted(f for f in os.listdir(fonte) if f.lower().endswith(IMAGE_EXTS))
+        for arquivo in arquivos[:limite]:
+            bgr = cv2.imread(os.path.join(fonte, arquivo))
+            if bgr is not None:
+                yield bgr
+        return
+    cap = cv2.VideoCapture(fonte)
+    try:
+        n = 0
+        while limite is None or n < limite:
+            ok, bgr = cap.read()
+            if not ok:
+                break
+            n += 1
+            yield bgr
+    finally:
+        cap.release()
+
+def video_benchmark(fonte: str, frames: Optional[int] = None, scale: Optional[float] = None,
+                    upsample: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Passa um vídeo gravado (ou uma pasta de imagens) por leitura -> RGB ->
+    detecção -> vetor facial -> matching, sem câmera, medindo cada etapa por
+    frame. A galeria é a do DB_FILE/backend configurados.
+    """
+    import recognition
+    detector, sp, rec = recognition.load_models()
+    db_operations.get_recognition_gallery() # Carga fora da medição
+
+    etapas: Dict[str, List[float]] = {"leitura": [], "rgb": [], "deteccao": [], "vetor": [], "match": [], "total": []}
+    faces = 0
+    fonte_frames = _frames(fonte, frames)
+    inicio = time.perf_counter()
+    while True:
+        t0 = time.perf_counter()
+        bgr = next(fonte_frames, None)
+        if bgr is None:
+            break
+        t1 = time.perf_counter()
+        rgb = recognition.to_rgb(bgr)
+        t2 = time.perf_counter()
+        rects = recognition.detect_faces(detector, rgb, upsample, scale)
+        t3 = time.perf_counter()
+        vecs = recognition.embed_faces(sp, rec, rgb, rects)
+        t4 = time.perf_counter()
+        if len(vecs):
+            matcher.match(vecs)
+        t5 = time.perf_counter()
+        faces += len(rects)
+        for etapa, t in zip(etapas, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4, t5 - t0)):
+            etapas[etapa].append(t)
+    duracao = time.perf_counter() - inicio
+    n = len(etapas["total"])
+    return {
+        "fonte": fonte, "frames": n, "faces": faces,
+        "fps": round(n / duracao, 2) if duracao else None,
+        "etapas": {etapa: latency_stats(tempos) for etapa, tempos in etapas.items()},
+        "usuarios_galeria": db_operations.get_recognition_gallery().usuarios,
+        "pico_rss_mb": peak_rss_mb(),
+    }
+
+# --- Relatório ---
+
+def environment() -> Dict[str, Any]:
+    """Identifica a máquina e o commit, para comparar resultados entre versões."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "data": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "numpy": np.__version__, "plataforma": platform.platform(), "cpus": os.cpu_count()}
+
+def _p95s(relatorio: Dict[str, Any]) -> Dict[str, float]:
+    """Achata o relatório em {caminho: p95_ms} (ex.: "galeria/10000/match")."""
+    valores = {}
+    for linha in relatorio.get("galeria", []):
+        valores[f"galeria/{linha['usuarios']}/{linha['busca']}/match"] = linha["match"].get("p95_ms")
+    for linha in relatorio.get("crud", []):
+        for op in ("create", "read", "update", "delete", "read_all", "recarga_galeria"):
+            valores[f"crud/{linha['backend']}/{op}"] = linha[op].get("p95_ms")
+    for etapa, stats in relatorio.get("video", {}).get("etapas", {}).items():
+        valores[f"video/{etapa}"] = stats.get("p95_ms")
+    return {k: v for k, v in valores.items() if v is not None}
+
+def compare(antes: Dict[str, Any], depois: Dict[str, Any], tolerancia: float = REGRESSION_TOLERANCE) -> List[str]:
+    """Medidas cujo p95 piorou mais que `tolerancia` entre dois relatórios."""
+    a, d = _p95s(antes), _p95s(depois)
+    return [f"{k}: {a[k]:.3f} ms -> {d[k]:.3f} ms (+{d[k] / a[k] - 1:.0%})"
+            for k in sorted(a.keys() & d.keys()) if a[k] > 0 and d[k] > a[k] * (1 + tolerancia)]
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmarks de reconhecimento e CRUD sem câmera (saída em JSON).")
+    parser.add_argument("--usuarios", type=int, nargs="*", default=list(GALLERY_SIZES),
+                        help="Tamanhos das galerias sintéticas (ex.: 10 1000 1000000). Vazio pula esta etapa.")
+    parser.add_argument("--consultas", type=int, default=QUERIES, help="Frames consultados por tamanho.")
+    parser.add_argument("--faces", type=int, default=FACES_PER_FRAME, help="Faces por frame.")
+    parser.add_argument("--backend", default="pickle", choices=db_operations.DB_BACKENDS,
+                        help="Backend usado nas galerias sintéticas.")
+    parser.add_argument("--busca", default="exact", choices=matcher.SEARCH_BACKENDS)
+    parser.add_argument("--crud", nargs="*", default=list(db_operations.DB_BACKENDS),
+                        help="Backends do benchmark de CRUD. Vazio pula esta etapa.")
+    parser.add_argument("--crud-base", type=int, default=CRUD_BASE)
+    parser.add_argument("--crud-ops", type=int, default=CRUD_OPS)
+    parser.add_argument("--video", default=None, help="Arquivo de vídeo ou pasta de imagens para reproduzir.")
+    parser.add_argument("--frames", type=int, default=None, help="Limite de frames do vídeo.")
+    parser.add_argument("--escala", type=float, default=None, help="Escala da detecção (padrão: DETECT_SCALE).")
+    parser.add_argument("--upsample", type=int, default=None)
+    parser.add_argument("--saida", default=None, help="Arquivo JSON de saída (padrão: stdout).")
+    parser.add_argument("--comparar", default=None, help="Relatório JSON anterior para apontar regressões do p95.")
+    args = parser.parse_args()
+
+    relatorio: Dict[str, Any] = {"ambiente": environment()}
+    if args.usuarios:
+        relatorio["galeria"] = gallery_benchmark(args.usuarios, args.consultas, args.faces, args.backend, args.busca)
+    if args.crud:
+        relatorio["crud"] = crud_benchmark(args.crud, args.crud_base, args.crud_ops)
+    if args.video:
+        relatorio["video"] = video_benchmark(args.video, args.frames, args.escala, args.upsample)
+    relatorio["pico_rss_mb"] = peak_rss_mb()
+
+    texto = json.dumps(relatorio, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            f.write(texto)
+    else:
+        print(texto)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            regressoes = compare(json.load(f), relatorio)
+        for linha in regressoes:
+            print(f"REGRESSÃO {linha}", file=sys.stderr)
+        if regressoes:
+            raise SystemExit(1)
@@ -0,0 +1,203 @@
+import base64
+import csv
+import json
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import db_operations # Gravação em lote no backend configurado
+import matcher # Combinação das fotos de cada pessoa em um template
+
+# --- Parâmetros do Cadastro em Lote ---
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+DEFAULT_PROFILE = "Usuário"
+CHUNKSIZE = 8 # Imagens por tarefa enviada a cada processo
+
+class Photo(NamedTuple):
+    caminho: str
+    nome: str
+    perfil: str
+
+# --- Entrada ---
+
+def photos_from_dir(pasta: str, perfil: str = DEFAULT_PROFILE) -> Iterator[Photo]:
+    """
+    Percorre `pasta/<nome>.jpg` (uma foto por pessoa) e `pasta/<nome>/*.jpg`
+    (várias fotos, combinadas em um template por matcher.aggregate_templates).
+    """
+    for item in sorted(os.listdir(pasta)):
+        caminho = os.path.join(pasta, item)
+        if os.path.isdir(caminho):
+            for arquivo in sorted(os.listdir(caminho)):
+                if arquivo.lower().endswith(IMAGE_EXTS):
+                    yield Photo(os.path.join(caminho, arquivo), item, perfil)
+        elif item.lower().endswith(IMAGE_EXTS):
+            yield Photo(caminho, os.path.splitext(item)[0], perfil)
+
+def photos_from_csv(arquivo: str, perfil: str = DEFAULT_PROFILE) -> Iterator[Photo]:
+    """CSV com as colunas `caminho,nome[,perfil]`; caminhos relativos partem da pasta do CSV."""
+    base = os.path.dirname(os.path.abspath(arquivo))
+    with open(arquivo, newline="", encoding="utf-8") as f:
+        for linha in csv.DictReader(f):
+            yield Photo(os.path.join(base, linha["caminho"]), linha["nome"].strip(),
+                        (linha.get("perfil") or perfil).strip())
+
+# --- Lado do Processo de Trabalho ---
+
+_worker_models = None
+_worker_error: Optional[str] = None
+
+def _init_worker(predictor: str, recog: str):
+    # Uma exceção no initializer encerra o processo e o Pool cria outro, em
+    # ciclo, sem nunca devolver erro: a falha fica guardada e sai na 1ª tarefa
+    global _worker_models, _worker_error
+    try:
+        import recognition
+        _worker_models = recognition.load_models(predictor, recog)
+    except Exception as e:
+        _worker_error = f"{type(e).__name__}: {e}"
+
+def _embed_photo(foto: Photo) -> Tuple[Photo, Optional[np.ndarray], Optional[str]]:
+    """Retorna (foto, vetor, None) ou (foto, None, motivo da rejeição)."""
+    if _worker_models is None:
+        raise RuntimeError(f"Modelos do Dlib não carregados no processo de trabalho ({_worker_error}).")
+    import cv2
+    import recognition
+    detector, sp, rec = _worker_models
+    # cv2.imread não abre caminhos com acentos no Windows: o arquivo é lido pelo Python
+    try:
+        bgr = cv2.imdecode(np.fromfile(foto.caminho, dtype=np.uint8), cv2.IMREAD_COLOR)
+    except (OSError, cv2.error): # Arquivo sumiu ou está vazio
+        bgr = None
+    if bgr is None:
+        return foto, None, "imagem ilegível"
+    rgb = recognition.to_rgb(bgr)
+    rects = recognition.detect_faces(detector, rgb)
+    if len(rects) == 0:
+        return foto, None, "nenhuma face"
+    if len(rects) > 1:
+        return foto, None, f"várias faces ({len(rects)})"
+    return foto, recognition.embed_faces(sp, rec, rgb, rects)[0], None
+
+# --- Progresso Retomável ---
+# Cada imagem processada vira uma linha JSON no arquivo de progresso (com o
+# vetor em base64). Ao repetir o comando, as imagens já registradas são puladas.
+
+def _load_progress(caminho: str) -> Dict[str, dict]:
+    feitos = {}
+    if os.path.exists(caminho):
+        with open(caminho, encoding="utf-8") as f:
+            for linha in f:
+                try:
+                    registro = json.loads(linha)
+                except json.JSONDecodeError:
+                    break # Última linha truncada por uma interrupção
+                feitos[registro["caminho"]] = registro
+    return feitos
+
+def _progress_record(foto: Photo, vec: Optional[np.ndarray], motivo: Optional[str]) -> dict:
+    return {
+        "caminho": foto.caminho, "nome": foto.nome, "perfil": foto.perfil, "motivo": motivo,
+        "vetor": base64.b64encode(vec.astype(np.float32).tobytes()).decode("ascii") if vec is not None else None,
+    }
+
+def _decode(registro: dict) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(registro["vetor"]), dtype=np.float32)
+
+# --- Cadastro ---
+
+def bulk_enroll(fotos: List[Photo], progress_path: str, report_path: str, workers: Optional[int] = None,
+                predictor: Optional[str] = None, recog: Optional[str] = None) -> Dict[str, int]:
+    """
+    Detecta e calcula os vetores das fotos em um pool de processos e grava
+    todos os novos usuários em uma única transação do backend. Imagens sem
+    face, com várias faces ou de perfil inválido vão para o relatório CSV.
+    """
+    import recognition
+
+    perfis_validos = set(db_operations.get_available_profiles().values())
+    feitos = _load_progress(progress_path)
+    pendentes = [f for f in fotos if f.caminho not in feitos]
+    inicio = time.monotonic()
+
+    with open(progress_path, "a", encoding="utf-8") as progresso:
+        def registrar(foto, vec, motivo):
+            registro = _progress_record(foto, vec, motivo)
+            feitos[foto.caminho] = registro
+            progresso.write(json.dumps(registro, ensure_ascii=False) + "\n")
+
+        validas = []
+        for foto in pendentes:
+            # Erros da entrada não vão para o progresso: corrigido o CSV, a foto é processada
+            if not foto.nome:
+                feitos[foto.caminho] = _progress_record(foto, None, "nome vazio")
+            elif foto.perfil not in perfis_validos:
+                feitos[foto.caminho] = _progress_record(foto, None, f"perfil inválido ('{foto.perfil}')")
+            else:
+                validas.append(foto)
+
+        if validas:
+            # "spawn": o Dlib não é seguro após fork e este é o padrão no Windows
+            with mp.get_context("spawn").Pool(workers or os.cpu_count() or 1, initializer=_init_worker,
+                                              initargs=(predictor or recognition.PREDICTOR,
+                                                        recog or recognition.RECOG)) as pool:
+                for i, (foto, vec, motivo) in enumerate(pool.imap_unordered(_embed_photo, validas, CHUNKSIZE), 1):
+                    registrar(foto, vec, motivo)
+                    if i % 100 == 0 or i == len(validas):
+                        progresso.flush()
+                        taxa = i / (time.monotonic() - inicio)
+                        print(f"\r{i}/{len(validas)} imagens ({taxa:.1f}/s)", end="", flush=True)
+                print()
+
+    # As fotos aceitas de cada pessoa viram um único template (média ou conjunto)
+    amostras: Dict[str, List[np.ndarray]] = {}
+    perfis: Dict[str, str] = {}
+    for foto in fotos:
+        registro = feitos.get(foto.caminho)
+        if registro and registro["vetor"]:
+            amostras.setdefault(foto.nome, []).append(_decode(registro))
+            perfis.setdefault(foto.nome, foto.perfil)
+    escolhidas = [(nome, matcher.aggregate_templates(np.stack(vecs)), perfis[nome]) for nome, vecs in amostras.items()]
+    criados = db_operations.create_users(escolhidas)
+
+    rejeitados = [r for r in (feitos.get(f.caminho) for f in fotos) if r and r["motivo"]]
+    with open(report_path, "w", newline="", encoding="utf-8") as f:
+        escritor = csv.writer(f)
+        escritor.writerow(["caminho", "nome", "motivo"])
+        for r in rejeitados:
+            escritor.writerow([r["caminho"], r["nome"], r["motivo"]])
+
+    return {
+        "imagens": len(fotos),
+        "processadas_agora": len(pendentes),
+        "rejeitadas": len(rejeitados),
+        "cadastrados": len(criados),
+        "ja_existentes": len(escolhidas) - len(criados),
+        "segundos": round(time.monotonic() - inicio, 1),
+    }
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Cadastro em lote a partir de uma pasta de fotos ou de um CSV.")
+    parser.add_argument("entrada", help="Pasta (<nome>.jpg ou <nome>/*.jpg) ou CSV (caminho,nome[,perfil]).")
+    parser.add_argument("--perfil", default=DEFAULT_PROFILE, help="Perfil de quem não tem um no CSV.")
+    parser.add_argument("--workers", type=int, default=None, help="Número de processos (padrão: núcleos da CPU).")
+    parser.add_argument("--progresso", default=None, help="Arquivo de progresso (padrão: <entrada>.progresso.jsonl).")
+    parser.add_argument("--relatorio", default=None, help="CSV das imagens rejeitadas (padrão: <entrada>.rejeitados.csv).")
+    args = parser.parse_args()
+
+    base = args.entrada.rstrip("/\\")
+    if os.path.isdir(args.entrada):
+        fotos = list(photos_from_dir(args.entrada, args.perfil))
+    else:
+        fotos = list(photos_from_csv(args.entrada, args.perfil))
+        base = os.path.splitext(base)[0]
+
+    resumo = bulk_enroll(fotos, args.progresso or base + ".progresso.jsonl",
+                         args.relatorio or base + ".rejeitados.csv", args.workers)
+    print("--- Cadastro em lote ---")
+    for chave, valor in resumo.items():
+        print(f"{chave}: {valor}")
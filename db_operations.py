@@ -1,8 +1,22 @@
+import base64
+import bisect
+import contextlib
+import json
 import pickle
 import os
-from typing import Dict, Any, Optional
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from typing import Dict, Any, Optional, NamedTuple, Callable, Iterator, List, Sequence, Tuple
+
+import numpy as np
 
 DB_FILE = "db.pkl"
+DESCRIPTOR_DIM = 128 # Dimensão do vetor facial gerado pelo ResNet do Dlib
+MAX_TEMPLATES = 5 # Máximo de vetores (templates) guardados por usuário
+PAGE_SIZE = 100 # Usuários por página na listagem (list_users)
 
 def _load_db() -> Dict[str, Any]:
     """Carrega o banco de dados (dicionário) do arquivo pickle."""
@@ -20,46 +34,687 @@ def _save_db(db: Dict[str, Any]):
     with open(DB_FILE, "wb") as f:
         pickle.dump(db, f)
 
+def _store_signature() -> Optional[tuple]:
+    """Assinatura do armazenamento atual; muda quando outro processo o altera."""
+    return _get_backend().signature()
+
+def _as_descriptor(vetor: Any) -> Optional[np.ndarray]:
+    """Converte o vetor para float32 (128,), ou None se não for um descritor válido."""
+    try:
+        vec = np.asarray(vetor, dtype=np.float32).reshape(-1)
+    except (TypeError, ValueError):
+        return None
+    if vec.shape[0] != DESCRIPTOR_DIM:
+        return None
+    return vec
+
+def _as_templates(vetor: Any) -> Optional[np.ndarray]:
+    """
+    Converte o vetor de um usuário para float32 (T, 128): um único descritor
+    (128,) ou um conjunto de até MAX_TEMPLATES. None se não for válido.
+    """
+    try:
+        vecs = np.asarray(vetor, dtype=np.float32)
+    except (TypeError, ValueError):
+        return None
+    if vecs.ndim == 1:
+        vecs = vecs[np.newaxis, :]
+    if vecs.ndim != 2 or vecs.shape[1] != DESCRIPTOR_DIM or not 1 <= vecs.shape[0] <= MAX_TEMPLATES:
+        return None
+    return vecs
+
+# --- Backends de Armazenamento ---
+# "pickle": dicionário inteiro em DB_FILE (padrão, formato original).
+# "mmap":   descritores em arquivo float32 mapeado em memória + log de metadados
+#           append-only (embedding_store.py). Migra o DB_FILE existente na 1ª abertura.
+# "sqlite": banco SQLite em modo WAL (sqlite_store.py), para vários processos/quiosques
+#           compartilhando o mesmo arquivo. Também migra o DB_FILE na 1ª abertura.
+
+DB_BACKENDS = ("pickle", "mmap", "sqlite")
+DB_BACKEND = os.environ.get("DB_BACKEND", "pickle")
+
+def _page_sorted(nomes: List[str], perfil_de: Callable[[str], Optional[str]], after: Optional[str],
+                 limit: int, prefix: str, perfil: Optional[str]) -> List[Tuple[str, Optional[str]]]:
+    """Página de (nome, perfil) a partir de uma lista de nomes em ordem (busca binária pelo cursor/prefixo)."""
+    inicio = bisect.bisect_right(nomes, after) if after is not None else 0
+    if prefix:
+        inicio = max(inicio, bisect.bisect_left(nomes, prefix))
+    itens = []
+    for i in range(inicio, len(nomes)): # Por índice: nomes[inicio:] copiaria o resto da lista a cada página
+        nome = nomes[i]
+        if prefix and not nome.startswith(prefix):
+            break
+        p = perfil_de(nome)
+        if perfil is not None and p != perfil:
+            continue
+        itens.append((nome, p))
+        if len(itens) == limit:
+            break
+    return itens
+
+class _PickleBackend:
+    """Backend original: o dicionário completo é relido e regravado a cada operação."""
+
+    def __init__(self):
+        self._meta = None # (assinatura, nomes em ordem, perfis) para a listagem paginada
+        self.last_write: Optional[Tuple[Any, Any]] = None # Assinaturas logo antes e logo depois da última escrita
+
+    def _save(self, db: Dict[str, Any], antes: Optional[tuple]):
+        _save_db(db)
+        self.last_write = (antes, self.signature())
+
+    def signature(self) -> Optional[tuple]:
+        """Retorna (mtime, tamanho) do arquivo do DB, ou None se ele não existir."""
+        try:
+            st = os.stat(DB_FILE)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def load(self) -> Dict[str, Any]:
+        return _load_db()
+
+    def get(self, nome: str) -> Optional[Dict[str, Any]]:
+        return _load_db().get(nome)
+
+    def create(self, nome: str, vetor: Any, perfil: str) -> bool:
+        antes = self.signature()
+        db = _load_db()
+        if nome in db:
+            return False
+        db[nome] = {"vetor": vetor, "perfil": perfil}
+        self._save(db, antes)
+        return True
+
+    def create_many(self, itens) -> List[str]:
+        """Cadastra vários usuários com uma única leitura e gravação do arquivo."""
+        antes = self.signature()
+        db = _load_db()
+        criados = []
+        for nome, vetor, perfil in itens:
+            if nome not in db:
+                db[nome] = {"vetor": vetor, "perfil": perfil}
+                criados.append(nome)
+        if criados:
+            self._save(db, antes)
+        return criados
+
+    def update_profile(self, nome: str, perfil: str) -> bool:
+        antes = self.signature()
+        db = _load_db()
+        if nome not in db:
+            return False
+        # Manter o vetor de reconhecimento facial original
+        db[nome]["perfil"] = perfil
+        self._save(db, antes)
+        return True
+
+    def delete(self, nome: str) -> bool:
+        antes = self.signature()
+        db = _load_db()
+        if nome not in db:
+            return False
+        del db[nome]
+        self._save(db, antes)
+        return True
+
+    def list_page(self, after: Optional[str], limit: int, prefix: str = "",
+                  perfil: Optional[str] = None) -> List[Tuple[str, Optional[str]]]:
+        """
+        Página da listagem por nome. O pickle só pode ser lido inteiro: os
+        nomes e perfis são guardados em ordem e só relidos quando o arquivo muda.
+        """
+        signature = self.signature()
+        if self._meta is None or self._meta[0] != signature:
+            db = _load_db()
+            self._meta = (signature, sorted(db), {nome: dados.get("perfil") for nome, dados in db.items()})
+        _, nomes, perfis = self._meta
+        return _page_sorted(nomes, perfis.get, after, limit, prefix, perfil)
+
+    def gallery_arrays(self):
+        """
+        (nomes, perfis, vetores (N, 128) float32) dos usuários com descritor
+        válido, uma linha por template (o nome se repete nas linhas do mesmo usuário).
+        """
+        nomes, perfis, vetores = [], [], []
+        for nome, dados in _load_db().items():
+            vecs = _as_templates(dados.get("vetor"))
+            if vecs is not None:
+                nomes += [nome] * len(vecs)
+                perfis += [dados.get("perfil")] * len(vecs)
+                vetores.append(vecs)
+        if not vetores:
+            return nomes, perfis, np.empty((0, DESCRIPTOR_DIM), dtype=np.float32)
+        return nomes, perfis, np.concatenate(vetores)
+
+    def paths(self) -> List[str]:
+        return [DB_FILE]
+
+    def close(self):
+        pass
+
+_backend = None
+_backend_lock = threading.Lock()
+_write_lock = threading.RLock() # Escrita no backend + atualização do cache, sem outra escrita do processo no meio
+
+def _open_backend(nome: str):
+    if nome == "pickle":
+        return _PickleBackend()
+    if nome == "mmap":
+        import embedding_store # Importado sob demanda: só é necessário neste backend
+        return embedding_store.EmbeddingStore(os.path.splitext(DB_FILE)[0], migrate_from=DB_FILE)
+    if nome == "sqlite":
+        import sqlite_store # Importado sob demanda: só é necessário neste backend
+        return sqlite_store.SQLiteStore(os.path.splitext(DB_FILE)[0] + ".sqlite3", migrate_from=DB_FILE)
+    raise ValueError(f"Backend desconhecido: {nome!r}. Use um de {DB_BACKENDS}.")
+
+def _get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _open_backend(DB_BACKEND)
+    return _backend
+
+def set_backend(nome: str):
+    """Troca o backend de armazenamento usado pelas funções CRUD deste módulo."""
+    global DB_BACKEND, _backend
+    if nome not in DB_BACKENDS:
+        raise ValueError(f"Backend desconhecido: {nome!r}. Use um de {DB_BACKENDS}.")
+    with _backend_lock:
+        if _backend is not None:
+            _backend.close()
+        DB_BACKEND = nome
+        _backend = None
+    _recognition_cache.invalidate()
+
+def get_store_paths() -> List[str]:
+    """Arquivos em disco usados pelo backend atual, incluindo o log de alterações."""
+    return _get_backend().paths() + [change_log_path(), change_log_path() + ".lock"]
+
+# --- Cache de Reconhecimento ---
+
+class Gallery(NamedTuple):
+    """
+    Galeria de reconhecimento: arrays paralelos, uma linha por template. Um
+    usuário com vários templates ocupa várias linhas com o mesmo dono.
+    """
+    nomes: np.ndarray    # (N,) object
+    perfis: np.ndarray   # (N,) object
+    vetores: np.ndarray  # (N, DESCRIPTOR_DIM) float32 contíguo
+    normas2: np.ndarray  # (N,) float32, ||vetor||^2 (usado pelo matcher)
+    donos: Optional[np.ndarray] = None # (N,) int64, ID do usuário de cada linha
+    usuarios: int = -1   # Número de usuários (== N quando todos têm um único template)
+
+def _spill_matrix(linhas: int) -> np.ndarray:
+    """
+    Matriz float32 (linhas, DESCRIPTOR_DIM) em um arquivo temporário mapeado,
+    ao lado do DB (a pasta temporária pode ser um tmpfs, que fica na memória).
+    O arquivo some ao ser fechado; o sistema lê do disco só as páginas acessadas.
+    """
+    arquivo = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(DB_FILE)), prefix="galeria-")
+    return np.memmap(arquivo, dtype=np.float32, mode="w+", shape=(max(linhas, 1), DESCRIPTOR_DIM))[:linhas]
+
+class _RecognitionCache:
+    """
+    Cache do processo com todos os descritores em uma matriz float32 contígua.
+    É atualizado incrementalmente pelas operações CRUD deste módulo e recarregado
+    do disco quando o arquivo do DB é alterado por outro processo (mtime).
+
+    Com `spill` (galeria compacta, ver set_gallery_spill), a matriz float32 não
+    fica na memória: é o próprio arquivo do backend "mmap" ou uma cópia em um
+    arquivo temporário mapeado (_spill_matrix).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.reloads = 0 # Releituras completas do disco e tempo total gasto nelas
+        self.reload_seconds = 0.0
+        self.spill = False
+        self.invalidate()
+
+    def _new_matrix(self, linhas: int) -> np.ndarray:
+        return _spill_matrix(linhas) if self.spill else np.empty((linhas, DESCRIPTOR_DIM), dtype=np.float32)
+
+    def invalidate(self):
+        """Descarta o cache; a próxima consulta recarrega do disco."""
+        with self._lock:
+            self._loaded = False
+            self._signature = None
+            self._n = 0
+            self._index: Dict[str, List[int]] = {} # nome -> linhas dos templates
+            self._owner_ids: Dict[str, int] = {}
+            self._next_owner = 0
+            self._donos = np.empty(0, dtype=np.int64)
+            self._nomes = np.empty(0, dtype=object)
+            self._perfis = np.empty(0, dtype=object)
+            self._vetores = np.empty((0, DESCRIPTOR_DIM), dtype=np.float32)
+            self._normas2 = np.empty(0, dtype=np.float32)
+            self._shared = False # Há uma Gallery exportada apontando para os buffers atuais
+            self.version = getattr(self, "version", 0) + 1
+            self._db_dict = None
+
+    def _reload(self):
+        inicio = time.perf_counter()
+        backend = _get_backend()
+        signature = backend.signature()
+        nomes, perfis, vetores = backend.gallery_arrays()
+        self.invalidate()
+        # A matriz do backend é adotada sem cópia (no backend "mmap" é o próprio
+        # arquivo mapeado); só é copiada quando precisar crescer ou ser alterada.
+        n = len(nomes)
+        self._nomes = np.empty(n, dtype=object)
+        self._nomes[:] = nomes
+        self._perfis = np.empty(n, dtype=object)
+        self._perfis[:] = perfis
+        if self.spill and not isinstance(vetores, np.memmap):
+            copia = _spill_matrix(n)
+            copia[:] = vetores
+            vetores = copia
+        self._vetores = vetores
+        self._normas2 = np.einsum("ij,ij->i", vetores, vetores)
+        self._donos = np.empty(n, dtype=np.int64)
+        for i, nome in enumerate(nomes):
+            self._index.setdefault(nome, []).append(i)
+            self._donos[i] = self._owner_id(nome)
+        self._n = n
+        self._signature = signature
+        self._loaded = True
+        self.reloads += 1
+        self.reload_seconds += time.perf_counter() - inicio
+
+    def _owner_id(self, nome: str) -> int:
+        dono = self._owner_ids.get(nome)
+        if dono is None:
+            dono = self._owner_ids[nome] = self._next_owner
+            self._next_owner += 1
+        return dono
+
+    def _reserve(self, capacidade: int):
+        """Garante espaço para `capacidade` linhas, crescendo geometricamente."""
+        if capacidade <= self._vetores.shape[0] and self._vetores.flags.writeable and not self._shared:
+            return
+        atual = self._vetores.shape[0]
+        # Só cresce se faltar espaço; buffers compartilhados ou só leitura são copiados no mesmo tamanho
+        nova = max(capacidade, 2 * atual, 16) if capacidade > atual else atual
+        vetores = self._new_matrix(nova)
+        normas2 = np.empty(nova, dtype=np.float32)
+        donos = np.empty(nova, dtype=np.int64)
+        nomes = np.empty(nova, dtype=object)
+        perfis = np.empty(nova, dtype=object)
+        n = self._n
+        vetores[:n] = self._vetores[:n]
+        normas2[:n] = self._normas2[:n]
+        donos[:n] = self._donos[:n]
+        nomes[:n] = self._nomes[:n]
+        perfis[:n] = self._perfis[:n]
+        self._vetores, self._normas2, self._donos, self._nomes, self._perfis = vetores, normas2, donos, nomes, perfis
+        self._shared = False
+
+    def _append(self, nome: str, vetor: Any, perfil: Optional[str]):
+        vecs = _as_templates(vetor)
+        if vecs is None or nome in self._index:
+            return
+        t = len(vecs)
+        if self._n + t > self._vetores.shape[0]:
+            self._reserve(self._n + t)
+        i = self._n
+        self._vetores[i:i + t] = vecs
+        self._normas2[i:i + t] = np.einsum("ij,ij->i", vecs, vecs)
+        self._donos[i:i + t] = self._owner_id(nome)
+        self._nomes[i:i + t] = nome
+        self._perfis[i:i + t] = perfil
+        self._index[nome] = list(range(i, i + t))
+        self._n += t
+
+    def _is_current(self) -> bool:
+        return self._loaded and self._signature == _store_signature()
+
+    def _after_write(self, escrita: Optional[Tuple[Any, Any]]) -> bool:
+        """
+        Verifica se o cache pode ser atualizado incrementalmente após uma escrita
+        deste processo. `escrita` traz as assinaturas registradas pelo backend
+        logo antes e logo depois da gravação (backend.last_write). O cache só é
+        atualizado no lugar se refletia exatamente o estado anterior à escrita e
+        se a assinatura atual ainda é a que ela deixou. Se outro processo gravou
+        antes ou depois, a próxima consulta recarrega tudo.
+        """
+        antes, depois = escrita or (None, None)
+        self.version += 1 # A galeria mudou mesmo sem cache carregado (ex.: busca no host de modelos)
+        if not self._loaded or antes is None or self._signature != antes or _store_signature() != depois:
+            self._loaded = False
+            return False
+        self._signature = depois
+        self._db_dict = None
+        return True
+
+    def on_create(self, escrita, nome: str, vetor: Any, perfil: str):
+        with self._lock:
+            if self._after_write(escrita):
+                self._append(nome, vetor, perfil)
+
+    def on_create_many(self, escrita, itens):
+        with self._lock:
+            if self._after_write(escrita):
+                validos = [_as_templates(vetor) for _, vetor, _ in itens]
+                self._reserve(self._n + sum(len(v) for v in validos if v is not None))
+                for nome, vetor, perfil in itens:
+                    self._append(nome, vetor, perfil)
+
+    def on_update_profile(self, escrita, nome: str, perfil: str):
+        with self._lock:
+            if self._after_write(escrita):
+                for i in self._index.get(nome, ()):
+                    self._perfis[i] = perfil
+
+    def on_delete(self, escrita, nome: str):
+        with self._lock:
+            if not self._after_write(escrita):
+                return
+            linhas = self._index.pop(nome, None)
+            if linhas is None:
+                return
+            self._owner_ids.pop(nome, None)
+            if self._shared:
+                # Não altera buffers que um consumidor ainda pode estar lendo
+                self._reserve(self._vetores.shape[0])
+            # Da maior linha para a menor: a última linha nunca é um template
+            # ainda não removido deste usuário (a não ser a própria linha i)
+            for i in sorted(linhas, reverse=True):
+                last = self._n - 1
+                if i != last:
+                    # Remove em O(1) movendo a última linha para a posição liberada
+                    self._vetores[i] = self._vetores[last]
+                    self._normas2[i] = self._normas2[last]
+                    self._donos[i] = self._donos[last]
+                    self._nomes[i] = self._nomes[last]
+                    self._perfis[i] = self._perfis[last]
+                    movidas = self._index[self._nomes[i]]
+                    movidas[movidas.index(last)] = i
+                self._nomes[last] = None
+                self._perfis[last] = None
+                self._n = last
+
+    def gallery(self) -> Gallery:
+        """Retorna a galeria atual, recarregando do disco apenas se necessário."""
+        with self._lock:
+            if not self._is_current():
+                self._reload()
+            self._shared = True
+            n = self._n
+            return Gallery(self._nomes[:n], self._perfis[:n], self._vetores[:n], self._normas2[:n],
+                           self._donos[:n], len(self._index))
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Visão em dicionário {nome: {"vetor", "perfil"}} montada a partir da galeria."""
+        with self._lock:
+            g = self.gallery()
+            if self._db_dict is None:
+                self._db_dict = {
+                    nome: {"vetor": g.vetores[linhas[0]] if len(linhas) == 1 else g.vetores[linhas],
+                           "perfil": g.perfis[linhas[0]]}
+                    for nome, linhas in self._index.items()
+                }
+            return self._db_dict
+
+_recognition_cache = _RecognitionCache()
+
+# --- Notificação de Alterações ---
+# Módulos que mantêm estruturas derivadas da galeria (ex.: índice ANN) registram
+# aqui uma função chamada após cada escrita feita por este processo. Ela recebe a
+# lista de alterações da escrita: [(operacao, nome, vetor, perfil)], com operacao
+# em {"create", "update", "delete"}. Uma escrita em lote gera uma única chamada.
+
+Change = Tuple[str, str, Any, Optional[str]]
+_change_listeners: List[Callable[[List[Change]], None]] = []
+
+def add_change_listener(listener: Callable[[List[Change]], None]):
+    """Registra uma função para ser avisada das alterações no DB."""
+    if listener not in _change_listeners:
+        _change_listeners.append(listener)
+
+def remove_change_listener(listener: Callable[[List[Change]], None]):
+    """Remove uma função registrada com add_change_listener."""
+    if listener in _change_listeners:
+        _change_listeners.remove(listener)
+
+def _notify(alteracoes: List[Change]):
+    _change_log.record(alteracoes)
+    for listener in list(_change_listeners):
+        listener(alteracoes)
+
+# --- Log de Alterações (Replicação entre Quiosques) ---
+# Cada escrita deste processo é registrada, com um número de sequência crescente,
+# em <DB>.changes.jsonl. Outro quiosque lê só os registros depois da última
+# sequência que já aplicou (replication.py) e os aplica com apply_changes(), que
+# atualiza a galeria em memória incrementalmente, sem recarregar o DB.
+
+CHANGE_LOG = os.environ.get("RECOG_CHANGELOG", "1") == "1"
+SITE_ID = os.environ.get("RECOG_SITE") or socket.gethostname() # Identifica a origem dos registros
+
+def change_log_path() -> str:
+    return os.path.splitext(DB_FILE)[0] + ".changes.jsonl"
+
+def _vector_array(vetor: Any) -> np.ndarray:
+    """Vetor como float32; chamado antes de gravar, para o log nunca falhar depois da escrita no DB."""
+    try:
+        return np.asarray(vetor, dtype=np.float32)
+    except (TypeError, ValueError):
+        raise ValueError("Vetor facial inválido.") from None
+
+def encode_vector(vetor: Any) -> Tuple[str, List[int]]:
+    """Vetor float32 em base64 e a sua forma, ex.: [128] ou [T, 128] (4x menor que a lista de números em JSON)."""
+    vecs = np.ascontiguousarray(_vector_array(vetor), dtype="<f4")
+    return base64.b64encode(vecs.tobytes()).decode("ascii"), list(vecs.shape)
+
+def decode_vector(texto: str, forma: Sequence[int]) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(texto), dtype="<f4").astype(np.float32).reshape(forma)
+
+def _last_sequence(path: str) -> int:
+    """Sequência do último registro completo do log (0 se ele não existir)."""
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            tamanho = f.tell()
+            f.seek(max(0, tamanho - 65536))
+            linhas = f.read().splitlines()
+    except OSError:
+        return 0
+    for linha in reversed(linhas):
+        try:
+            return int(json.loads(linha)["seq"])
+        except (ValueError, KeyError):
+            continue # Linha incompleta (escrita interrompida) ou cortada pelo seek
+    return 0
+
+@contextlib.contextmanager
+def _file_lock(path: str):
+    """
+    Trava exclusiva entre processos (ex.: GUI e console gravando ao mesmo tempo)
+    sobre um arquivo auxiliar `path`: fcntl.flock no Linux, msvcrt.locking no Windows.
+    """
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt # Só existe no Windows
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1) # Tenta por ~10 s antes de levantar OSError
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl # Só existe em sistemas POSIX
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+class _ChangeLog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local() # Origem dos registros sendo aplicados por apply_changes()
+
+    def record(self, alteracoes: List[Change]):
+        if not CHANGE_LOG or getattr(self._local, "silencioso", False):
+            return
+        path = change_log_path()
+        origens = getattr(self._local, "origens", None) or {}
+        # A trava do arquivo vale entre processos: a última sequência é relida e
+        # a próxima gravada sem que outro processo escreva no meio
+        with self._lock, _file_lock(path + ".lock"):
+            seq = _last_sequence(path)
+            linhas = []
+            for operacao, nome, vetor, perfil in alteracoes:
+                seq += 1
+                origem, origem_seq = origens.get(nome, (SITE_ID, seq))
+                registro = {"seq": seq, "op": operacao, "nome": nome, "perfil": perfil, "ts": round(time.time(), 3),
+                            "origem": origem, "origem_seq": origem_seq}
+                if operacao == "create":
+                    registro["vetor"], registro["forma"] = encode_vector(vetor)
+                linhas.append(json.dumps(registro, ensure_ascii=False).encode("utf-8") + b"\n")
+            with open(path, "ab") as f:
+                f.write(b"".join(linhas))
+
+_change_log = _ChangeLog()
+
+def last_change_sequence() -> int:
+    """Sequência do último registro do log deste DB."""
+    return _last_sequence(change_log_path())
+
+def apply_changes(registros: List[Dict[str, Any]]) -> int:
+    """
+    Aplica registros do log de outro quiosque com as funções CRUD deste
+    módulo (galeria em memória atualizada incrementalmente). Cadastros
+    seguidos são gravados em lote, com uma única escrita no DB. Os registros
+    são repassados ao log local com a origem preservada, para que este
+    quiosque também possa servir de fonte para outros. Um cadastro de um nome
+    que já existe substitui o usuário. Retorna quantos registros alteraram o DB.
+    """
+    local = _change_log._local
+    aplicados = 0
+    i = 0
+    while i < len(registros):
+        fim = i + 1
+        if registros[i]["op"] == "create":
+            nomes = {registros[i]["nome"]}
+            while fim < len(registros) and registros[fim]["op"] == "create" and registros[fim]["nome"] not in nomes:
+                nomes.add(registros[fim]["nome"])
+                fim += 1
+        lote = registros[i:fim]
+        local.origens = {r["nome"]: (r["origem"], r["origem_seq"]) for r in lote}
+        try:
+            op = lote[0]["op"]
+            if op == "create":
+                _recognition_cache.gallery()
+                existentes = [r["nome"] for r in lote if r["nome"] in _recognition_cache._index]
+                local.silencioso = True # A substituição é registrada como um único create
+                try:
+                    for nome in existentes:
+                        delete_user(nome)
+                finally:
+                    local.silencioso = False
+                aplicados += len(create_users([(r["nome"], decode_vector(r["vetor"], r["forma"]),
+                                                r.get("perfil")) for r in lote]))
+            elif op == "update":
+                aplicados += update_user_profile(lote[0]["nome"], lote[0]["perfil"])
+            elif op == "delete":
+                aplicados += delete_user(lote[0]["nome"])
+            else:
+                raise ValueError(f"Operação desconhecida no log: {op!r}")
+        finally:
+            local.origens = None
+        i = fim
+    return aplicados
+
 # --- CRUD Operations ---
 
 def create_user(nome: str, vetor: Any, perfil: str) -> bool:
     """
-    CREATE: Adiciona um novo usuário ao banco de dados.
+    CREATE: Adiciona um novo usuário ao banco de dados. `vetor` é um descritor
+    (128,) ou um conjunto de templates (T, 128), com T <= MAX_TEMPLATES.
     Retorna True se o usuário foi criado, False se já existia.
     """
-    db = _load_db()
-    if nome in db:
-        return False
-    
-    db[nome] = {"vetor": vetor, "perfil": perfil}
-    _save_db(db)
+    _vector_array(vetor)
+    backend = _get_backend()
+    with _write_lock:
+        if not backend.create(nome, vetor, perfil):
+            return False
+        _recognition_cache.on_create(backend.last_write, nome, vetor, perfil)
+    _notify([("create", nome, vetor, perfil)])
     return True
 
+def create_users(itens) -> List[str]:
+    """
+    CREATE (Lote): Cadastra vários usuários [(nome, vetor, perfil)] em uma única
+    gravação/transação do backend. Retorna os nomes criados (os já existentes são ignorados).
+    """
+    itens = list(itens)
+    for _, vetor, _ in itens:
+        _vector_array(vetor)
+    backend = _get_backend()
+    with _write_lock:
+        criados = set(backend.create_many(itens))
+        if not criados:
+            return []
+        novos = [item for item in itens if item[0] in criados]
+        _recognition_cache.on_create_many(backend.last_write, novos)
+    _notify([("create", nome, vetor, perfil) for nome, vetor, perfil in novos])
+    return [item[0] for item in novos]
+
 def read_user(nome: str) -> Optional[Dict[str, Any]]:
     """
     READ (Individual): Retorna os dados de um usuário específico.
     """
-    db = _load_db()
-    return db.get(nome)
+    return _get_backend().get(nome)
 
 def read_all_users() -> Dict[str, Any]:
     """
     READ (All): Retorna todos os usuários no banco de dados.
     """
-    return _load_db()
+    return _get_backend().load()
+
+class UserPage(NamedTuple):
+    itens: List[Tuple[str, Optional[str]]] # (nome, perfil), em ordem de nome
+    cursor: Optional[str] # Passar em `after` para a próxima página; None quando não há mais
+
+def list_users(after: Optional[str] = None, limit: int = PAGE_SIZE, prefix: str = "",
+               perfil: Optional[str] = None) -> UserPage:
+    """
+    READ (Paginado): uma página de nomes e perfis, sem carregar os vetores
+    faciais. Filtra por prefixo do nome e por perfil; `after` é o cursor
+    retornado pela página anterior (o último nome dela).
+    """
+    itens = _get_backend().list_page(after, limit, prefix, perfil)
+    return UserPage(itens, itens[-1][0] if len(itens) == limit else None)
+
+def iter_users(prefix: str = "", perfil: Optional[str] = None, page_size: int = PAGE_SIZE) -> Iterator[Tuple[str, Optional[str]]]:
+    """Percorre todos os (nome, perfil) página a página (ex.: exportação sem montar o DB em memória)."""
+    cursor = None
+    while True:
+        pagina = list_users(cursor, page_size, prefix, perfil)
+        yield from pagina.itens
+        if pagina.cursor is None:
+            return
+        cursor = pagina.cursor
 
 def update_user_profile(nome: str, novo_perfil: str) -> bool:
     """
     UPDATE: Atualiza apenas o perfil de usuário (Nutricionista/Usuário) de um usuário existente.
     Retorna True se o usuário foi atualizado, False se não foi encontrado.
     """
-    db = _load_db()
-    if nome not in db:
-        return False
-    
-    # Manter o vetor de reconhecimento facial original
-    db[nome]["perfil"] = novo_perfil
-    _save_db(db)
+    backend = _get_backend()
+    with _write_lock:
+        if not backend.update_profile(nome, novo_perfil):
+            return False
+        _recognition_cache.on_update_profile(backend.last_write, nome, novo_perfil)
+    _notify([("update", nome, None, novo_perfil)])
     return True
 
 def delete_user(nome: str) -> bool:
@@ -67,18 +722,50 @@ def delete_user(nome: str) -> bool:
     DELETE: Remove um usuário do banco de dados.
     Retorna True se o usuário foi removido, False se não foi encontrado.
     """
-    db = _load_db()
-    if nome in db:
-        del db[nome]
-        _save_db(db)
-        return True
-    return False
+    backend = _get_backend()
+    with _write_lock:
+        if not backend.delete(nome):
+            return False
+        _recognition_cache.on_delete(backend.last_write, nome)
+    _notify([("delete", nome, None, None)])
+    return True
 
 # Funções auxiliares para o código principal
 
 def get_db_for_recognition() -> Dict[str, Any]:
-    """Retorna o DB para uso no loop de reconhecimento facial."""
-    return _load_db()
+    """
+    Retorna o DB para uso no loop de reconhecimento facial.
+    Servido pelo cache em memória: o arquivo só é relido quando muda no disco.
+    """
+    return _recognition_cache.as_dict()
+
+def get_recognition_gallery() -> Gallery:
+    """Retorna a galeria (nomes, perfis e matriz float32 de descritores) do cache."""
+    return _recognition_cache.gallery()
+
+def set_gallery_spill(ligado: bool):
+    """
+    Liga ou desliga a matriz float32 da galeria fora da memória do processo
+    (arquivo mapeado). Usado com a galeria compacta (matcher.set_compact), que
+    só lê as linhas float32 dos candidatos reavaliados.
+    """
+    with _recognition_cache._lock:
+        if _recognition_cache.spill != ligado:
+            _recognition_cache.spill = ligado
+            _recognition_cache.invalidate()
+
+def get_gallery_version() -> int:
+    """Número que muda sempre que o conteúdo da galeria de reconhecimento muda."""
+    return _recognition_cache.version
+
+def get_cache_stats() -> Dict[str, float]:
+    """Releituras completas da galeria (ex.: DB alterado por outro processo) e o tempo gasto nelas."""
+    return {"db_recargas": _recognition_cache.reloads,
+            "db_recarga_segundos": round(_recognition_cache.reload_seconds, 4)}
+
+def invalidate_recognition_cache():
+    """Força a releitura do DB na próxima consulta de reconhecimento."""
+    _recognition_cache.invalidate()
 
 def get_available_profiles() -> Dict[str, str]:
     """Retorna os tipos de usuário disponíveis (Nutricionista/Usuário)."""
@@ -93,44 +780,56 @@ def get_profile_messages() -> Dict[str, str]:
     }
 
 if __name__ == '__main__':
-    # Exemplo de uso para demonstração
-    print("--- Teste CRUD ---")
-    
-    # 1. CREATE (Simulado)
-    print("\n1. CREATE (Adicionar 'Teste1')")
-    # Usando um vetor de exemplo (apenas para teste)
-    vetor_exemplo = [0.1, 0.2, 0.3] 
-    if create_user("Teste1", vetor_exemplo, "Usuário"):
-        print("Usuário Teste1 criado com sucesso.")
-    
-    # 2. READ ALL
-    print("\n2. READ ALL (Usuários Atuais)")
-    users = read_all_users()
-    for name, data in users.items():
-        print(f" - {name}: {data['perfil']}")
-        
-    # 3. UPDATE
-    print("\n3. UPDATE (Mudar perfil de 'Teste1' para 'Nutricionista')")
-    if update_user_profile("Teste1", "Nutricionista"):
-        print("Perfil de Teste1 atualizado.")
-        user_data = read_user("Teste1")
-        if user_data:
-            print("Novo perfil:", user_data["perfil"])
-        
-    # 4. DELETE
-    print("\n4. DELETE (Remover 'Teste1')")
-    if delete_user("Teste1"):
-        print("Usuário Teste1 removido.")
-        
-    # 5. READ ALL (Verificação)
-    print("\n5. READ ALL (Verificação após DELETE)")
-    users = read_all_users()
-    if "Teste1" not in users:
-        print("Teste1 não está mais no DB.")
-    else:
-        print("Erro: Teste1 ainda está no DB.")
-    
-    # Limpar o arquivo de teste para não poluir o ambiente real
-    if os.path.exists(DB_FILE):
-        os.remove(DB_FILE)
-        print(f"\nArquivo {DB_FILE} limpo.")
\ No newline at end of file
+    # Exemplo de uso para demonstração, uma vez com cada backend, em uma pasta
+    # temporária para não alterar o DB real
+    for backend in DB_BACKENDS:
+        print(f"\n=== Backend: {backend} ===")
+        pasta = tempfile.mkdtemp(prefix="recog-teste-")
+        DB_FILE = os.path.join(pasta, "db.pkl")
+        set_backend(backend)
+
+        print("--- Teste CRUD ---")
+
+        # 1. CREATE (Simulado)
+        print("\n1. CREATE (Adicionar 'Teste1')")
+        # Usando um vetor aleatório com a dimensão de um descritor real (apenas para teste)
+        vetor_exemplo = np.random.rand(DESCRIPTOR_DIM)
+        if create_user("Teste1", vetor_exemplo, "Usuário"):
+            print("Usuário Teste1 criado com sucesso.")
+
+        # 2. READ ALL
+        print("\n2. READ ALL (Usuários Atuais)")
+        users = read_all_users()
+        for name, data in users.items():
+            print(f" - {name}: {data['perfil']}")
+
+        # 3. UPDATE
+        print("\n3. UPDATE (Mudar perfil de 'Teste1' para 'Nutricionista')")
+        if update_user_profile("Teste1", "Nutricionista"):
+            print("Perfil de Teste1 atualizado.")
+            user_data = read_user("Teste1")
+            if user_data:
+                print("Novo perfil:", user_data["perfil"])
+
+        # 4. DELETE
+        print("\n4. DELETE (Remover 'Teste1')")
+        if delete_user("Teste1"):
+            print("Usuário Teste1 removido.")
+
+        # 5. READ ALL (Verificação)
+        print("\n5. READ ALL (Verificação após DELETE)")
+        users = read_all_users()
+        if "Teste1" not in users:
+            print("Teste1 não está mais no DB.")
+        else:
+            print("Erro: Teste1 ainda está no DB.")
+
+        # Limpar os arquivos de teste (o backend é fechado antes: no Windows,
+        # arquivos mapeados ou abertos não podem ser removidos)
+        paths = get_store_paths()
+        set_backend(backend)
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+                print(f"\nArquivo {path} limpo.")
+        shutil.rmtree(pasta, ignore_errors=True)
@@ -0,0 +1,427 @@
+import json
+import os
+import pickle
+import threading
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import db_operations # DESCRIPTOR_DIM e validação dos vetores
+
+# --- Formato em Disco ---
+# <base>.store       -> número da geração atual (trocado atomicamente na compactação)
+# <base>.<g>.vec     -> descritores float32 de largura fixa, uma linha por template
+# <base>.<g>.log     -> log JSON append-only: create (nome, perfil, primeira linha e
+#                       número de templates), update, delete
+ROW_BYTES = db_operations.DESCRIPTOR_DIM * np.dtype(np.float32).itemsize
+COMPACT_DEAD_RATIO = 0.25 # Compacta quando 25% das linhas são de usuários excluídos
+COMPACT_MIN_DEAD = 1024
+SYNC_WRITES = True # fsync a cada escrita (seguro contra queda de energia)
+
+def _fsync(f):
+    f.flush()
+    if SYNC_WRITES:
+        os.fsync(f.fileno())
+
+class EmbeddingStore:
+    """
+    Backend "mmap" de db_operations. Cada cadastro acrescenta uma linha ao
+    arquivo de vetores e um registro ao log (O(1) de E/S); exclusões são
+    marcações no log. A galeria é mapeada em memória sem desserialização.
+    Suporta um único processo escritor; leitores em outros processos
+    acompanham o log incrementalmente.
+    """
+
+    def __init__(self, base: str, migrate_from: Optional[str] = None):
+        self.base = base
+        self._lock = threading.RLock()
+        self._compactor: Optional[threading.Thread] = None
+        self._compact_lock = threading.Lock() # Uma compactação por vez (a cópia roda sem o _lock)
+        self.last_write: Optional[Tuple[Any, Any]] = None # Assinaturas logo antes e logo depois da última escrita
+        self._sorted: Optional[Tuple[Tuple[int, int], List[str]]] = None # Nomes em ordem, para list_page
+        if not os.path.exists(self._pointer_path()):
+            if migrate_from and os.path.exists(migrate_from):
+                migrate_from_pickle(migrate_from, base)
+            else:
+                self._write_pointer(1)
+        self._open()
+
+    # --- Arquivos ---
+
+    def _pointer_path(self) -> str:
+        return self.base + ".store"
+
+    def _vec_path(self, gen: Optional[int] = None) -> str:
+        return f"{self.base}.{gen or self._gen}.vec"
+
+    def _log_path(self, gen: Optional[int] = None) -> str:
+        return f"{self.base}.{gen or self._gen}.log"
+
+    def _read_pointer(self) -> int:
+        with open(self._pointer_path()) as f:
+            return int(f.read().strip())
+
+    def _write_pointer(self, gen: int):
+        for path in (self._vec_path(gen), self._log_path(gen)):
+            open(path, "ab").close()
+        tmp = self._pointer_path() + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(gen))
+            _fsync(f)
+        os.replace(tmp, self._pointer_path())
+
+    def paths(self) -> List[str]:
+        return [self._pointer_path(), self._vec_path(), self._log_path()]
+
+    # --- Leitura do Log ---
+
+    def _open(self):
+        """Lê a geração atual do zero."""
+        self._gen = self._read_pointer()
+        self._live: Dict[str, List[Any]] = {} # nome -> [primeira linha, perfil, templates]
+        self._live_rows = 0
+        self._log_offset = 0
+        # Descarta uma linha parcial deixada por uma escrita interrompida
+        tamanho = os.path.getsize(self._vec_path())
+        if tamanho % ROW_BYTES:
+            with open(self._vec_path(), "r+b") as f:
+                f.truncate(tamanho - tamanho % ROW_BYTES)
+        self._replay()
+        self._clean_old_generations()
+
+    def _replay(self):
+        """Aplica os registros do log a partir do último offset lido."""
+        with open(self._log_path(), "rb") as f:
+            f.seek(self._log_offset)
+            dados = f.read()
+        fim = dados.rfind(b"\n") + 1 # Ignora um último registro incompleto
+        for linha in dados[:fim].splitlines():
+            self._apply(json.loads(linha))
+        self._log_offset += fim
+        self._rows = os.path.getsize(self._vec_path()) // ROW_BYTES
+
+    def _apply(self, registro: Dict[str, Any]):
+        op, nome = registro["op"], registro["nome"]
+        if op == "create":
+            self._live[nome] = [registro["row"], registro["perfil"], registro.get("rows", 1)]
+            self._live_rows += self._live[nome][2]
+        elif op == "update" and nome in self._live:
+            self._live[nome][1] = registro["perfil"]
+        elif op == "delete" and nome in self._live:
+            self._live_rows -= self._live.pop(nome)[2]
+
+    def _clean_old_generations(self):
+        """Remove arquivos de gerações anteriores que não puderam ser apagados antes."""
+        pasta = os.path.dirname(self.base) or "."
+        prefixo = os.path.basename(self.base) + "."
+        atuais = {os.path.basename(p) for p in self.paths()}
+        for arquivo in os.listdir(pasta):
+            if arquivo.startswith(prefixo) and arquivo.endswith((".vec", ".log")) and arquivo not in atuais:
+                meio = arquivo[len(prefixo):-4]
+                if meio.isdigit() and int(meio) < self._gen:
+                    try:
+                        os.remove(os.path.join(pasta, arquivo))
+                    except OSError:
+                        pass # Ainda mapeado por outro processo (Windows)
+
+    def refresh(self):
+        """Acompanha alterações feitas por outros processos (log novo ou compactação)."""
+        with self._lock:
+            if self._read_pointer() != self._gen:
+                self._open()
+            elif os.path.getsize(self._log_path()) != self._log_offset:
+                self._replay()
+
+    def signature(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self._pointer_path())
+            return (st.st_mtime_ns, os.path.getsize(self._log_path()))
+        except OSError:
+            return None
+
+    # --- Escrita ---
+
+    def _append_log(self, registros: List[Dict[str, Any]]):
+        with open(self._log_path(), "ab") as f:
+            f.write(b"".join(json.dumps(r, ensure_ascii=False).encode("utf-8") + b"\n" for r in registros))
+            _fsync(f)
+            self._log_offset = f.tell()
+
+    def create_many(self, itens: Iterable[Tuple[str, Any, str]]) -> List[str]:
+        """
+        Cadastra vários usuários com uma escrita no arquivo de vetores e uma no log.
+        Retorna os nomes efetivamente criados (nomes repetidos são ignorados).
+        """
+        with self._lock:
+            antes = self.signature() # Antes do refresh: registros de outro processo também contam
+            self.refresh()
+            criados = self._create_many(itens)
+            if criados:
+                self.last_write = (antes, self.signature())
+            return criados
+
+    def _create_many(self, itens: Iterable[Tuple[str, Any, str]]) -> List[str]:
+        with self._lock:
+            nomes, perfis, vetores = [], [], []
+            novos = set()
+            for nome, vetor, perfil in itens:
+                if nome in self._live or nome in novos:
+                    continue
+                vecs = db_operations._as_templates(vetor)
+                if vecs is None:
+                    raise ValueError(f"Vetor facial inválido para '{nome}': são esperados 1 a {db_operations.MAX_TEMPLATES} "
+                                     f"vetores de {db_operations.DESCRIPTOR_DIM} valores.")
+                novos.add(nome)
+                nomes.append(nome)
+                perfis.append(perfil)
+                vetores.append(vecs)
+            if not nomes:
+                return []
+
+            # Os vetores são gravados antes do log: uma queda no meio deixa apenas
+            # linhas órfãs, nunca um registro apontando para um vetor incompleto.
+            with open(self._vec_path(), "ab") as f:
+                f.seek(0, os.SEEK_END)
+                primeira = f.tell() // ROW_BYTES
+                f.write(np.concatenate(vetores).tobytes())
+                _fsync(f)
+            registros = []
+            linha = primeira
+            for nome, perfil, vecs in zip(nomes, perfis, vetores):
+                registro = {"op": "create", "nome": nome, "perfil": perfil, "row": linha}
+                if len(vecs) > 1:
+                    registro["rows"] = len(vecs)
+                registros.append(registro)
+                linha += len(vecs)
+            self._append_log(registros)
+            for registro in registros:
+                self._apply(registro)
+            self._rows = linha
+            return nomes
+
+    def create(self, nome: str, vetor: Any, perfil: str) -> bool:
+        return bool(self.create_many([(nome, vetor, perfil)]))
+
+    def update_profile(self, nome: str, perfil: str) -> bool:
+        with self._lock:
+            antes = self.signature()
+            self.refresh()
+            if nome not in self._live:
+                return False
+            registro = {"op": "update", "nome": nome, "perfil": perfil}
+            self._append_log([registro])
+            self._apply(registro)
+            self.last_write = (antes, self.signature())
+            return True
+
+    def delete(self, nome: str) -> bool:
+        with self._lock:
+            antes = self.signature()
+            self.refresh()
+            if nome not in self._live:
+                return False
+            registro = {"op": "delete", "nome": nome}
+            self._append_log([registro])
+            self._apply(registro)
+            self.last_write = (antes, self.signature())
+            self._maybe_compact()
+            return True
+
+    # --- Consultas ---
+
+    def _vectors(self, modo: str = "r") -> np.ndarray:
+        """Arquivo de vetores inteiro mapeado em memória, (linhas, 128) float32."""
+        if self._rows == 0:
+            return np.empty((0, db_operations.DESCRIPTOR_DIM), dtype=np.float32)
+        return np.memmap(self._vec_path(), dtype=np.float32, mode=modo,
+                         shape=(self._rows, db_operations.DESCRIPTOR_DIM))
+
+    def get(self, nome: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self.refresh()
+            entrada = self._live.get(nome)
+            if entrada is None:
+                return None
+            linha, perfil, t = entrada
+            vetor = np.fromfile(self._vec_path(), dtype=np.float32,
+                                count=t * db_operations.DESCRIPTOR_DIM, offset=linha * ROW_BYTES)
+            if t > 1:
+                vetor = vetor.reshape(t, db_operations.DESCRIPTOR_DIM)
+            return {"vetor": vetor, "perfil": perfil}
+
+    def load(self) -> Dict[str, Any]:
+        with self._lock:
+            self.refresh()
+            vetores = self._vectors()
+            return {nome: {"vetor": vetores[linha] if t == 1 else vetores[linha:linha + t], "perfil": perfil}
+                    for nome, (linha, perfil, t) in self._live.items()}
+
+    def list_page(self, after: Optional[str], limit: int, prefix: str = "",
+                  perfil: Optional[str] = None) -> List[Tuple[str, Optional[str]]]:
+        """Página da listagem por nome, direto do índice do log (o arquivo de vetores não é lido)."""
+        with self._lock:
+            self.refresh()
+            chave = (self._gen, self._log_offset)
+            if self._sorted is None or self._sorted[0] != chave:
+                self._sorted = (chave, sorted(self._live))
+            return db_operations._page_sorted(self._sorted[1], lambda nome: self._live[nome][1],
+                                              after, limit, prefix, perfil)
+
+    def _live_row_indices(self, itens) -> np.ndarray:
+        """Linhas de todos os templates dos usuários vivos, na ordem de `itens`."""
+        linhas = np.empty(self._live_rows, dtype=np.int64)
+        pos = 0
+        for _, (linha, _, t) in itens:
+            linhas[pos:pos + t] = np.arange(linha, linha + t)
+            pos += t
+        return linhas
+
+    def gallery_arrays(self):
+        """
+        (nomes, perfis, vetores) em ordem de linha. Sem exclusões pendentes de
+        compactação, `vetores` é o próprio arquivo mapeado (copy-on-write), sem cópia.
+        """
+        with self._lock:
+            self.refresh()
+            itens = sorted(self._live.items(), key=lambda item: item[1][0])
+            nomes = [nome for nome, entrada in itens for _ in range(entrada[2])]
+            perfis = [entrada[1] for _, entrada in itens for _ in range(entrada[2])]
+            linhas = self._live_row_indices(itens)
+            vetores = self._vectors("c")
+            if len(linhas) == self._rows and np.array_equal(linhas, np.arange(self._rows)):
+                return nomes, perfis, vetores
+            return nomes, perfis, np.ascontiguousarray(vetores[linhas])
+
+    # --- Compactação ---
+
+    def dead_rows(self) -> int:
+        return self._rows - self._live_rows
+
+    def _maybe_compact(self):
+        mortas = self.dead_rows()
+        if mortas >= max(COMPACT_MIN_DEAD, COMPACT_DEAD_RATIO * self._rows):
+            if self._compactor is None or not self._compactor.is_alive():
+                self._compactor = threading.Thread(target=self.compact, daemon=True)
+                self._compactor.start()
+
+    def compact(self):
+        """
+        Reescreve só os usuários vivos em uma nova geração e troca o ponteiro
+        atomicamente. A cópia é feita de um retrato do índice, sem o lock: as
+        linhas já gravadas nunca mudam, e cadastros, exclusões e leituras
+        continuam na geração atual. O lock só é tomado no fim, para repassar à
+        nova geração o que o log recebeu durante a cópia e trocar o ponteiro.
+        """
+        with self._compact_lock:
+            with self._lock:
+                self.refresh()
+                gen, offset = self._gen, self._log_offset
+                antigos = [self._vec_path(), self._log_path()]
+                # Cópia das entradas: update_profile altera a lista do índice no lugar
+                itens = [(nome, tuple(entrada)) for nome, entrada in sorted(self._live.items(), key=lambda item: item[1][0])]
+                linhas = self._live_row_indices(itens)
+                vetores = self._vectors()
+            nova = gen + 1
+            novos = [self._vec_path(nova), self._log_path(nova)]
+
+            with open(novos[0], "wb") as f:
+                for inicio in range(0, len(linhas), 65536): # Copia em blocos para limitar a memória
+                    f.write(np.ascontiguousarray(vetores[linhas[inicio:inicio + 65536]]).tobytes())
+                _fsync(f)
+            del vetores
+            indice: Dict[str, List[Any]] = {} # Índice da nova geração (evita reler o log sob o lock)
+            with open(novos[1], "wb") as f:
+                linha = 0
+                for nome, (_, perfil, t) in itens:
+                    registro = {"op": "create", "nome": nome, "perfil": perfil, "row": linha}
+                    if t > 1:
+                        registro["rows"] = t
+                    f.write(json.dumps(registro, ensure_ascii=False).encode("utf-8") + b"\n")
+                    indice[nome] = [linha, perfil, t]
+                    linha += t
+                _fsync(f)
+
+            with self._lock:
+                self.refresh()
+                if self._gen != gen: # Outro processo compactou antes
+                    for path in novos:
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+                    return
+                # Registros gravados durante a cópia: os cadastros ganham linhas no fim do novo arquivo
+                with open(self._log_path(), "rb") as f:
+                    f.seek(offset)
+                    cauda = [json.loads(l) for l in f.read(self._log_offset - offset).splitlines()]
+                if cauda:
+                    vetores = self._vectors()
+                    with open(novos[0], "ab") as f:
+                        for registro in cauda:
+                            if registro["op"] == "create":
+                                t = registro.get("rows", 1)
+                                f.write(np.ascontiguousarray(vetores[registro["row"]:registro["row"] + t]).tobytes())
+                                registro["row"] = linha
+                                linha += t
+                        _fsync(f)
+                    del vetores
+                    with open(novos[1], "ab") as f:
+                        f.write(b"".join(json.dumps(r, ensure_ascii=False).encode("utf-8") + b"\n" for r in cauda))
+                        _fsync(f)
+                self._write_pointer(nova)
+                self._gen = nova
+                self._live, self._live_rows = indice, len(linhas)
+                for registro in cauda:
+                    self._apply(registro)
+                self._rows = linha
+                self._log_offset = os.path.getsize(self._log_path())
+            for path in antigos:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass # Removido depois por _clean_old_generations
+
+    def close(self):
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+def migrate_from_pickle(pkl_path: str, base: str) -> int:
+    """
+    Migração única de um db.pkl para o formato append-only. O arquivo pickle
+    original não é alterado. Retorna o número de usuários migrados.
+    """
+    try:
+        with open(pkl_path, "rb") as f:
+            db = pickle.load(f)
+    except EOFError:
+        db = {}
+
+    store = EmbeddingStore.__new__(EmbeddingStore)
+    store.base = base
+    store._lock = threading.RLock()
+    store._compactor = None
+    store._compact_lock = threading.Lock()
+    store.last_write = None
+    gen = 1
+    if os.path.exists(store._pointer_path()):
+        gen = store._read_pointer() + 1
+    # A nova geração só passa a valer quando o ponteiro é gravado, no fim
+    for path in (store._vec_path(gen), store._log_path(gen)):
+        open(path, "wb").close()
+    store._gen = gen
+    store._live = {}
+    store._live_rows = 0
+    store._log_offset = 0
+    store._rows = 0
+
+    validos, invalidos = [], []
+    for nome, dados in db.items():
+        if db_operations._as_templates(dados.get("vetor")) is None:
+            invalidos.append(nome)
+        else:
+            validos.append((nome, dados["vetor"], dados.get("perfil")))
+    if invalidos:
+        print(f"Aviso: {len(invalidos)} usuário(s) sem vetor facial válido não foram migrados: {', '.join(invalidos)}")
+    store._create_many(validos)
+    store._write_pointer(gen)
+    return len(validos)
@@ -0,0 +1,182 @@
+import os
+import threading
+import cv2
+import numpy as np
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+# --- Parâmetros da Qualidade ---
+QUALITY_GATE = os.environ.get("RECOG_QUALITY", "1") == "1" # RECOG_QUALITY=0 calcula o vetor de todas as faces
+MIN_FACE_PX = int(os.environ.get("RECOG_MIN_FACE", "0")) # Menor lado (px) do retângulo da face; 0 = sem limite (como antes do filtro)
+FULL_SCORE_PX = 120 # Lado (px) a partir do qual o tamanho não reduz a pontuação do frame
+MIN_SHARPNESS = float(os.environ.get("RECOG_MIN_SHARPNESS", "25")) # Variância do Laplaciano no recorte reduzido
+MAX_YAW = float(os.environ.get("RECOG_MAX_YAW", "0.35")) # Desvio do nariz em relação ao meio dos olhos (fração da distância entre eles)
+SHARPNESS_SIZE = 64 # Lado do recorte em tons de cinza usado na nitidez (independe da distância da câmera)
+
+class FaceQuality(NamedTuple):
+    lado: int # Menor lado do retângulo (px)
+    nitidez: float # Variância do Laplaciano
+    desvio: Optional[float] # Rotação lateral estimada pelos 5 pontos (0 = de frente); None se não avaliada
+    motivo: Optional[str] # "tamanho", "nitidez", "pose" ou None se aprovada
+
+    @property
+    def ok(self) -> bool:
+        return self.motivo is None
+
+    @property
+    def pontuacao(self) -> float:
+        """Nota em [0, 1] para escolher o melhor frame: nitidez, tamanho e frontalidade."""
+        if not self.ok:
+            return 0.0
+        nitidez = self.nitidez / (self.nitidez + 4 * MIN_SHARPNESS) # Sem saturar: entre frames nítidos, o mais nítido
+        tamanho = min(1.0, self.lado / FULL_SCORE_PX)
+        frontal = 1.0 - 0.5 * min(1.0, abs(self.desvio or 0.0) / MAX_YAW)
+        return nitidez * tamanho * frontal
+
+def sharpness(rgb: np.ndarray, rect: Any) -> float:
+    """
+    Variância do Laplaciano da região da face, reduzida para SHARPNESS_SIZE px:
+    borrão de movimento ou foco tira as bordas finas e derruba o valor. Só o
+    recorte é convertido, não o frame inteiro.
+    """
+    altura, largura = rgb.shape[:2]
+    top, bottom = max(0, rect.top()), min(altura, rect.bottom())
+    left, right = max(0, rect.left()), min(largura, rect.right())
+    if bottom - top < 2 or right - left < 2:
+        return 0.0
+    gray = cv2.cvtColor(rgb[top:bottom, left:right], cv2.COLOR_RGB2GRAY)
+    gray = cv2.resize(gray, (SHARPNESS_SIZE, SHARPNESS_SIZE), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(gray, cv2.CV_32F).var())
+
+def yaw(shape: Any) -> float:
+    """
+    Rotação lateral pelos 5 pontos do preditor (cantos dos olhos 0-3 e base do
+    nariz 4): deslocamento do nariz, ao longo da linha dos olhos, em relação ao
+    meio deles, em frações da distância entre os olhos. A inclinação (roll) não
+    entra: o alinhamento do get_face_chip já a corrige.
+    """
+    p = np.array([(shape.part(i).x, shape.part(i).y) for i in range(5)], dtype=np.float32)
+    olho_a, olho_b = (p[0] + p[1]) / 2, (p[2] + p[3]) / 2
+    eixo = olho_b - olho_a
+    distancia = float(np.hypot(*eixo))
+    if distancia == 0:
+        return float("inf")
+    return float(np.dot(p[4] - (olho_a + olho_b) / 2, eixo) / distancia ** 2)
+
+class QualityGate:
+    """
+    Filtro barato antes do vetor facial: faces pequenas ou borradas são
+    descartadas antes do preditor de pontos, e faces muito de lado logo depois
+    dele (os pontos são reaproveitados pelo get_face_chip). Só as aprovadas
+    passam pela ResNet; `stats` informa quantos vetores foram evitados.
+    """
+
+    def __init__(self, min_lado: int = MIN_FACE_PX, min_nitidez: float = MIN_SHARPNESS, max_desvio: float = MAX_YAW):
+        self.min_lado = min_lado
+        self.min_nitidez = min_nitidez
+        self.max_desvio = max_desvio
+        self._lock = threading.Lock()
+        self.avaliadas = 0
+        self.rejeitadas = {"tamanho": 0, "nitidez": 0, "pose": 0}
+
+    def assess(self, sp: Any, rgb: np.ndarray, rect: Any) -> Tuple[FaceQuality, Any]:
+        """(qualidade, pontos do preditor) de uma face; os pontos são None se ela foi reprovada antes do preditor."""
+        lado = min(rect.width(), rect.height())
+        if lado < self.min_lado:
+            return FaceQuality(lado, 0.0, None, "tamanho"), None
+        nitidez = sharpness(rgb, rect)
+        if nitidez < self.min_nitidez:
+            return FaceQuality(lado, nitidez, None, "nitidez"), None
+        shape = sp(rgb, rect)
+        desvio = yaw(shape)
+        return FaceQuality(lado, nitidez, desvio, "pose" if abs(desvio) > self.max_desvio else None), shape
+
+    def filter(self, sp: Any, rgb: np.ndarray, rects: List) -> Tuple[List, List, List]:
+        """
+        Separa as faces de um frame. Retorna (retângulos aprovados, pontos das
+        aprovadas, retângulos reprovados); os pontos vão para
+        recognition.embed_many, que não roda o preditor de novo.
+        """
+        aprovados, shapes, reprovados = [], [], []
+        contagem: Dict[str, int] = {}
+        for r in rects:
+            qualidade, shape = self.assess(sp, rgb, r)
+            if qualidade.ok:
+                aprovados.append(r)
+                shapes.append(shape)
+            else:
+                reprovados.append(r)
+                contagem[qualidade.motivo] = contagem.get(qualidade.motivo, 0) + 1
+        with self._lock:
+            self.avaliadas += len(rects)
+            for motivo, n in contagem.items():
+                self.rejeitadas[motivo] += n
+        return aprovados, shapes, reprovados
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            evitados = sum(self.rejeitadas.values())
+            linha = {"faces_avaliadas": self.avaliadas, "vetores_evitados": evitados}
+            linha.update({f"baixa_{motivo}": n for motivo, n in self.rejeitadas.items()})
+        return linha
+
+def from_env() -> Optional[QualityGate]:
+    """Filtro com os limites de RECOG_MIN_FACE/RECOG_MIN_SHARPNESS/RECOG_MAX_YAW, ou None com RECOG_QUALITY=0."""
+    return QualityGate() if QUALITY_GATE else None
+
+# --- Verificação ---
+
+def gate_check(seed: int = 0) -> Dict[str, Any]:
+    """
+    Confere o filtro em faces sintéticas (textura com 5 pontos): uma boa, uma
+    pequena, uma borrada e uma de lado. Só a boa deve passar, e a pontuação
+    deve preferir a versão nítida à levemente suavizada.
+    """
+    import dlib
+
+    class _Ponto(NamedTuple):
+        x: int
+        y: int
+
+    class _Pontos:
+        def __init__(self, pontos):
+            self._pontos = pontos
+
+        def part(self, i):
+            return self._pontos[i]
+
+    rng = np.random.default_rng(seed)
+    textura = rng.integers(0, 256, (200, 200), dtype=np.uint8)
+    rgb = np.zeros((240, 900, 3), dtype=np.uint8)
+    rgb[20:220, 20:220] = cv2.GaussianBlur(textura, (0, 0), 2.0)[..., None] # Boa / de lado
+    rgb[20:220, 240:440] = cv2.GaussianBlur(textura, (0, 0), 5.0)[..., None] # Borrada
+    rgb[20:60, 460:500] = cv2.GaussianBlur(textura, (0, 0), 2.0)[:40, :40, None] # Pequena
+    rgb[20:220, 680:880] = cv2.GaussianBlur(textura, (0, 0), 2.5)[..., None] # Levemente suavizada
+
+    rects = {"boa": dlib.rectangle(20, 20, 220, 220), "borrada": dlib.rectangle(240, 20, 440, 220),
+             "pequena": dlib.rectangle(460, 20, 500, 60), "suavizada": dlib.rectangle(680, 20, 880, 220)}
+    de_lado = dlib.rectangle(21, 21, 219, 219) # Mesma região da boa, com o nariz deslocado
+
+    def sp(img, r):
+        cx, cy, w = (r.left() + r.right()) // 2, (r.top() + r.bottom()) // 2, r.width()
+        nariz_dx = w // 4 if r.left() == de_lado.left() else 0
+        return _Pontos([_Ponto(cx - w // 4, cy - w // 8), _Ponto(cx - w // 8, cy - w // 8), _Ponto(cx + w // 4, cy - w // 8),
+                        _Ponto(cx + w // 8, cy - w // 8), _Ponto(cx + nariz_dx, cy + w // 4)])
+
+    gate = QualityGate(min_lado=60) # O limite de tamanho vem desligado por padrão
+    aprovados, _, _ = gate.filter(sp, rgb, list(rects.values()) + [de_lado])
+    qualidade = {nome: gate.assess(sp, rgb, r)[0] for nome, r in rects.items()}
+    qualidade["de_lado"] = gate.assess(sp, rgb, de_lado)[0]
+    return {
+        "motivos": {nome: q.motivo for nome, q in qualidade.items()},
+        "aprovados": len(aprovados),
+        "prefere_nitida": qualidade["boa"].pontuacao > qualidade["suavizada"].pontuacao,
+        "stats": gate.stats(),
+    }
+
+if __name__ == "__main__":
+    r = gate_check()
+    print(f"Motivos: {r['motivos']} | contadores: {r['stats']}")
+    esperado = {"boa": None, "borrada": "nitidez", "pequena": "tamanho", "de_lado": "pose"}
+    if any(r["motivos"][nome] != motivo for nome, motivo in esperado.items()) or not r["prefere_nitida"]:
+        raise SystemExit("FALHA")
+    print("OK: só a face boa passa, e a mais nítida tem a maior pontuação.")
@@ -0,0 +1,164 @@
+import threading
+import weakref
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+# --- Parâmetros do Pool ---
+MAX_FREE_BUFFERS = 8 # Buffers livres guardados por formato; o excedente fica para o GC
+
+class FramePool:
+    """
+    Pool de arrays reutilizáveis para os frames do vídeo. `acquire` entrega um
+    array sobre um bloco de memória pré-alocado; quando a última referência a
+    ele some (frame descartado pela fila, substituído como mais recente ou já
+    processado), o bloco volta ao pool automaticamente. Em regime, a captura e
+    a conversão de cor gravam (dst=) sempre nos mesmos poucos blocos.
+
+    O bloco é um bytearray, não um ndarray: assim o NumPy usa o próprio array
+    entregue como `base` de toda fatia ou visão derivada dele (recorte de uma
+    face, frame[::2]), e o bloco só volta ao pool depois que todas morrem.
+    """
+
+    def __init__(self, max_free: int = MAX_FREE_BUFFERS):
+        self.max_free = max_free
+        self.allocated = 0
+        self._lock = threading.Lock()
+        self._free: Dict[Tuple[Tuple[int, ...], str], List[bytearray]] = {}
+
+    def acquire(self, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        chave = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            livres = self._free.get(chave)
+            buf = livres.pop() if livres else None
+        if buf is None:
+            buf = bytearray(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+            self.allocated += 1
+        frame = np.ndarray(shape, dtype=dtype, buffer=buf)
+        weakref.finalize(frame, self._release, chave, buf)
+        return frame
+
+    def _release(self, chave, buf: bytearray):
+        with self._lock:
+            livres = self._free.setdefault(chave, [])
+            if len(livres) < self.max_free:
+                livres.append(buf)
+
+    def free_buffers(self) -> int:
+        with self._lock:
+            return sum(len(livres) for livres in self._free.values())
+
+class DisplayBuffer:
+    """
+    Buffer RGBA fixo para a exibição na GUI, com uma PIL.Image que compartilha
+    a mesma memória: desenhar no array já altera a imagem, e o PhotoImage do
+    Tkinter é atualizado com paste() em vez de recriado a cada frame.
+    """
+
+    def __init__(self, shape: Tuple[int, ...]):
+        from PIL import Image # Só a GUI precisa do Pillow
+        altura, largura = shape[:2]
+        self.rgba = np.empty((altura, largura, 4), dtype=np.uint8)
+        # "RGBA" com o decodificador "raw" é um dos modos em que o Pillow usa o buffer sem cópia
+        self.image = Image.frombuffer("RGBA", (largura, altura), self.rgba, "raw", "RGBA", 0, 1)
+
+    def matches(self, shape: Tuple[int, ...]) -> bool:
+        return self.rgba.shape[:2] == tuple(shape[:2])
+
+    def load(self, rgb: np.ndarray) -> np.ndarray:
+        """Copia o frame RGB compartilhado para o buffer (alfa 255) e retorna o array para desenhar."""
+        import cv2
+        cv2.cvtColor(rgb, cv2.COLOR_RGB2RGBA, dst=self.rgba)
+        return self.rgba
+
+# --- Verificação de Alocações (tracemalloc) ---
+
+class _SyntheticCapture:
+    """Câmera sintética que grava no buffer recebido, como cv2.VideoCapture.read(image)."""
+
+    def __init__(self, shape: Tuple[int, int, int], frames: int):
+        self.shape = shape
+        self.frames = frames
+        self.n = 0
+
+    def read(self, image: Optional[np.ndarray] = None):
+        if self.n >= self.frames:
+            return False, None
+        self.n += 1
+        if image is None or image.shape != self.shape:
+            image = np.empty(self.shape, dtype=np.uint8)
+        image.fill(self.n % 256)
+        return True, image
+
+def allocation_check(frames: int = 600, warmup: int = 100, shape: Tuple[int, int, int] = (480, 640, 3)):
+    """
+    Roda o caminho de vídeo (captura -> RGB compartilhado -> buffer de exibição
+    -> anotação) em regime e mede com tracemalloc, por frame, a memória
+    alocada e liberada (pico acima do nível anterior) e a variação da memória
+    em uso. Compara com o caminho antigo (copy + cvtColor + Image.fromarray).
+    """
+    import time
+    import tracemalloc
+    import cv2
+    from PIL import Image
+    from pipeline import RecognitionPipeline
+
+    def medir(compor):
+        pipeline = RecognitionPipeline(_SyntheticCapture(shape, frames + warmup)).start()
+        transitorios, ultimo = [], 0
+        base = None
+        while True:
+            frame = pipeline.wait_frame(ultimo, timeout=1.0)
+            if frame is None:
+                break # Fim da câmera sintética
+            ultimo = frame.seq
+            if ultimo == warmup:
+                base = tracemalloc.get_traced_memory()[0]
+            antes = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            compor(frame)
+            if ultimo > warmup:
+                transitorios.append(tracemalloc.get_traced_memory()[1] - antes)
+            time.sleep(0.001)
+        pipeline.stop()
+        atual = tracemalloc.get_traced_memory()[0]
+        return {
+            "frames_medidos": len(transitorios),
+            "bytes_transitorios_por_frame": int(np.median(transitorios)) if transitorios else 0,
+            "variacao_memoria_em_uso": atual - base if base is not None else 0,
+            "buffers_alocados": pipeline.pool.allocated,
+        }
+
+    display = DisplayBuffer(shape)
+
+    def compor_pool(frame):
+        canvas = display.load(frame.rgb)
+        cv2.rectangle(canvas, (100, 100), (200, 200), (0, 255, 0, 255), 2)
+
+    def compor_antigo(frame):
+        img = frame.bgr.copy()
+        cv2.rectangle(img, (100, 100), (200, 200), (0, 255, 0), 2)
+        Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+
+    tracemalloc.start()
+    try:
+        return {"pool": medir(compor_pool), "antigo": medir(compor_antigo)}
+    finally:
+        tracemalloc.stop()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Verifica as alocações por frame do caminho de vídeo (tracemalloc).")
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--limite", type=int, default=64 * 1024,
+                        help="Máximo de bytes transitórios por frame aceito no caminho com pool.")
+    args = parser.parse_args()
+
+    relatorio = allocation_check(args.frames)
+    for nome, r in relatorio.items():
+        print(f"{nome:<7} {r['bytes_transitorios_por_frame']:>10} bytes/frame transitórios | "
+              f"variação em uso {r['variacao_memoria_em_uso']:>8} bytes | buffers {r['buffers_alocados']}")
+    pool = relatorio["pool"]
+    if pool["bytes_transitorios_por_frame"] > args.limite or pool["variacao_memoria_em_uso"] > args.limite:
+        raise SystemExit("FALHA: as alocações por frame não estão estáveis.")
+    print("OK: alocações estáveis em regime.")
@@ -1,38 +1,20 @@
-import cv2
-import dlib
-import numpy as np
+import startup # Primeiro import: marca o início do processo e carrega câmera/modelos em segundo plano
 import os
+import sys
+import threading
 import db_operations # Importa o módulo com as funções CRUD
+import matcher # Comparação vetorizada com a galeria
+import metrics as metrics_mod # Tempos por etapa (RECOG_METRICS=1)
+import access_control # Eventos de acesso com confirmação e relé da porta em thread própria
+import replication # Cadastros de outros quiosques (RECOG_SYNC_PEERS)
 
 # --- Constantes do Sistema ---
 PREDICTOR = "shape_predictor_5_face_landmarks.dat"
 RECOG = "dlib_face_recognition_resnet_model_v1.dat"
-THRESH = 0.6
-
-# --- Inicialização do Dlib ---
-try:
-    detector = dlib.get_frontal_face_detector()
-    sp = dlib.shape_predictor(PREDICTOR)
-    rec = dlib.face_recognition_model_v1(RECOG)
-except RuntimeError as e:
-    print(f"Erro ao carregar modelos do Dlib: {e}")
-    print("Certifique-se de que os arquivos 'shape_predictor_5_face_landmarks.dat' e 'dlib_face_recognition_resnet_model_v1.dat' estão presentes.")
-    exit()
+DETECT_EVERY = 10 # Detecção completa a cada N frames; entre elas as faces são rastreadas
 
 # --- Variáveis de Estado ---
-cap = cv2.VideoCapture(0)
 validando = False
-ultimo = 0
-cooldown = 3
-# Variáveis de comunicação serial (mantidas como comentário)
-'''
-import serial
-import time
-PORT = "COM7"
-BAUD = 9600
-ser = serial.Serial(PORT, BAUD, timeout=0.5)
-time.sleep(2)
-'''
 
 # --- Funções Auxiliares para o CRUD no Console ---
 
@@ -65,22 +47,27 @@ def handle_create(vec):
     else:
         print(f"Erro ao cadastrar '{nome}'.")
 
+CONSOLE_PAGE = 20 # Usuários por página na listagem do console
+
 def handle_read_all():
-    """Lida com a operação de Listar Todos (READ All)."""
-    try:
-        users = db_operations.read_all_users()
-    except AttributeError:
-        print("Erro de importação: A função 'db_operations.read_all_users' não foi encontrada. Verifique se 'db_operations.py' está no mesmo diretório.")
-        return
-        
-    if not users:
-        print("\n--- Banco de Dados Vazio ---")
+    """Lida com a operação de Listar Todos (READ All), uma página por vez e sem carregar os vetores."""
+    prefixo = input("Filtrar por início do nome (Enter para todos): ").strip()
+    pagina = db_operations.list_users(limit=CONSOLE_PAGE, prefix=prefixo)
+    if not pagina.itens:
+        print("\n--- Nenhum Usuário Encontrado ---" if prefixo else "\n--- Banco de Dados Vazio ---")
         return
 
     print("\n--- Lista de Usuários Cadastrados ---")
-    for i, (nome, dados) in enumerate(users.items(), 1):
-        # Mostra o nome e o perfil, mas omite o vetor para simplicidade
-        print(f"{i}. Nome: {nome} | Perfil: {dados['perfil']}")
+    i = 0
+    while True:
+        for nome, perfil in pagina.itens:
+            i += 1
+            print(f"{i}. Nome: {nome} | Perfil: {perfil}")
+        if pagina.cursor is None:
+            break
+        if input("[Enter]=Próxima página | [Q]=Parar: ").strip().lower() == "q":
+            break
+        pagina = db_operations.list_users(pagina.cursor, CONSOLE_PAGE, prefixo)
     print("--------------------------------------")
 
 def handle_update():
@@ -122,45 +109,105 @@ def handle_delete():
     else:
         print(f"Erro: Usuário '{nome}' não encontrado.")
 
+# --- Modo Só CRUD (python main.py --crud): sem câmera e sem carregar os modelos ---
+
+def crud_menu():
+    print("[L]=Listar | [U]=Atualizar Perfil | [D]=Deletar | [Q]=Sair")
+    while True:
+        opcao = input("> ").strip().lower()
+        if opcao == "q": break
+        if opcao == "l": handle_read_all()
+        elif opcao == "u": handle_update()
+        elif opcao == "d": handle_delete()
+
+if "--crud" in sys.argv[1:]:
+    crud_menu()
+    sys.exit()
+
+# --- Inicialização do Dlib e da Câmera ---
+# Os modelos carregam em segundo plano: o vídeo aparece assim que a câmera abre
+# e a detecção é ligada no pipeline quando eles ficam prontos.
+import cv2
+import numpy as np
+from pipeline import RecognitionPipeline # Captura/detecção/vetor facial em threads
+from recognition import DetectionPolicy # Escala/upsample da detecção
+import face_quality # Faces pequenas, borradas ou de lado não passam pela ResNet
+
+loader = startup.BackgroundLoader(predictor=PREDICTOR, recog=RECOG).start()
+loader.camera_ready.wait()
+cap = loader.cap
+if cap is None:
+    raise SystemExit(f"Erro ao abrir a câmera: {loader.error}")
+
 # --- Loop Principal ---
 
 print("[E]=Cadastrar | [V]=Validar ON/OFF | [L]=Listar | [U]=Atualizar Perfil | [D]=Deletar | [Q]=Sair")
 
-while True:
-    ok, frame = cap.read()
-    if not ok: break
+# Instrumentação desligada por padrão (metrics = None não custa nada no loop)
+metrics = metrics_mod.from_env()
+mostrar_metricas = metrics is not None
+if metrics:
+    metrics.add_source(db_operations.get_cache_stats)
+    if matcher.MATCH_CACHE:
+        import match_cache # Acertos do cache de resultados (ajuste de RECOG_MATCH_CACHE_EPS)
+        metrics.add_source(match_cache.stats)
+    print("[M]=Mostrar/ocultar métricas")
 
-    # Processamento de reconhecimento facial
-    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    rects = detector(rgb, 1)
-    
+# Captura, detecção e vetor facial rodam em threads próprias; este loop só exibe.
+# No modo de rastreamento a detecção completa só roda a cada DETECT_EVERY frames.
+pipeline = RecognitionPipeline(cap, validate=lambda: validando,
+                               tracking=True, detect_every=DETECT_EVERY,
+                               detect_policy=DetectionPolicy(adaptive=True), metrics=metrics,
+                               quality=face_quality.from_env()).start()
+ultimo_frame = 0
+exibicao = None # Buffer reutilizado para desenhar as anotações
+cadastrando = None # Thread da rajada de cadastro em andamento
+rajada = [] # Template produzido pela rajada
+
+# Acesso liberado após CONFIRM_MATCHES reconhecimentos seguidos, uma vez por pessoa
+# a cada COOLDOWN_S; o relé (RECOG_RELAY_PORT) é acionado por uma thread própria
+acesso = access_control.from_env()
+if metrics:
+    metrics.add_source(acesso.stats)
+
+# Cadastros feitos em outros quiosques chegam pelo log de alterações (desligado sem RECOG_SYNC_PEERS/PORT)
+replicador = replication.from_env()
+if metrics and replicador:
+    metrics.add_source(replicador.stats)
+
+while pipeline.running:
+    latest = pipeline.wait_frame(ultimo_frame, timeout=1.0)
+    if latest is None:
+        if cv2.waitKey(1) & 0xFF == ord('q'): break
+        continue
+    ultimo_frame = latest.seq
+    if pipeline.detector is None and loader.models_ready.is_set():
+        if loader.models is None:
+            print(f"Erro ao carregar modelos do Dlib: {loader.error}")
+            print("Certifique-se de que os arquivos 'shape_predictor_5_face_landmarks.dat' e 'dlib_face_recognition_resnet_model_v1.dat' estão presentes.")
+            break
+        pipeline.attach_models(*loader.models)
+    t_exibicao = metrics.clock() if metrics else 0.0
+    # As anotações não podem alterar o frame em uso pela detecção: copia para um buffer fixo
+    if exibicao is None or exibicao.shape != latest.bgr.shape:
+        exibicao = np.empty_like(latest.bgr)
+    np.copyto(exibicao, latest.bgr)
+    frame = exibicao
+
+    # Último resultado de reconhecimento disponível
+    result = pipeline.latest_result()
     current_vec = None # Vetor da face detectada (se houver)
+    if result is not None and len(result.vecs):
+        current_vec = result.vecs[-1]
 
-    for r in rects:
-        shape = sp(rgb, r)
-        chip = dlib.get_face_chip(rgb, shape)
-        current_vec = np.array(rec.compute_face_descriptor(chip), dtype=np.float32)
-
-        # Lógica de Validação (READ durante a execução)
-        if validando:
-            try:
-                db = db_operations.get_db_for_recognition()
-            except AttributeError:
-                print("Erro de importação: A função 'db_operations.get_db_for_recognition' não foi encontrada. Verifique se 'db_operations.py' está no mesmo diretório.")
-                db = {} # Continua com um DB vazio para evitar quebrar o loop
-
-            nome, dist, perfil = "Desconhecido", 999, None
-            
-            if db:
-                for n, dados in db.items():
-                    d = np.linalg.norm(current_vec - dados["vetor"])
-                    if d < dist:
-                        nome, dist, perfil = n, d, dados["perfil"]
-
-            if dist > THRESH:
-                nome, perfil = "Desconhecido", None
-
-            messages = db_operations.get_profile_messages()
+    # Lógica de Validação (READ durante a execução)
+    if validando and result is not None and result.matches:
+        messages = db_operations.get_profile_messages()
+        # Uma mensagem de boas-vindas por liberação (não a cada frame)
+        for evento in acesso.process(result):
+            print(messages.get(evento.perfil, "Bem-vindo!")) # Usa .get para segurança
+
+        for r, (nome, dist, perfil) in zip(result.rects, result.matches):
             color = (0, 255, 0) if nome != "Desconhecido" else (0, 0, 255)
             cv2.rectangle(frame, (r.left(), r.top()), (r.right(), r.bottom()), color, 2)
 
@@ -168,28 +215,50 @@ while True:
                 texto = f"{nome} - {perfil}"
                 cv2.putText(frame, texto, (r.left(), r.top() - 10),
                             cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-                print(messages.get(perfil, "Bem-vindo!")) # Usa .get para segurança
             else:
                 cv2.putText(frame, "Desconhecido", (r.left(), r.top() - 10),
                             cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-            
-            # Lógica de comunicação serial (mantida como comentário)
-            '''
-            if nome != "Desconhecido" and time.time()-ultimo > cooldown:
-                ser.write(b'O')
-                ultimo = time.time()
-            '''
 
+    # Faces sem vetor (qualidade baixa): só o contorno, sem identificar
+    for r in (result.low_quality or []) if result is not None else []:
+        cv2.rectangle(frame, (r.left(), r.top()), (r.right(), r.bottom()), (128, 128, 128), 1)
+
+    if cadastrando is not None:
+        cv2.putText(frame, "Capturando amostras...", (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+    if pipeline.detector is None:
+        cv2.putText(frame, loader.status(), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+    if mostrar_metricas:
+        metrics_mod.draw_overlay(frame, metrics)
     cv2.imshow("Faces", frame)
+    if "primeiro_frame" not in startup.marks():
+        startup.mark("primeiro_frame")
+        print(f"Inicialização: {startup.report()}")
     k = cv2.waitKey(1) & 0xFF
+    if metrics:
+        metrics.observe("exibicao", metrics.clock() - t_exibicao)
 
     # --- Comandos do Console (CRUD) ---
     if k == ord('q'): break
     if k == ord('v'): validando = not validando
+    if k == ord('m') and metrics: mostrar_metricas = not mostrar_metricas
     
-    # CREATE - Cadastro de novo usuário
-    if k == ord('e') and current_vec is not None:
-        handle_create(current_vec)
+    # CREATE - Cadastro de novo usuário (rajada de frames -> template).
+    # A rajada leva alguns segundos: roda em outra thread para o vídeo continuar
+    # na janela, e o cadastro é concluído aqui quando ela termina.
+    if cadastrando is not None and not cadastrando.is_alive():
+        cadastrando = None
+        template = rajada.pop() if rajada else None
+        if template is not None:
+            handle_create(template)
+        else:
+            print("Erro: Nenhuma face detectada durante a captura.")
+    if k == ord('e') and cadastrando is not None:
+        pass # Rajada em andamento
+    elif k == ord('e') and current_vec is not None:
+        print("Capturando amostras, olhe para a câmera...")
+        cadastrando = threading.Thread(target=lambda: rajada.append(matcher.aggregate_templates(pipeline.capture_burst())),
+                                       name="rajada-cadastro", daemon=True)
+        cadastrando.start()
     elif k == ord('e') and current_vec is None:
         print("Erro: Nenhuma face detectada para cadastrar.")
 
@@ -205,6 +274,9 @@ while True:
     if k == ord('d'):
         handle_delete()
 
+pipeline.stop()
+acesso.stop()
+if replicador:
+    replicador.stop()
 cap.release()
 cv2.destroyAllWindows()
-'''ser.close()'''
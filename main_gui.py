@@ -1,37 +1,101 @@
+import startup # Primeiro import: marca o início do processo e carrega câmera/modelos em segundo plano
+import threading
+import time
 import tkinter as tk
 from tkinter import messagebox
-import cv2
-import dlib
-import numpy as np
-from PIL import Image, ImageTk
 import db_operations # Módulo CRUD
+import matcher # Comparação vetorizada com a galeria
+import metrics as metrics_mod # Tempos por etapa (RECOG_METRICS=1)
+import access_control # Eventos de acesso com confirmação e relé da porta em thread própria
+import replication # Cadastros de outros quiosques (RECOG_SYNC_PEERS)
+# cv2, Dlib, Pillow e o pipeline são importados só quando a câmera/modelos
+# ficam prontos (ver _start_pipeline): a janela aparece sem esperar por eles.
 
 # --- Constantes do Sistema ---
 PREDICTOR = "shape_predictor_5_face_landmarks.dat"
 RECOG = "dlib_face_recognition_resnet_model_v1.dat"
-THRESH = 0.6
+THRESH = matcher.THRESH
+DETECT_EVERY = 10 # Detecção completa a cada N frames; entre elas as faces são rastreadas
 
-# --- Inicialização do Dlib (Tratamento de Erro Robusto) ---
+# Cores das anotações (RGBA: o buffer de exibição já está em RGB, com alfa opaco)
+COR_FACE = (0, 0, 255, 255)
+COR_CONHECIDO = (0, 255, 0, 255)
+COR_DESCONHECIDO = (255, 0, 0, 255)
+COR_METRICAS = (255, 255, 0, 255)
+COR_BAIXA_QUALIDADE = (128, 128, 128, 255)
+GRANT_DISPLAY_S = 3.0 # Tempo em que a mensagem de boas-vindas fica no status
+
+# --- Inicialização do Dlib (em segundo plano, ver startup.BackgroundLoader) ---
 detector = None
 sp = None
 rec = None
-dlib_loaded = False
-
-try:
-    detector = dlib.get_frontal_face_detector()
-    sp = dlib.shape_predictor(PREDICTOR)
-    rec = dlib.face_recognition_model_v1(RECOG)
-    dlib_loaded = True
-except RuntimeError as e:
-    print(f"Erro ao carregar modelos do Dlib: {e}")
-    print("Certifique-se de que os arquivos .dat estão presentes no diretório de execução.")
-    # Se falhar, as variáveis continuam None e dlib_loaded é False
+dlib_loaded = False # Só fica True quando os modelos terminam de carregar
 
 # --- Variáveis Globais ---
-cap = cv2.VideoCapture(0)
 current_vec = None # Vetor da face detectada
 validando = False
 
+# --- Lista de Usuários (carregada sob demanda) ---
+class UserListWindow:
+    """
+    Janela da listagem com filtros por prefixo e perfil. Só as páginas já
+    vistas ficam no Listbox: a próxima é buscada (db_operations.list_users)
+    quando a rolagem chega perto do fim, então abrir a lista custa o mesmo
+    com 10 ou 100 mil usuários.
+    """
+
+    TODOS = "Todos"
+
+    def __init__(self, parent):
+        self.top = tk.Toplevel(parent)
+        self.top.title("Usuários Cadastrados")
+
+        filtros = tk.Frame(self.top)
+        filtros.pack(fill=tk.X, padx=10, pady=(10, 0))
+        tk.Label(filtros, text="Nome começa com:").pack(side=tk.LEFT)
+        self.prefix_var = tk.StringVar()
+        self.prefix_var.trace_add("write", lambda *_: self.reset())
+        tk.Entry(filtros, textvariable=self.prefix_var, width=15).pack(side=tk.LEFT, padx=5)
+        self.profile_var = tk.StringVar(value=self.TODOS)
+        perfis = [self.TODOS] + list(db_operations.get_available_profiles().values())
+        tk.OptionMenu(filtros, self.profile_var, *perfis, command=lambda _: self.reset()).pack(side=tk.LEFT)
+
+        corpo = tk.Frame(self.top)
+        corpo.pack(padx=10, pady=10)
+        self.scrollbar = tk.Scrollbar(corpo)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.listbox = tk.Listbox(corpo, height=20, width=50, yscrollcommand=self.on_scroll)
+        self.listbox.pack(side=tk.LEFT)
+        self.scrollbar.config(command=self.listbox.yview)
+        self.loading = False # Próxima página já agendada (after_idle)
+        self.reset()
+
+    def reset(self):
+        self.listbox.delete(0, tk.END)
+        self.cursor = None
+        self.done = False
+        self.load_page()
+
+    def load_page(self):
+        self.loading = False
+        if self.done:
+            return
+        perfil = self.profile_var.get()
+        pagina = db_operations.list_users(self.cursor, prefix=self.prefix_var.get().strip(),
+                                          perfil=None if perfil == self.TODOS else perfil)
+        for nome, perfil in pagina.itens:
+            self.listbox.insert(tk.END, f"Nome: {nome} | Perfil: {perfil}")
+        self.cursor = pagina.cursor
+        self.done = pagina.cursor is None
+
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        # Perto do fim do que já foi carregado: busca a próxima página
+        # (cada inserção rola a lista de novo: sem a flag, várias cargas seriam agendadas)
+        if float(last) > 0.9 and not self.done and not self.loading:
+            self.loading = True
+            self.top.after_idle(self.load_page)
+
 # --- Classe Principal da Aplicação ---
 class FaceCRUDApp:
     def __init__(self, window, window_title):
@@ -110,7 +174,37 @@ class FaceCRUDApp:
         self.delete_btn = tk.Button(crud_frame, text="4. Excluir Usuário", command=self.delete_user, bg="red", fg="white")
         self.delete_btn.pack(pady=10)
 
-        # Inicia o loop de vídeo
+        # Instrumentação desligada por padrão (None não custa nada no loop de vídeo)
+        self.metrics = metrics_mod.from_env()
+        if self.metrics:
+            self.metrics.add_source(db_operations.get_cache_stats)
+            if matcher.MATCH_CACHE:
+                import match_cache # Acertos do cache de resultados (ajuste de RECOG_MATCH_CACHE_EPS)
+                self.metrics.add_source(match_cache.stats)
+
+        # Liberação confirmada em vários frames, uma vez por pessoa a cada
+        # COOLDOWN_S; o relé da porta é acionado fora da thread da interface
+        self.access = access_control.from_env()
+        self.grant = None # (mensagem, instante) da última liberação
+        self.enrolling = None # Thread da rajada de cadastro em andamento
+        if self.metrics:
+            self.metrics.add_source(self.access.stats)
+
+        # Cadastros feitos em outros quiosques chegam pelo log de alterações
+        self.replicator = replication.from_env()
+        if self.metrics and self.replicator:
+            self.metrics.add_source(self.replicator.stats)
+
+        # Câmera e modelos abrem em segundo plano; o pipeline começa só capturando
+        # e a detecção é ligada quando os modelos ficam prontos (update_video)
+        self.loader = startup.BackgroundLoader(predictor=PREDICTOR, recog=RECOG).start()
+        self.pipeline = None
+        self.cap = None # Aberta em segundo plano
+        self.awaiting_models = True
+        self.window.bind("<Map>", lambda e: startup.mark("janela"), add="+")
+        self.last_seq = 0
+        self.display = None # DisplayBuffer + PhotoImage criados no primeiro frame e reutilizados
+        self.photo = None
         self.delay = 10 # 10ms delay para 100 FPS (aprox.)
         self.update_video()
         
@@ -119,48 +213,97 @@ class FaceCRUDApp:
         self.window.mainloop()
 
     # --- Lógica de Vídeo e Reconhecimento ---
+    def _start_pipeline(self):
+        """Câmera aberta: cria o pipeline só de captura (os imports pesados já foram feitos pelo loader)."""
+        import cv2
+        from PIL import ImageTk
+        from frame_buffers import DisplayBuffer # Buffer de exibição reutilizado entre frames
+        from pipeline import RecognitionPipeline # Captura/detecção/vetor facial em threads
+        from recognition import DetectionPolicy # Escala/upsample da detecção
+        import face_quality # Faces pequenas, borradas ou de lado não passam pela ResNet
+        # Guardados na instância: update_video e on_closing usam os mesmos objetos
+        self.cv2, self.ImageTk, self.DisplayBuffer = cv2, ImageTk, DisplayBuffer
+        self.cap = self.loader.cap
+        self.pipeline = RecognitionPipeline(self.cap, validate=lambda: validando,
+                                            tracking=True, detect_every=DETECT_EVERY,
+                                            detect_policy=DetectionPolicy(adaptive=True), metrics=self.metrics,
+                                            quality=face_quality.from_env()).start()
+
+    def _attach_models(self):
+        """Modelos carregados (ou falha): liga a detecção no pipeline já em execução."""
+        global detector, sp, rec, dlib_loaded
+        if self.loader.models is None:
+            print(f"Erro ao carregar modelos do Dlib: {self.loader.error}")
+            print("Certifique-se de que os arquivos .dat estão presentes no diretório de execução.")
+            return
+        detector, sp, rec = self.loader.models
+        dlib_loaded = True
+        self.pipeline.attach_models(detector, sp, rec)
+
     def update_video(self):
         global current_vec
+
+        if self.pipeline is None:
+            if not self.loader.camera_ready.is_set():
+                self.status_label.config(text=f"Status: {self.loader.status()}")
+                self.window.after(self.delay, self.update_video)
+                return
+            if self.loader.cap is None:
+                print(f"Erro ao abrir a câmera: {self.loader.error}")
+                self.status_label.config(text=f"Status: {self.loader.status()}")
+                return
+            self._start_pipeline()
+        if self.awaiting_models and self.loader.models_ready.is_set():
+            self.awaiting_models = False
+            self._attach_models()
         
-        ok, frame = cap.read()
-        if ok:
-            # Processamento de reconhecimento facial
-            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        # O pipeline captura e reconhece em threads próprias; aqui só compomos
+        # o último frame da câmera com o último resultado disponível.
+        cv2 = self.cv2
+        latest = self.pipeline.latest_frame()
+        if latest is not None and latest.seq != self.last_seq:
+            self.last_seq = latest.seq
+            m = self.metrics
+            t_exibicao = m.clock() if m else 0.0
+            if self.display is None or not self.display.matches(latest.rgb.shape):
+                self.display = self.DisplayBuffer(latest.rgb.shape)
+                self.photo = self.ImageTk.PhotoImage(self.display.image.mode, self.display.image.size)
+                self.video_label.config(image=self.photo)
+            # O RGB convertido na captura é copiado para o buffer de exibição:
+            # as anotações não podem alterar o frame em uso pela detecção
+            frame = self.display.load(latest.rgb)
             
             current_vec = None # Reset do vetor
             recognition_status = "Status: Aguardando..."
 
             # Somente tenta processar se o Dlib tiver sido carregado com sucesso
             if dlib_loaded:
-                rects = detector(rgb, 1)
+                result = self.pipeline.latest_result()
+                rects = result.rects if result is not None else []
                 
-                for r in rects:
-                    # AQUI ESTAVA O ERRO: shape = sp(rgb, r) só deve ser chamado se sp estiver definido
-                    shape = sp(rgb, r)
-                    chip = dlib.get_face_chip(rgb, shape)
-                    current_vec = np.array(rec.compute_face_descriptor(chip), dtype=np.float32)
+                for r, vec in zip(rects, result.vecs if result is not None else []):
+                    current_vec = vec
                     
                     # Desenha o retângulo no frame original
-                    cv2.rectangle(frame, (r.left(), r.top()), (r.right(), r.bottom()), (255, 0, 0), 2)
+                    cv2.rectangle(frame, (r.left(), r.top()), (r.right(), r.bottom()), COR_FACE, 2)
                     
                     recognition_status = "Status: Face Detectada! Pronto para Cadastrar."
 
-                    # Lógica de Validação (READ durante a execução)
-                    if validando:
-                        db = db_operations.get_db_for_recognition()
-                        nome, dist, perfil = "Desconhecido", 999, None
-                        
-                        if db:
-                            for n, dados in db.items():
-                                d = np.linalg.norm(current_vec - dados["vetor"])
-                                if d < dist:
-                                    nome, dist, perfil = n, d, dados["perfil"]
+                # Faces sem vetor (qualidade baixa): só o contorno, sem identificar
+                for r in (result.low_quality or []) if result is not None else []:
+                    cv2.rectangle(frame, (r.left(), r.top()), (r.right(), r.bottom()), COR_BAIXA_QUALIDADE, 1)
+                    if not len(rects):
+                        recognition_status = "Status: Aproxime-se e olhe para a câmera."
 
-                        if dist > THRESH:
-                            nome, perfil = "Desconhecido", None
+                # Lógica de Validação (READ durante a execução)
+                if validando and result is not None and result.matches:
+                    messages = db_operations.get_profile_messages()
+                    for evento in self.access.process(result):
+                        self.grant = (f"Status: {messages.get(evento.perfil, 'Bem-vindo!')} Acesso liberado.",
+                                      evento.timestamp)
 
-                        messages = db_operations.get_profile_messages()
-                        color = (0, 255, 0) if nome != "Desconhecido" else (0, 0, 255)
+                    for r, (nome, dist, perfil) in zip(rects, result.matches):
+                        color = COR_CONHECIDO if nome != "Desconhecido" else COR_DESCONHECIDO
                         
                         # Atualiza o retângulo e o texto
                         cv2.rectangle(frame, (r.left(), r.top()), (r.right(), r.bottom()), color, 2)
@@ -169,31 +312,48 @@ class FaceCRUDApp:
                             texto = f"{nome} - {perfil}"
                             cv2.putText(frame, texto, (r.left(), r.top() - 10),
                                         cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-                            # Exibe a mensagem de boas-vindas do perfil (Nutricionista/Usuário)
-                            recognition_status = f"Status: {messages.get(perfil, 'Bem-vindo!')}"
+                            recognition_status = f"Status: Reconhecido: {nome}"
                         else:
                             cv2.putText(frame, "Desconhecido", (r.left(), r.top() - 10),
                                         cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
                             recognition_status = "Status: Face Desconhecida."
+            elif not self.loader.models_ready.is_set():
+                # Vídeo já na tela enquanto os modelos terminam de carregar
+                recognition_status = f"Status: {self.loader.status()}"
             else:
                 # Caso o Dlib não tenha sido carregado
                 recognition_status = "ERRO: Modelos Dlib não carregados. Verifique os arquivos .dat."
-                cv2.putText(frame, recognition_status, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+                cv2.putText(frame, recognition_status, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, COR_DESCONHECIDO, 2)
             
+            # A mensagem de boas-vindas do perfil fica visível por alguns segundos após a liberação
+            if self.grant is not None and time.monotonic() - self.grant[1] < GRANT_DISPLAY_S:
+                recognition_status = self.grant[0]
+            if self.enrolling is not None:
+                recognition_status = "Status: Capturando amostras, olhe para a câmera..."
+
+            if m:
+                metrics_mod.draw_overlay(frame, m, COR_METRICAS)
+
             # Atualiza o status na GUI
             self.status_label.config(text=recognition_status)
 
-            # Converte o frame do OpenCV para um formato que o Tkinter pode usar
-            img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            img = Image.fromarray(img)
-            self.photo = ImageTk.PhotoImage(image=img)
-            self.video_label.config(image=self.photo)
+            # A PIL.Image do DisplayBuffer compartilha a memória do array: basta
+            # atualizar o PhotoImage existente, sem criar imagens novas
+            self.photo.paste(self.display.image)
+            if "primeiro_frame" not in startup.marks():
+                startup.mark("primeiro_frame")
+                print(f"Inicialização: {startup.report()}")
+            if m:
+                m.observe("exibicao", m.clock() - t_exibicao)
         
         # Chama a si mesmo após um pequeno atraso para o loop de vídeo
         self.window.after(self.delay, self.update_video)
 
     def toggle_validation(self):
         global validando
+        if not self.loader.models_ready.is_set():
+            messagebox.showinfo("Aguarde", "Os modelos do Dlib ainda estão carregando.")
+            return
         if not dlib_loaded:
             messagebox.showerror("Erro de Inicialização", "Não é possível ligar a validação. Os modelos do Dlib não foram carregados. Verifique se os arquivos .dat estão no diretório correto.")
             return
@@ -208,6 +368,9 @@ class FaceCRUDApp:
     # --- Funções de CRUD Integradas à GUI ---
     
     def create_user(self):
+        if not self.loader.models_ready.is_set():
+            messagebox.showinfo("Aguarde", "Os modelos do Dlib ainda estão carregando.")
+            return
         if not dlib_loaded:
             messagebox.showerror("Erro de Inicialização", "Não é possível cadastrar. Os modelos do Dlib não foram carregados.")
             return
@@ -223,29 +386,45 @@ class FaceCRUDApp:
             messagebox.showerror("Erro", "Nenhuma face detectada para cadastrar. Posicione-se em frente à câmera.")
             return
 
-        if db_operations.create_user(nome, current_vec, perfil):
+        if self.enrolling is not None:
+            return
+
+        # Rajada de frames -> template (média ou conjunto, conforme matcher.TEMPLATE_MODE).
+        # A rajada leva alguns segundos: roda em outra thread para o vídeo
+        # continuar na tela, e o cadastro termina na thread da interface.
+        resultado = []
+        self.enrolling = threading.Thread(
+            target=lambda: resultado.append(matcher.aggregate_templates(self.pipeline.capture_burst())),
+            name="rajada-cadastro", daemon=True)
+        self.create_btn.config(state=tk.DISABLED)
+        self.status_label.config(text="Status: Capturando amostras, olhe para a câmera...")
+        self.enrolling.start()
+        self.window.after(self.delay, self._finish_enroll, nome, perfil, resultado)
+
+    def _finish_enroll(self, nome, perfil, resultado):
+        if self.enrolling.is_alive():
+            self.window.after(self.delay, self._finish_enroll, nome, perfil, resultado)
+            return
+        self.enrolling = None
+        self.create_btn.config(state=tk.NORMAL)
+        template = resultado[0] if resultado else None
+        if template is None:
+            messagebox.showerror("Erro", "Nenhuma face detectada durante a captura. Tente novamente.")
+            return
+
+        if db_operations.create_user(nome, template, perfil):
             messagebox.showinfo("Sucesso", f"Usuário '{nome}' ({perfil}) cadastrado com sucesso.")
             self.name_entry.delete(0, tk.END)
         else:
             messagebox.showerror("Erro", f"O usuário '{nome}' já existe no banco de dados.")
 
     def read_all_users(self):
-        users = db_operations.read_all_users()
-        if not users:
+        # Lista paginada: só nomes e perfis, buscados aos poucos conforme a rolagem
+        primeira = db_operations.list_users(limit=1)
+        if not primeira.itens:
             messagebox.showinfo("Lista de Usuários", "O banco de dados está vazio.")
             return
-
-        user_list = "--- Lista de Usuários ---\n"
-        for nome, dados in users.items():
-            user_list += f"Nome: {nome} | Perfil: {dados['perfil']}\n"
-            
-        # Usa um widget Text para exibir a lista formatada
-        top = tk.Toplevel(self.window)
-        top.title("Usuários Cadastrados")
-        text_widget = tk.Text(top, height=20, width=50)
-        text_widget.pack(padx=10, pady=10)
-        text_widget.insert(tk.END, user_list)
-        text_widget.config(state=tk.DISABLED) # Torna o texto somente leitura
+        UserListWindow(self.window)
 
     def update_user(self):
         nome = self.update_name_entry.get().strip()
@@ -276,17 +455,22 @@ class FaceCRUDApp:
                 messagebox.showerror("Erro", f"Erro: Usuário '{nome}' não encontrado.")
 
     def on_closing(self):
-        # Libera a câmera e fecha a janela
-        if cap.isOpened():
-            cap.release()
+        # Para o pipeline, libera a câmera e fecha a janela
+        if self.pipeline is not None:
+            self.pipeline.stop()
+        self.access.stop()
+        if self.replicator is not None:
+            self.replicator.stop()
+        if self.cap is not None and self.cap.isOpened():
+            self.cap.release()
         self.window.destroy()
 
 # --- Execução ---
 if __name__ == "__main__":
-    # Certifica-se de que os módulos necessários estão instalados
-    try:
-        from PIL import Image, ImageTk
-    except ImportError:
+    # Certifica-se de que os módulos necessários estão instalados (sem importá-los
+    # ainda: o Pillow só é carregado quando a câmera estiver pronta)
+    import importlib.util
+    if importlib.util.find_spec("PIL") is None:
         print("Erro: A biblioteca 'Pillow' (PIL) é necessária para a GUI.")
         print("Instale com: pip install Pillow")
         exit()
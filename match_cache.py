@@ -0,0 +1,203 @@
+import os
+import threading
+import time
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional
+
+import db_operations # Versão da galeria (invalidação após CRUD)
+import matcher # Busca na galeria e Match
+
+# --- Parâmetros do Cache de Resultados ---
+CACHE_SIZE = int(os.environ.get("RECOG_MATCH_CACHE_SIZE", "64")) # Descritores resolvidos guardados (LRU)
+CACHE_TTL_S = float(os.environ.get("RECOG_MATCH_CACHE_TTL", "2.0")) # Validade de cada resultado
+CACHE_EPSILON = float(os.environ.get("RECOG_MATCH_CACHE_EPS", "0.1")) # Distância máxima até o descritor em cache
+
+def _gallery_version() -> Any:
+    if matcher.SEARCH_BACKEND == "host":
+        import model_host # Importado sob demanda: a galeria consultada é a do host
+        return model_host.get_client().gallery_version()
+    db_operations.get_recognition_gallery() # Confere se outro processo alterou o DB (a recarga muda a versão)
+    return db_operations.get_gallery_version()
+
+class MatchCache:
+    """
+    Cache LRU de resultados do match() com k=1, com tamanho e validade (TTL)
+    limitados. Uma face a menos de `epsilon` de um descritor resolvido há pouco
+    reaproveita o nome, a distância e o perfil, sem percorrer a galeria.
+
+    Pela desigualdade triangular, mover a consulta de r muda cada distância da
+    galeria em no máximo r. Por isso cada resultado guarda o seu raio seguro,
+    calculado com os dois usuários mais próximos na busca original: a folga
+    até o threshold e metade da diferença entre o 1º e o 2º. Dentro desse raio
+    a decisão (quem é, ou desconhecido) é a mesma da busca completa; só a
+    distância informada pode diferir em até `epsilon`. Consultas dentro de
+    `epsilon` mas fora do raio seguro contam como `recusados` e vão à galeria.
+
+    Qualquer CRUD (ou recarga do DB alterado por outro processo) muda a versão
+    da galeria e esvazia o cache: um perfil desatualizado nunca é servido.
+    """
+
+    def __init__(self, tamanho: int = CACHE_SIZE, ttl: float = CACHE_TTL_S, epsilon: float = CACHE_EPSILON,
+                 search: Optional[Callable[..., List[List[matcher.Match]]]] = None,
+                 version: Optional[Callable[[], Any]] = None):
+        self.tamanho = tamanho
+        self.ttl = ttl
+        self.epsilon = epsilon
+        self._search = search or matcher.search
+        self._version = version or _gallery_version
+        self._lock = threading.Lock()
+        self._vetores = np.zeros((tamanho, db_operations.DESCRIPTOR_DIM), dtype=np.float32)
+        self._raios = np.full(tamanho, -1.0) # Raio seguro de cada posição; -1 = livre
+        self._criados = np.zeros(tamanho)
+        self._usos = np.zeros(tamanho, dtype=np.int64) # Relógio do último uso (LRU)
+        self._matches: List[Optional[matcher.Match]] = [None] * tamanho
+        self._relogio = 0
+        self._chave: Any = None # (versão da galeria, threshold) dos resultados guardados
+        self.hits = 0
+        self.misses = 0
+        self.recusados = 0
+        self.invalidacoes = 0
+
+    def clear(self):
+        with self._lock:
+            self._raios[:] = -1.0
+            self._matches = [None] * self.tamanho
+
+    def match(self, q: np.ndarray, threshold: float = matcher.THRESH) -> List[List[matcher.Match]]:
+        """Mesmo formato de matcher.match(q, k=1): [[Match]] por face de `q` (F, 128)."""
+        chave = (self._version(), threshold)
+        agora = time.monotonic()
+        resultados: List[Optional[matcher.Match]] = [None] * q.shape[0]
+        with self._lock:
+            if chave != self._chave:
+                if self._chave is not None and (self._raios >= 0).any():
+                    self.invalidacoes += 1
+                self._raios[:] = -1.0
+                self._chave = chave
+            validas = np.flatnonzero((self._raios >= 0) & (agora - self._criados <= self.ttl))
+            if len(validas):
+                dist = matcher.pairwise_distances(q, self._vetores[validas])
+                for f, j in enumerate(np.argmin(dist, axis=1)):
+                    d, pos = dist[f, j], validas[j]
+                    if d < min(self.epsilon, self._raios[pos]):
+                        resultados[f] = self._matches[pos]
+                        self._relogio += 1
+                        self._usos[pos] = self._relogio
+                    elif d < self.epsilon:
+                        self.recusados += 1
+            faltam = [f for f, m in enumerate(resultados) if m is None]
+            self.hits += len(resultados) - len(faltam)
+            self.misses += len(faltam)
+        if not faltam:
+            return [[m] for m in resultados]
+
+        # Dois candidatos: o segundo define o raio seguro do resultado
+        candidatos = self._search(q[faltam], 2, threshold)
+        with self._lock:
+            for f, c in zip(faltam, candidatos):
+                m = c[0]
+                resultados[f] = m
+                if chave != self._chave:
+                    continue # A galeria mudou durante a busca: o resultado não é guardado
+                if m.nome == matcher.UNKNOWN:
+                    raio = m.distancia - threshold
+                else:
+                    segunda = c[1].distancia if len(c) > 1 else float("inf")
+                    raio = min(threshold - m.distancia, (segunda - m.distancia) / 2)
+                if not raio > 0:
+                    continue
+                livres = np.flatnonzero((self._raios < 0) | (agora - self._criados > self.ttl))
+                pos = livres[0] if len(livres) else int(np.argmin(self._usos))
+                self._vetores[pos] = q[f]
+                self._raios[pos] = raio
+                self._criados[pos] = agora
+                self._matches[pos] = m
+                self._relogio += 1
+                self._usos[pos] = self._relogio
+        return [[m] for m in resultados]
+
+    def stats(self) -> Dict[str, float]:
+        consultas = self.hits + self.misses
+        return {"cache_match_acertos": self.hits, "cache_match_consultas": consultas,
+                "cache_match_taxa": round(self.hits / consultas, 4) if consultas else 0.0,
+                "cache_match_recusados": self.recusados, "cache_match_invalidacoes": self.invalidacoes}
+
+# --- Instância do Processo ---
+
+_cache: Optional[MatchCache] = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> MatchCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = MatchCache()
+        return _cache
+
+def stats() -> Dict[str, float]:
+    """Estatísticas do cache do processo (fonte para metrics.Metrics.add_source)."""
+    return get_cache().stats()
+
+# --- Verificação ---
+
+def cache_check(n_usuarios: int = 10000, pessoas: int = 20, frames: int = 60, ruido: float = 0.05,
+                epsilon: float = CACHE_EPSILON, threshold: float = matcher.THRESH, seed: int = 0) -> Dict[str, float]:
+    """
+    Simula pessoas paradas diante da câmera (um descritor por pessoa com
+    `ruido` a cada frame; metade cadastradas, metade desconhecidas) em uma
+    galeria sintética. Compara cada resultado do cache com a busca completa:
+    a decisão nunca pode diferir. Retorna a taxa de acertos, as decisões
+    diferentes e o tempo médio por consulta com e sem o cache.
+    """
+    import ann_index
+
+    vetores = ann_index.synthetic_gallery(n_usuarios, seed)
+    nomes = np.array([f"u{i}" for i in range(n_usuarios)], dtype=object)
+    perfis = np.full(n_usuarios, "Usuário", dtype=object)
+    gallery = db_operations.Gallery(nomes, perfis, vetores, np.einsum("ij,ij->i", vetores, vetores))
+
+    def busca(q, k, limite):
+        idx, dist = matcher.nearest(q, gallery, k)
+        return matcher.to_matches(matcher.rows_to_neighbors(gallery, idx, dist, k, False), limite)
+
+    rng = np.random.default_rng(seed + 1)
+    base = np.concatenate([vetores[rng.choice(n_usuarios, pessoas // 2, replace=False)],
+                           ann_index.synthetic_gallery(pessoas - pessoas // 2, seed + 2)])
+    cache = MatchCache(epsilon=epsilon, ttl=float("inf"), search=busca, version=lambda: 0)
+    diferentes = 0
+    t_cache = t_busca = 0.0
+    for _ in range(frames):
+        for p in range(pessoas):
+            ruido_vec = rng.standard_normal(base.shape[1]).astype(np.float32)
+            q = (base[p] + ruido * ruido_vec / np.linalg.norm(ruido_vec))[np.newaxis, :]
+            t0 = time.perf_counter()
+            m = cache.match(q, threshold)[0][0]
+            t1 = time.perf_counter()
+            exato = busca(q, 1, threshold)[0][0]
+            t_cache += t1 - t0
+            t_busca += time.perf_counter() - t1
+            diferentes += m.nome != exato.nome
+    consultas = frames * pessoas
+    return {"taxa_acerto": cache.stats()["cache_match_taxa"], "decisoes_diferentes": diferentes,
+            "recusados": cache.recusados, "ms_com_cache": t_cache / consultas * 1000,
+            "ms_sem_cache": t_busca / consultas * 1000}
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Taxa de acertos e segurança do cache de resultados do matcher.")
+    parser.add_argument("--usuarios", type=int, default=10000)
+    parser.add_argument("--ruido", type=float, default=0.05, help="Variação do descritor entre frames da mesma pessoa.")
+    parser.add_argument("--epsilon", type=float, nargs="+", default=[0.05, CACHE_EPSILON, 0.2])
+    args = parser.parse_args()
+
+    print(f"--- Cache de resultados ({args.usuarios} usuários, ruído {args.ruido}, THRESH={matcher.THRESH}) ---")
+    falhou = False
+    for eps in args.epsilon:
+        r = cache_check(args.usuarios, ruido=args.ruido, epsilon=eps)
+        print(f"epsilon={eps:<5g} | acertos {r['taxa_acerto']:.1%} | recusados pelo raio seguro {r['recusados']} | "
+              f"decisões diferentes {r['decisoes_diferentes']} | {r['ms_com_cache']:.3f} ms com cache, "
+              f"{r['ms_sem_cache']:.3f} ms sem")
+        falhou = falhou or r["decisoes_diferentes"] > 0
+    if falhou:
+        raise SystemExit("FALHA")
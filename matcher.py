@@ -0,0 +1,226 @@
+import os
+import numpy as np
+from typing import Any, List, NamedTuple, Optional, Tuple
+
+import db_operations # Galeria de reconhecimento (cache em memória)
+
+# --- Constantes do Matcher ---
+THRESH = 0.6
+UNKNOWN = "Desconhecido"
+
+# --- Estratégia de Busca ---
+# "exact": força bruta vetorizada sobre a galeria inteira (padrão).
+# "ivf": índice aproximado de ann_index.py, para galerias muito grandes;
+#        IVF_NPROBE controla o equilíbrio recall/latência.
+# "host": a busca é feita pelo host de modelos (model_host.py), que mantém a
+#         galeria residente; selecionada por model_host.connect().
+SEARCH_BACKENDS = ("exact", "ivf", "host")
+SEARCH_BACKEND = os.environ.get("RECOG_SEARCH", "exact")
+IVF_NPROBE = int(os.environ.get("RECOG_NPROBE", "8"))
+# Faces rejeitadas pelo IVF (melhor distância > threshold) são conferidas na busca
+# exata, então o IVF nunca aumenta a taxa de falsa rejeição; só pessoas não
+# cadastradas pagam o custo da força bruta.
+IVF_EXACT_FALLBACK = True
+
+# --- Galeria Compacta ---
+# "" (padrão): busca sobre os vetores float32. "float16" ou "int8": as distâncias
+# são calculadas sobre uma cópia compacta (quantized.py), a matriz float32 sai
+# da memória (arquivo mapeado) e só os candidatos cuja decisão a aproximação
+# não garante são reavaliados em float32.
+COMPACT = os.environ.get("RECOG_COMPACT", "")
+if COMPACT:
+    db_operations.set_gallery_spill(True)
+
+# --- Templates por Usuário ---
+# "media": um único vetor, média das amostras do cadastro (custo de busca inalterado).
+# "conjunto": até MAX_TEMPLATES amostras diversas; a distância do usuário é a menor delas.
+TEMPLATE_MODES = ("media", "conjunto")
+TEMPLATE_MODE = os.environ.get("RECOG_TEMPLATES", "media")
+
+# --- Cache de Resultados ---
+# Com k=1, faces quase idênticas a uma resolvida há pouco (mesma pessoa parada
+# diante da câmera) reaproveitam o resultado sem percorrer a galeria
+# (match_cache.py). O raio de reaproveitamento é limitado para nunca mudar a
+# decisão (nome ou desconhecido); RECOG_MATCH_CACHE=0 desliga.
+MATCH_CACHE = os.environ.get("RECOG_MATCH_CACHE", "1") == "1"
+
+def set_search_backend(backend: str, nprobe: Optional[int] = None):
+    """Seleciona a busca exata ou aproximada (IVF) usada por match()."""
+    global SEARCH_BACKEND, IVF_NPROBE
+    if backend not in SEARCH_BACKENDS:
+        raise ValueError(f"Busca desconhecida: {backend!r}. Use uma de {SEARCH_BACKENDS}.")
+    SEARCH_BACKEND = backend
+    if nprobe is not None:
+        IVF_NPROBE = nprobe
+
+class Match(NamedTuple):
+    """Resultado de uma comparação: nome, distância euclidiana e perfil."""
+    nome: str
+    distancia: float
+    perfil: Optional[str]
+
+def _as_batch(descriptors: Any) -> np.ndarray:
+    """Converte um descritor (128,) ou um lote (F, 128) para float32 (F, 128)."""
+    q = np.asarray(descriptors, dtype=np.float32)
+    if q.ndim == 1:
+        q = q[np.newaxis, :]
+    return q
+
+def pairwise_distances(q: np.ndarray, vetores: np.ndarray, normas2: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Distâncias euclidianas (F, N) entre as consultas e a galeria em uma única
+    operação, pela expansão ||q - g||^2 = ||q||^2 + ||g||^2 - 2 q.g
+    """
+    if normas2 is None:
+        normas2 = np.einsum("ij,ij->i", vetores, vetores)
+    q_normas2 = np.einsum("ij,ij->i", q, q)
+    d2 = q_normas2[:, np.newaxis] + normas2[np.newaxis, :] - 2.0 * (q @ vetores.T)
+    # Erros de arredondamento podem gerar valores levemente negativos
+    np.maximum(d2, 0.0, out=d2)
+    return np.sqrt(d2, out=d2)
+
+def nearest(q: np.ndarray, gallery: db_operations.Gallery, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Busca exata dos k vizinhos mais próximos de cada consulta.
+    Retorna (indices, distancias), ambos (F, min(k, N)), em ordem crescente de distância.
+    """
+    n = gallery.vetores.shape[0]
+    k = min(k, n)
+    if k == 0:
+        return np.empty((q.shape[0], 0), dtype=np.intp), np.empty((q.shape[0], 0), dtype=np.float32)
+
+    dist = pairwise_distances(q, gallery.vetores, gallery.normas2)
+    if k < n:
+        idx = np.argpartition(dist, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.broadcast_to(np.arange(n), (q.shape[0], n))
+    top = np.take_along_axis(dist, idx, axis=1)
+    order = np.argsort(top, axis=1)
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(top, order, axis=1)
+
+def set_compact(modo: str):
+    """Liga ("float16"/"int8") ou desliga ("") a galeria compacta usada pela busca exata."""
+    global COMPACT
+    if modo and modo not in ("float16", "int8"):
+        raise ValueError(f"Modo compacto desconhecido: {modo!r}. Use float16, int8 ou \"\".")
+    COMPACT = modo
+    db_operations.set_gallery_spill(bool(modo))
+
+def _exact_neighbors(q: np.ndarray, k: int, threshold: float = THRESH) -> List[List[Tuple[str, float, Optional[str]]]]:
+    """
+    Busca exata na galeria do cache, no formato [(nome, distancia, perfil)] por
+    face. Com vários templates por usuário, a distância de cada usuário é a do
+    seu template mais próximo: os k usuários distintos mais próximos estão
+    entre as k * MAX_TEMPLATES linhas mais próximas.
+    """
+    if COMPACT:
+        import quantized # Importado sob demanda: só é necessário com a galeria compacta
+        return quantized.get_compact(COMPACT).neighbors(q, k, threshold)
+    gallery = db_operations.get_recognition_gallery()
+    multi = gallery.usuarios >= 0 and gallery.usuarios < gallery.vetores.shape[0]
+    idx, dist = nearest(q, gallery, k * db_operations.MAX_TEMPLATES if multi and k > 1 else k)
+    return rows_to_neighbors(gallery, idx, dist, k, multi)
+
+def rows_to_neighbors(gallery: db_operations.Gallery, idx: np.ndarray, dist: np.ndarray, k: int,
+                      multi: bool) -> List[List[Tuple[str, float, Optional[str]]]]:
+    """Linhas mais próximas (em ordem) -> os k usuários distintos mais próximos de cada face."""
+    q_faces = idx.shape[0]
+    if not multi or k == 1:
+        return [[(gallery.nomes[i], d, gallery.perfis[i]) for i, d in zip(idx[f, :k], dist[f, :k])]
+                for f in range(q_faces)]
+    results = []
+    for f in range(q_faces):
+        vistos, candidatos = set(), []
+        for i, d in zip(idx[f], dist[f]):
+            if gallery.donos[i] not in vistos:
+                vistos.add(gallery.donos[i])
+                candidatos.append((gallery.nomes[i], d, gallery.perfis[i]))
+                if len(candidatos) == k:
+                    break
+        results.append(candidatos)
+    return results
+
+def match(descriptors: Any, k: int = 1, threshold: float = THRESH) -> List[List[Match]]:
+    """
+    Compara todas as faces de um frame, (F, 128), contra a galeria inteira.
+    Retorna, para cada face, os k candidatos mais próximos. Candidatos com
+    distância acima de `threshold` são marcados como "Desconhecido" (perfil None).
+    Com a galeria vazia, cada face recebe um único resultado "Desconhecido".
+    """
+    q = _as_batch(descriptors)
+    if q.shape[0] == 0:
+        return []
+    if k == 1 and MATCH_CACHE:
+        import match_cache # Importado sob demanda: evita o import circular (match_cache usa search())
+        return match_cache.get_cache().match(q, threshold)
+    return search(q, k, threshold)
+
+def search(q: np.ndarray, k: int = 1, threshold: float = THRESH) -> List[List[Match]]:
+    """match() sem o cache de resultados: sempre consulta a galeria. `q` é (F, 128) float32."""
+    if SEARCH_BACKEND == "host":
+        import model_host # Importado sob demanda: só é necessário com o host de modelos
+        return model_host.get_client().match(q, k, threshold)
+    if SEARCH_BACKEND == "ivf":
+        import ann_index # Importado sob demanda: só é necessário na busca aproximada
+        vizinhos = ann_index.get_index().search(q, k, IVF_NPROBE)
+        if IVF_EXACT_FALLBACK:
+            rejeitadas = [f for f, c in enumerate(vizinhos) if not c or c[0][1] > threshold]
+            if rejeitadas:
+                for f, c in zip(rejeitadas, _exact_neighbors(q[rejeitadas], k, threshold)):
+                    vizinhos[f] = c
+    else:
+        vizinhos = _exact_neighbors(q, k, threshold)
+    return to_matches(vizinhos, threshold)
+
+def to_matches(vizinhos: List[List[Tuple[str, float, Optional[str]]]], threshold: float = THRESH) -> List[List[Match]]:
+    """[(nome, distancia, perfil)] por face -> Match, com "Desconhecido" acima de `threshold`."""
+    results = []
+    for candidatos in vizinhos:
+        faces = []
+        for nome, d, perfil in candidatos:
+            d = float(d)
+            if d > threshold:
+                faces.append(Match(UNKNOWN, d, None))
+            else:
+                faces.append(Match(nome, d, perfil))
+        if not faces:
+            faces.append(Match(UNKNOWN, float("inf"), None))
+        results.append(faces)
+    return results
+
+def match_one(descriptor: Any, threshold: float = THRESH) -> Match:
+    """Atalho para o melhor resultado de uma única face."""
+    return match(descriptor, k=1, threshold=threshold)[0][0]
+
+def aggregate_templates(amostras: Any, mode: Optional[str] = None, max_templates: int = db_operations.MAX_TEMPLATES,
+                        threshold: float = THRESH) -> Optional[np.ndarray]:
+    """
+    Combina os vetores de uma rajada de cadastro (K, 128). Amostras a mais de
+    `threshold` da amostra central (medoide) são descartadas como capturas
+    ruins ou de outra pessoa. Com mode="media" retorna a média (128,); com
+    "conjunto", até `max_templates` amostras diversas (T, 128), começando pelo
+    medoide e escolhendo sempre a mais distante das já escolhidas.
+    Retorna None se não houver amostras.
+    """
+    mode = mode or TEMPLATE_MODE
+    if mode not in TEMPLATE_MODES:
+        raise ValueError(f"Modo de template desconhecido: {mode!r}. Use um de {TEMPLATE_MODES}.")
+    vecs = _as_batch(amostras)
+    if vecs.shape[0] == 0:
+        return None
+    dist = pairwise_distances(vecs, vecs)
+    medoide = int(np.argmin(dist.sum(axis=1)))
+    manter = dist[medoide] <= threshold
+    vecs = vecs[manter]
+    if mode == "media":
+        return vecs.mean(axis=0).astype(np.float32)
+
+    escolhidas = [int(np.count_nonzero(manter[:medoide]))] # Posição do medoide entre as mantidas
+    minimas = dist[medoide][manter].copy()
+    while len(escolhidas) < min(max_templates, vecs.shape[0]):
+        proxima = int(np.argmax(minimas))
+        if minimas[proxima] == 0.0:
+            break # Restam só amostras repetidas
+        escolhidas.append(proxima)
+        np.minimum(minimas, pairwise_distances(vecs[proxima:proxima + 1], vecs)[0], out=minimas)
+    return vecs[escolhidas]
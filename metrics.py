@@ -0,0 +1,261 @@
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional
+
+# --- Parâmetros das Métricas ---
+# Desligadas por padrão: sem RECOG_METRICS=1 o pipeline recebe metrics=None e
+# cada ponto de medição custa só um teste `if m`.
+ENABLED = os.environ.get("RECOG_METRICS", "0") == "1"
+METRICS_PORT = int(os.environ.get("RECOG_METRICS_PORT", "0")) # 0 = sem endpoint HTTP
+METRICS_JSON = os.environ.get("RECOG_METRICS_JSON") # Arquivo JSON regravado periodicamente
+DUMP_INTERVAL_S = 5.0
+WINDOW = 512 # Amostras guardadas por etapa (histograma móvel)
+OVERLAY_REFRESH_S = 0.5 # O texto sobre o vídeo é recalculado no máximo a cada 0.5 s
+GAUGE_SUFFIXES = ("_taxa", "_segundos") # Razões e tempos: saem como gauge no Prometheus, não como counter
+STAGES = ("captura", "rgb", "deteccao", "rastreamento", "landmarks", "vetor", "match", "exibicao")
+
+class RollingHistogram:
+    """Últimas `window` durações de uma etapa (buffer circular) e totais desde o início."""
+
+    def __init__(self, window: int = WINDOW):
+        self._buf = np.zeros(window, dtype=np.float64)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, segundos: float):
+        with self._lock:
+            self._buf[self.count % len(self._buf)] = segundos
+            self.count += 1
+            self.total += segundos
+
+    def samples(self) -> np.ndarray:
+        with self._lock:
+            return self._buf[:min(self.count, len(self._buf))].copy()
+
+    def stats(self) -> Dict[str, float]:
+        amostras = self.samples() * 1000
+        if not len(amostras):
+            return {"n": self.count}
+        p50, p95, p99 = np.percentile(amostras, [50, 95, 99])
+        return {"n": self.count, "p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3),
+                "p99_ms": round(float(p99), 3), "media_ms": round(float(amostras.mean()), 3)}
+
+class Metrics:
+    """
+    Tempos por etapa (relógio monotônico), contadores e fontes externas (ex.:
+    quadros descartados pelo pipeline). O caminho quente só faz clock() e
+    observe()/count(); percentis e formatação ficam para quem lê.
+    """
+
+    clock = staticmethod(time.perf_counter)
+
+    def __init__(self, window: int = WINDOW):
+        self.window = window
+        self.started = time.monotonic()
+        self._stages: Dict[str, RollingHistogram] = {}
+        self._counters: Dict[str, int] = {}
+        self._sources: List[Callable[[], Dict[str, float]]] = []
+        self._lock = threading.Lock()
+        self._rate_base = (self.started, {})
+        self._overlay = (0.0, [])
+
+    def observe(self, etapa: str, segundos: float):
+        hist = self._stages.get(etapa)
+        if hist is None:
+            with self._lock:
+                hist = self._stages.setdefault(etapa, RollingHistogram(self.window))
+        hist.observe(segundos)
+
+    def count(self, nome: str, n: int = 1):
+        with self._lock:
+            self._counters[nome] = self._counters.get(nome, 0) + n
+
+    def add_source(self, fonte: Callable[[], Dict[str, float]]):
+        """Registra uma função que retorna contadores mantidos em outro lugar (lida só no snapshot)."""
+        self._sources.append(fonte)
+
+    # --- Leitura ---
+
+    def counters(self) -> Dict[str, float]:
+        with self._lock:
+            valores = dict(self._counters)
+        for fonte in self._sources:
+            valores.update(fonte())
+        return valores
+
+    def snapshot(self) -> Dict[str, Any]:
+        contadores = self.counters()
+        capturados = contadores.get("quadros_capturados", 0)
+        return {
+            "uptime_s": round(time.monotonic() - self.started, 1),
+            "etapas": {etapa: hist.stats() for etapa, hist in sorted(self._stages.items())},
+            "contadores": contadores,
+            "taxa_descarte": round(contadores.get("quadros_descartados", 0) / capturados, 4) if capturados else 0.0,
+        }
+
+    def rates(self) -> Dict[str, float]:
+        """Contadores por segundo desde a chamada anterior (ex.: FPS de captura e de processamento)."""
+        agora, contadores = time.monotonic(), self.counters()
+        inicio, base = self._rate_base
+        self._rate_base = (agora, contadores)
+        dt = max(agora - inicio, 1e-9)
+        return {nome: (valor - base.get(nome, 0)) / dt for nome, valor in contadores.items()}
+
+    def overlay_lines(self) -> List[str]:
+        """Linhas curtas para desenhar sobre o vídeo (recalculadas a cada OVERLAY_REFRESH_S)."""
+        agora = time.monotonic()
+        if agora - self._overlay[0] >= OVERLAY_REFRESH_S:
+            self._overlay = (agora, self._overlay_text())
+        return self._overlay[1]
+
+    def _overlay_text(self) -> List[str]:
+        snap = self.snapshot()
+        taxas = self.rates()
+        linhas = [f"captura {taxas.get('quadros_capturados', 0):.1f} fps | proc {taxas.get('quadros_processados', 0):.1f} fps"
+                  f" | descarte {snap['taxa_descarte']:.1%}"]
+        for etapa in STAGES:
+            stats = snap["etapas"].get(etapa)
+            if stats and "p50_ms" in stats:
+                linhas.append(f"{etapa:<12} p50 {stats['p50_ms']:6.1f} ms  p95 {stats['p95_ms']:6.1f} ms")
+        c = snap["contadores"]
+        linhas.append(f"faces {c.get('faces', 0)} | reconhecidas {c.get('reconhecidas', 0)} | "
+                      f"desconhecidas {c.get('desconhecidas', 0)}")
+        return linhas
+
+    def prometheus(self) -> str:
+        """Formato de texto do Prometheus (etapas como summary com quantis da janela móvel)."""
+        linhas = ["# HELP recog_stage_seconds Duração de cada etapa do reconhecimento.",
+                  "# TYPE recog_stage_seconds summary"]
+        for etapa, hist in sorted(self._stages.items()):
+            amostras = hist.samples()
+            if len(amostras):
+                for q, v in zip(("0.5", "0.95", "0.99"), np.percentile(amostras, [50, 95, 99])):
+                    linhas.append(f'recog_stage_seconds{{stage="{etapa}",quantile="{q}"}} {v:.6f}')
+            linhas.append(f'recog_stage_seconds_sum{{stage="{etapa}"}} {hist.total:.6f}')
+            linhas.append(f'recog_stage_seconds_count{{stage="{etapa}"}} {hist.count}')
+        for nome, valor in sorted(self.counters().items()):
+            nome = "recog_" + _metric_name(nome)
+            if nome.endswith(GAUGE_SUFFIXES):
+                linhas += [f"# TYPE {nome} gauge", f"{nome} {valor}"]
+            else:
+                linhas += [f"# TYPE {nome}_total counter", f"{nome}_total {valor}"]
+        snap_taxa = self.snapshot()["taxa_descarte"]
+        linhas += ["# TYPE recog_taxa_descarte gauge", f"recog_taxa_descarte {snap_taxa}"]
+        return "\n".join(linhas) + "\n"
+
+def _metric_name(nome: str) -> str:
+    """Nome aceito pelo Prometheus ([a-zA-Z0-9_]): os contadores por câmera levam o nome dado pelo usuário."""
+    sem_acento = unicodedata.normalize("NFKD", nome).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-zA-Z0-9_]", "_", sem_acento)
+
+# --- Exposição ---
+
+def serve(metrics: Metrics, port: int = METRICS_PORT, host: str = "127.0.0.1"):
+    """Endpoint HTTP em segundo plano: /metrics (Prometheus) e /metrics.json."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                corpo, tipo = metrics.prometheus().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+            elif self.path == "/metrics.json":
+                corpo, tipo = json.dumps(metrics.snapshot(), ensure_ascii=False).encode("utf-8"), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, *args):
+            pass # Sem uma linha no console a cada coleta
+
+    servidor = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=servidor.serve_forever, name="metricas-http", daemon=True).start()
+    return servidor
+
+def dump_periodically(metrics: Metrics, caminho: str, intervalo: float = DUMP_INTERVAL_S) -> threading.Thread:
+    """Regrava `caminho` com o snapshot JSON a cada `intervalo` segundos (troca atômica do arquivo)."""
+    def loop():
+        while True:
+            time.sleep(intervalo)
+            tmp = caminho + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(metrics.snapshot(), f, ensure_ascii=False, indent=2)
+            os.replace(tmp, caminho)
+
+    t = threading.Thread(target=loop, name="metricas-json", daemon=True)
+    t.start()
+    return t
+
+def from_env() -> Optional[Metrics]:
+    """Metrics configurado pelas variáveis RECOG_METRICS*, ou None se desligado."""
+    if not ENABLED:
+        return None
+    metrics = Metrics()
+    if METRICS_PORT:
+        serve(metrics, METRICS_PORT)
+        print(f"Métricas em http://127.0.0.1:{METRICS_PORT}/metrics")
+    if METRICS_JSON:
+        dump_periodically(metrics, METRICS_JSON)
+    return metrics
+
+def draw_overlay(frame: np.ndarray, metrics: Metrics, cor=(255, 255, 0)):
+    """Desenha as linhas de overlay_lines() no canto superior esquerdo do frame."""
+    import cv2
+    for i, linha in enumerate(metrics.overlay_lines()):
+        cv2.putText(frame, linha, (10, 20 + 16 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.45, cor, 1)
+
+# --- Verificação do Custo ---
+
+def overhead_check(iteracoes: int = 200000, etapas_por_frame: int = len(STAGES),
+                   frame_ms: float = 33.3) -> Dict[str, float]:
+    """
+    Mede o custo de um ponto de medição (clock + observe) ligado e desligado e
+    estima a fração de um frame de `frame_ms` gasta com `etapas_por_frame` pontos.
+    """
+    m = Metrics()
+    clock = m.clock
+    t0 = time.perf_counter()
+    for _ in range(iteracoes):
+        t = clock()
+        m.observe("teste", clock() - t)
+    ligado = (time.perf_counter() - t0) / iteracoes
+
+    nenhum = None
+    t0 = time.perf_counter()
+    for _ in range(iteracoes):
+        t = clock() if nenhum else 0.0
+        if nenhum:
+            nenhum.observe("teste", clock() - t)
+    desligado = (time.perf_counter() - t0) / iteracoes
+
+    return {
+        "ns_por_ponto_ligado": round(ligado * 1e9, 1),
+        "ns_por_ponto_desligado": round(desligado * 1e9, 1),
+        "fracao_do_frame_ligado": ligado * etapas_por_frame / (frame_ms / 1000),
+        "fracao_do_frame_desligado": desligado * etapas_por_frame / (frame_ms / 1000),
+    }
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Mede o custo da instrumentação por frame.")
+    parser.add_argument("--frame-ms", type=float, default=33.3, help="Duração de referência de um frame.")
+    parser.add_argument("--limite", type=float, default=0.01, help="Fração máxima do frame aceita (0.01 = 1%%).")
+    args = parser.parse_args()
+
+    r = overhead_check(frame_ms=args.frame_ms)
+    print(f"Ligado:    {r['ns_por_ponto_ligado']:.0f} ns/ponto -> {r['fracao_do_frame_ligado']:.4%} do frame")
+    print(f"Desligado: {r['ns_por_ponto_desligado']:.0f} ns/ponto -> {r['fracao_do_frame_desligado']:.4%} do frame")
+    if r["fracao_do_frame_ligado"] > args.limite:
+        raise SystemExit("FALHA: a instrumentação custa mais que o limite.")
+    print("OK")
@@ -0,0 +1,368 @@
+import os
+import secrets
+import stat
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from multiprocessing import AuthenticationError, shared_memory
+from multiprocessing.connection import Client, Listener
+from typing import Any, List, Optional, Sequence, Tuple
+
+import db_operations # Galeria residente no host
+import matcher # Busca executada no host (SEARCH_BACKEND "host" nos clientes)
+
+# --- Parâmetros do Host de Modelos ---
+# "auto": a UI usa o host se ele estiver rodando, senão carrega os modelos localmente.
+# "1": exige o host; "0": nunca usa.
+USE_HOST = os.environ.get("RECOG_MODEL_HOST", "auto")
+# Chave da conexão: RECOG_MODEL_HOST_KEY ou, sem ela, uma chave aleatória gerada
+# na primeira execução do host e guardada em run_dir()/model-host.key (0600)
+AUTHKEY_ENV = os.environ.get("RECOG_MODEL_HOST_KEY", "")
+DEFAULT_KEY = "recog-local" # Chave fixa de versões anteriores: o host se recusa a usá-la
+CHIP_SIZE = 150 # Recortes alinhados do get_face_chips (150x150 RGB)
+
+def run_dir() -> str:
+    """
+    Pasta do usuário (0700) com o socket e a chave: XDG_RUNTIME_DIR, ou uma pasta
+    própria na pasta temporária; no Windows, a pasta local do usuário.
+    """
+    if sys.platform == "win32":
+        pasta = os.path.join(os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "recog")
+        os.makedirs(pasta, exist_ok=True)
+        return pasta
+    base = os.environ.get("XDG_RUNTIME_DIR")
+    pasta = os.path.join(base, "recog") if base else os.path.join(tempfile.gettempdir(), f"recog-{os.getuid()}")
+    os.makedirs(pasta, mode=0o700, exist_ok=True)
+    info = os.lstat(pasta)
+    # Na pasta temporária compartilhada, outro usuário pode ter criado a pasta antes
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError(f"{pasta} não é uma pasta deste usuário")
+    if stat.S_IMODE(info.st_mode) != 0o700:
+        os.chmod(pasta, 0o700)
+    return pasta
+
+def default_address() -> str:
+    """Named pipe no Windows; socket Unix na pasta do usuário (run_dir) nos demais sistemas."""
+    if sys.platform == "win32":
+        return r"\\.\pipe\recog-model-host"
+    return os.path.join(run_dir(), "model-host.sock")
+
+def load_authkey(criar: bool = False) -> bytes:
+    """
+    Chave de autenticação da conexão. Sem RECOG_MODEL_HOST_KEY, lê o arquivo de
+    chave; com criar=True (o host), gera uma chave aleatória se ele não existir.
+    Sem o arquivo, o cliente recebe FileNotFoundError (o host nunca rodou).
+    """
+    if AUTHKEY_ENV:
+        return AUTHKEY_ENV.encode()
+    caminho = os.path.join(run_dir(), "model-host.key")
+    if criar and not os.path.exists(caminho):
+        try:
+            fd = os.open(caminho, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass # Outro host criou ao mesmo tempo
+        else:
+            with os.fdopen(fd, "w") as f:
+                f.write(secrets.token_hex(32))
+    with open(caminho) as f:
+        return f.read().strip().encode()
+
+# --- Lado do Host ---
+
+class _HostConnection(threading.Thread):
+    """Atende um cliente (uma thread de UI): imagens chegam pela memória compartilhada do cliente."""
+
+    def __init__(self, host: "ModelHost", conn):
+        super().__init__(name="host-cliente", daemon=True)
+        self.host = host
+        self.conn = conn
+        self.shm: Optional[shared_memory.SharedMemory] = None
+
+    def _image(self, shape: Tuple[int, ...], offset: int = 0) -> np.ndarray:
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=offset)
+
+    def _attach(self, nome: str):
+        self._detach()
+        self.shm = shared_memory.SharedMemory(name=nome)
+        if sys.platform != "win32":
+            # O bloco pertence ao cliente: o resource_tracker do host não deve removê-lo ao sair
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+
+    def _detach(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm = None
+
+    def handle(self, pedido: tuple) -> Any:
+        detector, sp, rec = self.host.models
+        op = pedido[0]
+        if op == "buffer":
+            self._attach(pedido[1])
+            return None
+        if op == "detect":
+            _, shape, upsample = pedido
+            return [(r.left(), r.top(), r.right(), r.bottom()) for r in detector(self._image(shape), upsample)]
+        if op == "landmarks":
+            import dlib
+            _, shape, caixas = pedido
+            img = self._image(shape)
+            formas = [sp(img, dlib.rectangle(*caixa)) for caixa in caixas]
+            return [[(p.x, p.y) for p in forma.parts()] for forma in formas]
+        if op == "descriptors":
+            _, n = pedido
+            chips = self._image((n, CHIP_SIZE, CHIP_SIZE, 3))
+            return np.array([np.asarray(d) for d in rec.compute_face_descriptor(list(chips))], dtype=np.float32)
+        if op == "match":
+            _, q, k, threshold = pedido
+            return matcher.match(q, k, threshold)
+        if op == "version":
+            db_operations.get_recognition_gallery() # Confere se outro processo alterou o DB
+            # O pid separa as versões de um host reiniciado (o contador recomeça)
+            return os.getpid(), db_operations.get_gallery_version()
+        if op == "status":
+            return self.host.status()
+        raise ValueError(f"Operação desconhecida: {op!r}")
+
+    def run(self):
+        self.host.clients += 1
+        try:
+            while True:
+                try:
+                    pedido = self.conn.recv()
+                except (EOFError, OSError):
+                    break
+                try:
+                    self.conn.send(("ok", self.handle(pedido)))
+                except Exception as exc:
+                    self.conn.send(("erro", f"{type(exc).__name__}: {exc}"))
+        finally:
+            self.host.clients -= 1
+            self._detach()
+            self.conn.close()
+
+class ModelHost:
+    """
+    Processo de longa duração que mantém os modelos do Dlib e a galeria em
+    memória e atende os processos de interface por um socket local. Reiniciar
+    a interface não recarrega nada, e várias interfaces compartilham os mesmos
+    modelos. Cada conexão é atendida em uma thread (o Dlib libera o GIL).
+    """
+
+    def __init__(self, address: Optional[str] = None, predictor: Optional[str] = None, recog: Optional[str] = None):
+        if AUTHKEY_ENV == DEFAULT_KEY:
+            raise ValueError(f"RECOG_MODEL_HOST_KEY={DEFAULT_KEY!r} é a chave padrão antiga; "
+                             "remova a variável (o host gera uma chave aleatória) ou use outra chave.")
+        self.address = address or default_address()
+        self.authkey = load_authkey(criar=True)
+        import recognition
+        inicio = time.perf_counter()
+        self.models = recognition.load_models(predictor or recognition.PREDICTOR, recog or recognition.RECOG)
+        db_operations.get_recognition_gallery() # Galeria residente desde o início
+        if matcher.SEARCH_BACKEND == "ivf":
+            import ann_index
+            ann_index.get_index()
+        self.load_seconds = time.perf_counter() - inicio
+        self.started = time.monotonic()
+        self.clients = 0
+
+    def status(self) -> dict:
+        gallery = db_operations.get_recognition_gallery()
+        return {"pid": os.getpid(), "uptime_s": round(time.monotonic() - self.started, 1),
+                "carga_s": round(self.load_seconds, 2), "clientes": self.clients,
+                "usuarios": gallery.usuarios, "busca": matcher.SEARCH_BACKEND}
+
+    def serve_forever(self):
+        if sys.platform != "win32" and os.path.exists(self.address):
+            os.unlink(self.address) # Socket de uma execução anterior
+        with Listener(self.address, authkey=self.authkey) as listener:
+            print(f"Host de modelos pronto em {self.address} (carga em {self.load_seconds:.1f} s)")
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError):
+                    continue # Cliente com authkey errada ou que desistiu da conexão
+                _HostConnection(self, conn).start()
+
+# --- Lado do Cliente ---
+
+class _Channel:
+    """Conexão de uma thread do cliente, com seu próprio bloco de memória compartilhada."""
+
+    def __init__(self, address: str, authkey: bytes):
+        self.conn = Client(address, authkey=authkey)
+        self.shm: Optional[shared_memory.SharedMemory] = None
+
+    def reserve(self, nbytes: int) -> memoryview:
+        if self.shm is None or self.shm.size < nbytes:
+            if self.shm is not None:
+                self.shm.close()
+                self.shm.unlink()
+            self.shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 640 * 480 * 3))
+            self.call(("buffer", self.shm.name))
+        return self.shm.buf
+
+    def put(self, arrays: Sequence[np.ndarray]):
+        """Copia as imagens, em sequência, para o bloco compartilhado."""
+        total = sum(a.nbytes for a in arrays)
+        buf = self.reserve(total)
+        pos = 0
+        for a in arrays:
+            np.ndarray(a.shape, dtype=np.uint8, buffer=buf, offset=pos)[...] = a
+            pos += a.nbytes
+
+    def call(self, pedido: tuple) -> Any:
+        self.conn.send(pedido)
+        estado, resposta = self.conn.recv()
+        if estado != "ok":
+            raise RuntimeError(f"Host de modelos: {resposta}")
+        return resposta
+
+    def close(self):
+        self.conn.close()
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+
+class ModelHostClient:
+    """
+    Cliente do host. Cada thread que chama usa uma conexão própria, então as
+    etapas do pipeline continuam em paralelo (o host atende cada uma em uma thread).
+    """
+
+    def __init__(self, address: Optional[str] = None):
+        self.address = address or default_address()
+        self.authkey = load_authkey()
+        self._local = threading.local()
+        self._channels: List[_Channel] = []
+        self._lock = threading.Lock()
+        self.status = self._channel().call(("status",)) # Falha aqui se o host não estiver rodando
+
+    def _channel(self) -> _Channel:
+        canal = getattr(self._local, "canal", None)
+        if canal is None:
+            canal = self._local.canal = _Channel(self.address, self.authkey)
+            with self._lock:
+                self._channels.append(canal)
+        return canal
+
+    def detect(self, img: np.ndarray, upsample: int = 0) -> List[Tuple[int, int, int, int]]:
+        canal = self._channel()
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        canal.put([img])
+        return canal.call(("detect", img.shape, upsample))
+
+    def landmarks(self, img: np.ndarray, caixas: Sequence[Tuple[int, int, int, int]]) -> List[List[Tuple[int, int]]]:
+        canal = self._channel()
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        canal.put([img])
+        return canal.call(("landmarks", img.shape, list(caixas)))
+
+    def descriptors(self, chips: Sequence[np.ndarray]) -> np.ndarray:
+        canal = self._channel()
+        canal.put([np.ascontiguousarray(c, dtype=np.uint8) for c in chips])
+        return canal.call(("descriptors", len(chips)))
+
+    def match(self, q: np.ndarray, k: int = 1, threshold: float = matcher.THRESH) -> List[List[matcher.Match]]:
+        return self._channel().call(("match", np.ascontiguousarray(q, dtype=np.float32), k, threshold))
+
+    def gallery_version(self) -> Tuple[int, Any]:
+        """Versão da galeria do host, para invalidar caches de resultados do lado do cliente."""
+        return self._channel().call(("version",))
+
+    def models(self) -> Tuple[Any, Any, Any]:
+        """(detector, sp, rec) remotos, com a mesma interface dos objetos do Dlib usados por recognition.py."""
+        return RemoteDetector(self), RemoteShapePredictor(self), RemoteFaceRecognizer(self)
+
+    def close(self):
+        with self._lock:
+            for canal in self._channels:
+                canal.close()
+            self._channels.clear()
+
+# --- Modelos Remotos (substitutos dos objetos do Dlib) ---
+
+class RemoteDetector:
+    def __init__(self, client: ModelHostClient):
+        self.client = client
+
+    def __call__(self, img: np.ndarray, upsample: int = 0):
+        import dlib
+        return [dlib.rectangle(*caixa) for caixa in self.client.detect(img, upsample)]
+
+class RemoteShapePredictor:
+    def __init__(self, client: ModelHostClient):
+        self.client = client
+
+    def __call__(self, img: np.ndarray, rect: Any):
+        import dlib
+        pontos = dlib.points()
+        for x, y in self.client.landmarks(img, [(rect.left(), rect.top(), rect.right(), rect.bottom())])[0]:
+            pontos.append(dlib.point(x, y))
+        return dlib.full_object_detection(rect, pontos)
+
+class RemoteFaceRecognizer:
+    def __init__(self, client: ModelHostClient):
+        self.client = client
+
+    def compute_face_descriptor(self, chips: Any, *args) -> np.ndarray:
+        """Só a forma em lote usada por recognition.embed_chips: uma lista de recortes 150x150."""
+        if isinstance(chips, np.ndarray) and chips.ndim == 3:
+            return self.client.descriptors([chips])[0]
+        return self.client.descriptors(list(chips))
+
+_client: Optional[ModelHostClient] = None
+
+def connect(address: Optional[str] = None) -> Optional[ModelHostClient]:
+    """
+    Conecta ao host conforme RECOG_MODEL_HOST. Em caso de sucesso, a busca na
+    galeria também passa a ser feita no host (matcher SEARCH_BACKEND "host").
+    Retorna None se o host não estiver disponível (e USE_HOST não for "1").
+    """
+    global _client
+    if USE_HOST == "0":
+        return None
+    try:
+        _client = ModelHostClient(address)
+    except (OSError, EOFError, AuthenticationError) as e:
+        # AuthenticationError: host de outro usuário ou com outra chave
+        if USE_HOST == "1":
+            raise RuntimeError(f"Host de modelos indisponível em {address or default_address()}: {e}")
+        return None
+    matcher.set_search_backend("host")
+    return _client
+
+def get_client() -> ModelHostClient:
+    if _client is None:
+        raise RuntimeError("Não conectado ao host de modelos (use model_host.connect()).")
+    return _client
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Mantém os modelos do Dlib e a galeria carregados para as interfaces.")
+    parser.add_argument("--endereco", default=None, help=f"Socket/named pipe (padrão: {default_address()}).")
+    parser.add_argument("--status", action="store_true", help="Só consulta um host em execução.")
+    args = parser.parse_args()
+
+    if args.status:
+        try:
+            print(ModelHostClient(args.endereco).status)
+        except (OSError, EOFError, AuthenticationError) as e:
+            print(f"Host de modelos indisponível: {type(e).__name__}: {e}")
+            raise SystemExit(1)
+        raise SystemExit
+    try:
+        host = ModelHost(args.endereco)
+    except ValueError as e:
+        print(f"Erro: {e}")
+        raise SystemExit(1)
+    except RuntimeError as e:
+        print(f"Erro ao carregar modelos do Dlib: {e}")
+        raise SystemExit(1)
+    try:
+        host.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,377 @@
+import threading
+import time
+import numpy as np
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from frame_buffers import FramePool # Buffers reutilizáveis, um pool por câmera
+import matcher # Galeria compartilhada por todas as câmeras
+import recognition # Detecção e vetor facial
+import tracking as tracking_mod # Rastreamento entre frames (um FaceTracker por câmera)
+from pipeline import Frame, FrameResult # Mesmos tipos do pipeline de uma câmera
+
+# --- Parâmetros do Modo Multicâmera ---
+WORKERS = 2 # Threads de reconhecimento compartilhadas por todas as câmeras
+MAX_SKIP = 8 # Maior intervalo de frames que a política adaptativa pode impor
+RELAX_AFTER = 30 # Frames atendidos em dia antes de a política voltar a processar mais frames
+
+class StreamConfig(NamedTuple):
+    nome: str
+    fonte: Any # Índice da câmera, URL RTSP ou arquivo de vídeo
+    prioridade: float = 1.0 # Peso no escalonador (ex.: entrada 3, corredor 1)
+    processar_cada: int = 1 # Reconhece 1 a cada N frames capturados
+    tracking: bool = True
+
+class FrameSkipPolicy:
+    """
+    Quais frames de uma câmera vão para o reconhecimento. Processa 1 a cada
+    `every` frames; adaptativa, aumenta o intervalo (até `max_every`) quando
+    o escalonador não dá conta da câmera (o frame pendente foi substituído
+    antes de ser atendido) e volta aos poucos para `every` quando ela está em dia.
+    """
+
+    def __init__(self, every: int = 1, adaptive: bool = True, max_every: int = MAX_SKIP):
+        self.base = max(1, every)
+        self.every = self.base
+        self.adaptive = adaptive
+        self.max_every = max(max_every, self.base)
+        self._em_dia = 0
+
+    def admit(self, seq: int) -> bool:
+        return seq % self.every == 0
+
+    def feedback(self, atrasado: bool):
+        if not self.adaptive:
+            return
+        if atrasado:
+            self.every = min(self.max_every, self.every + 1)
+            self._em_dia = 0
+        else:
+            self._em_dia += 1
+            if self._em_dia >= RELAX_AFTER and self.every > self.base:
+                self.every -= 1
+                self._em_dia = 0
+
+class Stream:
+    """Uma câmera: captura própria, frame pendente para o escalonador e último resultado."""
+
+    def __init__(self, config: StreamConfig, cap: Any):
+        self.config = config
+        self.nome = config.nome
+        self.cap = cap
+        self.skip = FrameSkipPolicy(config.processar_cada)
+        self.pool = FramePool()
+        self.tracker: Optional[tracking_mod.FaceTracker] = None
+        self.captured = 0
+        self.processed = 0
+        self.skipped = 0 # Frames pulados pela política
+        self.dropped = 0 # Frames substituídos antes de serem atendidos
+        self.ended = False
+        self._frame_cond = threading.Condition()
+        self._latest_frame: Optional[Frame] = None
+        self._result_lock = threading.Lock()
+        self._latest_result: Optional[FrameResult] = None
+
+    def latest_frame(self) -> Optional[Frame]:
+        with self._frame_cond:
+            return self._latest_frame
+
+    def wait_frame(self, after_seq: int = 0, timeout: Optional[float] = None) -> Optional[Frame]:
+        with self._frame_cond:
+            self._frame_cond.wait_for(
+                lambda: self.ended or (self._latest_frame is not None and self._latest_frame.seq > after_seq), timeout)
+            frame = self._latest_frame
+            return frame if frame is not None and frame.seq > after_seq else None
+
+    def latest_result(self) -> Optional[FrameResult]:
+        with self._result_lock:
+            return self._latest_result
+
+    def stats(self) -> Dict[str, int]:
+        return {"capturados": self.captured, "processados": self.processed, "pulados": self.skipped,
+                "descartados": self.dropped, "processar_cada": self.skip.every}
+
+class FairScheduler:
+    """
+    Divide a capacidade de reconhecimento entre as câmeras na proporção das
+    prioridades (escalonamento por passos: cada atendimento avança o "tempo
+    virtual" da câmera em 1/prioridade e a próxima atendida é a de menor tempo
+    com frame pendente). Cada câmera tem um único frame pendente (o mais
+    recente) e nunca é atendida por duas threads ao mesmo tempo, então os
+    frames de uma câmera são processados em ordem.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending: Dict[str, Frame] = {}
+        self._busy: set = set()
+        self._vtime: Dict[str, float] = {}
+        self._peso: Dict[str, float] = {}
+        self.served: Dict[str, int] = {}
+        self._now = 0.0 # Tempo virtual do último atendimento
+        self._closed = False
+
+    def register(self, nome: str, prioridade: float):
+        with self._cond:
+            self._peso[nome] = max(float(prioridade), 1e-3)
+            self._vtime[nome] = self._now
+            self.served[nome] = 0
+
+    def offer(self, nome: str, frame: Frame) -> bool:
+        """Torna `frame` o pendente da câmera. Retorna True se substituiu um frame não atendido."""
+        with self._cond:
+            substituiu = nome in self._pending
+            if not substituiu and nome not in self._busy:
+                # Câmera que ficou sem frames não acumula crédito para depois
+                self._vtime[nome] = max(self._vtime[nome], self._now)
+            self._pending[nome] = frame
+            self._cond.notify()
+            return substituiu
+
+    def next(self, timeout: Optional[float] = None) -> Optional[Tuple[str, Frame]]:
+        with self._cond:
+            def elegiveis():
+                return [n for n in self._pending if n not in self._busy]
+            self._cond.wait_for(lambda: self._closed or elegiveis(), timeout)
+            candidatos = elegiveis()
+            if self._closed or not candidatos:
+                return None
+            nome = min(candidatos, key=lambda n: self._vtime[n])
+            self._now = self._vtime[nome]
+            self._busy.add(nome)
+            return nome, self._pending.pop(nome)
+
+    def done(self, nome: str):
+        with self._cond:
+            self._busy.discard(nome)
+            self._vtime[nome] += 1.0 / self._peso[nome]
+            self.served[nome] += 1
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+class MultiCameraPipeline:
+    """
+    Várias câmeras (índices, URLs RTSP ou arquivos) em um só processo, com a
+    galeria em memória compartilhada. Cada câmera captura na sua thread;
+    `workers` threads de reconhecimento atendem as câmeras pelo FairScheduler,
+    e cada câmera pula frames pela sua política. O detector e a ResNet de
+    recognition.load_models têm uma instância por thread de reconhecimento.
+    """
+
+    def __init__(self, configs: Sequence[StreamConfig], detector: Any, sp: Any, rec: Any,
+                 validate: Callable[[], bool] = lambda: True, workers: int = WORKERS,
+                 threshold: float = matcher.THRESH, detect_every: int = tracking_mod.DETECT_EVERY,
+                 open_capture: Optional[Callable[[Any], Any]] = None, metrics: Any = None, quality: Any = None):
+        if open_capture is None:
+            import cv2
+            open_capture = cv2.VideoCapture
+        nomes = [c.nome for c in configs]
+        if len(set(nomes)) != len(nomes):
+            raise ValueError("Os nomes das câmeras precisam ser únicos.")
+        self.detector, self.sp, self.rec = detector, sp, rec
+        self.validate = validate
+        self.threshold = threshold
+        self.metrics = metrics
+        self.quality = quality # face_quality.QualityGate opcional, compartilhado pelas câmeras
+        self.scheduler = FairScheduler()
+        self.streams: Dict[str, Stream] = {}
+        self._parar = threading.Event()
+        for config in configs:
+            stream = Stream(config, open_capture(config.fonte))
+            if config.tracking:
+                stream.tracker = tracking_mod.FaceTracker(detector, sp, rec, detect_every, threshold=threshold,
+                                                          policy=recognition.DetectionPolicy(adaptive=True),
+                                                          metrics=metrics, quality=quality)
+            self.streams[config.nome] = stream
+            self.scheduler.register(config.nome, config.prioridade)
+        self._policies = {nome: recognition.DetectionPolicy(adaptive=True) for nome in self.streams}
+        self._threads = ([threading.Thread(target=self._capture_loop, args=(s,), name=f"captura-{s.nome}", daemon=True)
+                          for s in self.streams.values()]
+                         + [threading.Thread(target=self._worker, name=f"reconhecimento-{i}", daemon=True)
+                            for i in range(workers)])
+        if metrics:
+            metrics.add_source(self._counters)
+            if quality:
+                metrics.add_source(quality.stats)
+
+    def _counters(self) -> Dict[str, int]:
+        valores = {}
+        for s in self.streams.values():
+            for chave, valor in (("quadros_capturados", s.captured), ("quadros_processados", s.processed),
+                                 ("quadros_descartados", s.dropped)):
+                valores[chave] = valores.get(chave, 0) + valor
+                valores[f"{chave}_{s.nome}"] = valor
+        return valores
+
+    # --- Controle ---
+
+    def start(self) -> "MultiCameraPipeline":
+        for t in self._threads:
+            t.start()
+        return self
+
+    def stop(self):
+        self._parar.set()
+        self.scheduler.close()
+        for t in self._threads:
+            t.join(timeout=1.0)
+        for s in self.streams.values():
+            s.cap.release()
+
+    @property
+    def running(self) -> bool:
+        return not self._parar.is_set() and not all(s.ended for s in self.streams.values())
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {nome: dict(s.stats(), atendidos=self.scheduler.served[nome]) for nome, s in self.streams.items()}
+
+    # --- Etapas ---
+
+    def _capture_loop(self, stream: Stream):
+        seq = 0
+        shape = None
+        while not self._parar.is_set():
+            ok, bgr = stream.cap.read(stream.pool.acquire(shape)) if shape else stream.cap.read()
+            if not ok:
+                break # Fim do vídeo ou câmera desconectada: só esta câmera para
+            shape = bgr.shape
+            seq += 1
+            frame = Frame(seq, time.monotonic(), bgr, recognition.to_rgb(bgr, dst=stream.pool.acquire(shape)))
+            with stream._frame_cond:
+                stream._latest_frame = frame
+                stream._frame_cond.notify_all()
+            stream.captured += 1
+            # Com rastreamento, o FaceTracker precisa de frames próximos: a política só reduz a cadência
+            if not stream.skip.admit(seq):
+                stream.skipped += 1
+                continue
+            atrasado = self.scheduler.offer(stream.nome, frame)
+            if atrasado:
+                stream.dropped += 1
+            stream.skip.feedback(atrasado)
+        with stream._frame_cond:
+            stream.ended = True
+            stream._frame_cond.notify_all()
+
+    def _worker(self):
+        while not self._parar.is_set():
+            item = self.scheduler.next(timeout=0.1)
+            if item is None:
+                continue
+            nome, frame = item
+            try:
+                self._process(self.streams[nome], frame)
+            finally:
+                self.scheduler.done(nome)
+
+    def _process(self, stream: Stream, frame: Frame):
+        validar = self.validate()
+        if stream.tracker is not None:
+            tracks = stream.tracker.process(frame.rgb, validate=validar)
+            matches = [t.match for t in tracks] if validar and tracks else None
+            result = FrameResult(frame.seq, frame.timestamp, [t.rect for t in tracks], stream.tracker.vectors(),
+                                 matches, [t.id for t in tracks], stream.tracker.low_quality)
+        else:
+            rects = self._policies[stream.nome].detect(self.detector, frame.rgb)
+            shapes, baixa = None, None
+            if self.quality:
+                rects, shapes, baixa = self.quality.filter(self.sp, frame.rgb, rects)
+            vecs = recognition.embed_faces(self.sp, self.rec, frame.rgb, rects, self.metrics, shapes)
+            matches = None
+            if validar and len(vecs):
+                matches = [candidatos[0] for candidatos in matcher.match(vecs, k=1, threshold=self.threshold)]
+            result = FrameResult(frame.seq, frame.timestamp, list(rects), vecs, matches, low_quality=baixa)
+        with stream._result_lock:
+            stream._latest_result = result
+            stream.processed += 1
+
+# --- Verificação do Escalonador ---
+
+def scheduler_check(prioridades: Dict[str, float], servicos: int = 2000, workers: int = 1) -> Dict[str, float]:
+    """
+    Simula câmeras sempre com frame pendente e retorna a fração dos
+    atendimentos de cada uma (deve seguir a proporção das prioridades).
+    """
+    agenda = FairScheduler()
+    for nome, prioridade in prioridades.items():
+        agenda.register(nome, prioridade)
+        agenda.offer(nome, Frame(0, 0.0, np.empty(0)))
+    ocupados: List[str] = []
+    for _ in range(servicos):
+        while len(ocupados) < workers:
+            nome, _frame = agenda.next(timeout=0)
+            ocupados.append(nome)
+        nome = ocupados.pop(0)
+        agenda.done(nome)
+        agenda.offer(nome, Frame(0, 0.0, np.empty(0)))
+    total = sum(agenda.served.values())
+    return {nome: agenda.served[nome] / total for nome in prioridades}
+
+def parse_stream(texto: str) -> StreamConfig:
+    """"nome=fonte[,prioridade[,processar_cada]]", ex.: "entrada=0,3" ou "corredor=rtsp://10.0.0.5:554/stream,1,2"."""
+    from startup import parse_source
+    nome, _, resto = texto.partition("=")
+    if not resto:
+        nome, resto = texto, texto
+    fonte, *numeros = resto.split(",")
+    prioridade = float(numeros[0]) if numeros else 1.0
+    cada = int(numeros[1]) if len(numeros) > 1 else 1
+    return StreamConfig(nome, parse_source(fonte), prioridade, cada)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Reconhecimento em várias câmeras com modelos e galeria compartilhados.")
+    parser.add_argument("cameras", nargs="*", help='"nome=fonte[,prioridade[,processar_cada]]", ex.: entrada=0,3 corredor=1')
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--verificar", action="store_true", help="Só verifica a divisão justa do escalonador.")
+    args = parser.parse_args()
+
+    if args.verificar or not args.cameras:
+        prioridades = {"entrada": 3.0, "corredor": 1.0, "estoque": 1.0}
+        fracoes = scheduler_check(prioridades)
+        esperado = {n: p / sum(prioridades.values()) for n, p in prioridades.items()}
+        for nome in prioridades:
+            print(f"{nome:<10} prioridade {prioridades[nome]:.0f}: {fracoes[nome]:.1%} (esperado {esperado[nome]:.1%})")
+        if any(abs(fracoes[n] - esperado[n]) > 0.01 for n in prioridades):
+            raise SystemExit("FALHA: divisão fora da proporção das prioridades.")
+        print("OK")
+        raise SystemExit
+
+    import cv2
+    import db_operations
+    import face_quality
+    try:
+        modelos = recognition.load_models()
+    except RuntimeError as e:
+        print(f"Erro ao carregar modelos do Dlib: {e}")
+        raise SystemExit(1)
+    db_operations.get_recognition_gallery() # Galeria carregada uma vez para todas as câmeras
+    multi = MultiCameraPipeline([parse_stream(c) for c in args.cameras], *modelos, workers=args.workers,
+                                quality=face_quality.from_env()).start()
+    print("[Q]=Sair")
+    vistos = {nome: 0 for nome in multi.streams}
+    while multi.running:
+        for nome, stream in multi.streams.items():
+            frame = stream.latest_frame()
+            if frame is None or frame.seq == vistos[nome]:
+                continue
+            vistos[nome] = frame.seq
+            imagem = frame.bgr.copy()
+            result = stream.latest_result()
+            if result is not None and result.matches:
+                for r, (pessoa, _dist, perfil) in zip(result.rects, result.matches):
+                    cor = (0, 255, 0) if pessoa != matcher.UNKNOWN else (0, 0, 255)
+                    cv2.rectangle(imagem, (r.left(), r.top()), (r.right(), r.bottom()), cor, 2)
+                    rotulo = f"{pessoa} - {perfil}" if pessoa != matcher.UNKNOWN else pessoa
+                    cv2.putText(imagem, rotulo, (r.left(), r.top() - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, cor, 2)
+            cv2.imshow(nome, imagem)
+        if cv2.waitKey(5) & 0xFF == ord('q'):
+            break
+    for nome, estatisticas in multi.stats().items():
+        print(nome, estatisticas)
+    multi.stop()
+    cv2.destroyAllWindows()
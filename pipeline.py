@@ -0,0 +1,387 @@
+import collections
+import threading
+import time
+import numpy as np
+from typing import Any, Callable, List, NamedTuple, Optional
+
+import db_operations # DESCRIPTOR_DIM
+import face_quality # Filtro de qualidade antes do vetor facial
+from frame_buffers import FramePool # Buffers reutilizáveis para os frames
+import matcher # Comparação com a galeria
+import recognition # Etapas de detecção e vetor facial
+import tracking as tracking_mod # Modo detectar uma vez / rastrear entre frames
+
+# --- Parâmetros do Pipeline ---
+QUEUE_SIZE = 2 # Frames aguardando em cada fila; os mais antigos são descartados
+ENROLL_SAMPLES = 5 # Frames da rajada de cadastro
+ENROLL_INTERVAL_S = 0.15 # Intervalo mínimo entre amostras (variação de pose/expressão)
+ENROLL_TIMEOUT_S = 5.0
+
+class DropOldestQueue:
+    """
+    Fila limitada entre etapas. Quando cheia, descarta o item mais antigo em vez
+    de bloquear o produtor: a etapa seguinte sempre trabalha no frame mais recente.
+    """
+
+    def __init__(self, maxsize: int = QUEUE_SIZE):
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def put(self, item: Any):
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """Retorna o próximo item, ou None se a fila foi fechada ou o tempo acabou."""
+        with self._cond:
+            if not self._items and not self._closed:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            return self._items.popleft()
+
+    def drain(self, limit: int) -> List[Any]:
+        """Retira até `limit` itens já disponíveis, sem esperar."""
+        with self._cond:
+            itens = []
+            while self._items and len(itens) < limit:
+                itens.append(self._items.popleft())
+            return itens
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        return len(self._items)
+
+class Frame(NamedTuple):
+    seq: int
+    timestamp: float
+    bgr: np.ndarray
+    rgb: Optional[np.ndarray] = None # Convertido uma vez na captura; compartilhado por detecção e exibição
+
+class FrameResult(NamedTuple):
+    """Resultado do reconhecimento de um frame."""
+    seq: int
+    timestamp: float
+    rects: list # Retângulos do Dlib, no frame de origem
+    vecs: np.ndarray # (F, 128) float32
+    matches: Optional[List[matcher.Match]] # Só preenchido com a validação ligada
+    track_ids: Optional[List[int]] = None # IDs dos rastros (modo de rastreamento)
+    low_quality: Optional[list] = None # Faces detectadas sem vetor: pequenas, borradas ou de lado (face_quality)
+
+class _Worker(threading.Thread):
+    """
+    Thread de uma etapa: consome a fila de entrada até o pipeline parar. Com
+    `batch` > 1, `processar` recebe uma lista com o item esperado e os que já
+    estavam na fila (até `batch`).
+    """
+
+    def __init__(self, nome: str, entrada: DropOldestQueue, processar: Callable[[Any], None], parar: threading.Event,
+                 batch: int = 1):
+        super().__init__(name=nome, daemon=True)
+        self._entrada = entrada
+        self._processar = processar
+        self._parar = parar
+        self._batch = batch
+
+    def run(self):
+        while not self._parar.is_set():
+            item = self._entrada.get(timeout=0.1)
+            if item is None:
+                continue
+            if self._batch > 1:
+                item = [item] + self._entrada.drain(self._batch - 1)
+            self._processar(item)
+
+class RecognitionPipeline:
+    """
+    Captura -> detecção -> vetor facial/matching, cada etapa em suas próprias
+    threads com filas limitadas entre elas. O Dlib libera o GIL no código C++,
+    então as etapas rodam em paralelo com a interface. A exibição lê sempre o
+    último frame capturado (latest_frame) e sobrepõe o último resultado pronto
+    (latest_result), sem esperar o reconhecimento.
+
+    Com `tracking=True`, detecção e vetor facial completos só rodam a cada
+    `detect_every` frames (tracking.FaceTracker); nos demais as faces são
+    seguidas por correlação em uma única thread, que precisa ver os frames em ordem.
+
+    Com `embed_batch` > 1, a etapa de vetor facial junta os frames que já
+    estão na fila e calcula os vetores de todos em uma só chamada em lote.
+
+    Com `metrics` (metrics.Metrics), cada etapa registra sua duração e o
+    pipeline publica os contadores de quadros, faces e descartes.
+
+    Com `quality` (face_quality.QualityGate), faces pequenas, borradas ou de
+    lado não passam pela ResNet: ficam em FrameResult.low_quality, sem vetor
+    nem identidade, e a rajada de cadastro usa o melhor frame de cada intervalo.
+
+    Sem `detector`, o pipeline só captura (ex.: modelos do Dlib não carregados
+    ou ainda carregando; ver attach_models).
+    """
+
+    def __init__(self, cap: Any, detector: Any = None, sp: Any = None, rec: Any = None,
+                 validate: Callable[[], bool] = lambda: False, queue_size: int = QUEUE_SIZE,
+                 detect_workers: int = 1, embed_workers: int = 1, threshold: float = matcher.THRESH,
+                 tracking: bool = False, detect_every: int = tracking_mod.DETECT_EVERY,
+                 detect_policy: Optional[recognition.DetectionPolicy] = None, embed_batch: int = 1,
+                 metrics: Any = None, quality: Optional[face_quality.QualityGate] = None):
+        self.cap = cap
+        self.detector, self.sp, self.rec = detector, sp, rec
+        self.validate = validate
+        self.threshold = threshold
+        self.detect_policy = detect_policy or recognition.DetectionPolicy()
+        self.detect_queue = DropOldestQueue(queue_size)
+        self.embed_queue = DropOldestQueue(queue_size)
+        self._parar = threading.Event()
+        self._frame_cond = threading.Condition()
+        self._latest_frame: Optional[Frame] = None
+        self._result_lock = threading.Lock()
+        self._latest_result: Optional[FrameResult] = None
+        self.pool = FramePool()
+        self.captured = 0
+        self.processed = 0
+        self.metrics = metrics
+        if metrics:
+            metrics.add_source(lambda: {"quadros_capturados": self.captured, "quadros_processados": self.processed,
+                                        "quadros_descartados": self.dropped})
+        self.quality = quality
+        if metrics and quality:
+            metrics.add_source(quality.stats)
+
+        self.tracker = None
+        self._config = dict(tracking=tracking, detect_every=detect_every, detect_workers=detect_workers,
+                            embed_workers=embed_workers, embed_batch=embed_batch)
+        self._started = False
+        self._threads: List[threading.Thread] = [threading.Thread(target=self._capture_loop, name="captura", daemon=True)]
+        if detector is not None:
+            self._threads += self._model_threads(detector)
+
+    def _model_threads(self, detector: Any) -> List[threading.Thread]:
+        c = self._config
+        if c["tracking"]:
+            self.tracker = tracking_mod.FaceTracker(detector, self.sp, self.rec, c["detect_every"],
+                                                    threshold=self.threshold, policy=self.detect_policy,
+                                                    metrics=self.metrics, quality=self.quality)
+            return [_Worker("rastreamento", self.detect_queue, self._track, self._parar)]
+        return ([_Worker(f"deteccao-{i}", self.detect_queue, self._detect, self._parar) for i in range(c["detect_workers"])]
+                + [_Worker(f"vetor-{i}", self.embed_queue, self._embed, self._parar, batch=c["embed_batch"])
+                   for i in range(c["embed_workers"])])
+
+    # --- Controle ---
+
+    def start(self) -> "RecognitionPipeline":
+        self._started = True
+        for t in self._threads:
+            t.start()
+        return self
+
+    def attach_models(self, detector: Any, sp: Any, rec: Any):
+        """
+        Liga a detecção e o vetor facial em um pipeline criado sem modelos (só
+        captura), para exibir a câmera enquanto os modelos ainda carregam.
+        """
+        if self.detector is not None:
+            return
+        self.sp, self.rec = sp, rec
+        novas = self._model_threads(detector)
+        self._threads += novas
+        if self._started:
+            for t in novas:
+                t.start()
+        self.detector = detector # Por último: a captura só enfileira frames quando há detector
+
+    def stop(self):
+        self._parar.set()
+        self.detect_queue.close()
+        self.embed_queue.close()
+        for t in self._threads:
+            t.join(timeout=1.0)
+
+    @property
+    def running(self) -> bool:
+        return not self._parar.is_set()
+
+    @property
+    def dropped(self) -> int:
+        """Frames descartados pela contrapressão (fila cheia) em todas as etapas."""
+        return self.detect_queue.dropped + self.embed_queue.dropped
+
+    # --- Etapas ---
+
+    def _capture_loop(self):
+        seq = 0
+        shape = None
+        m = self.metrics
+        while not self._parar.is_set():
+            t0 = m.clock() if m else 0.0
+            # Lê direto em um buffer do pool (o OpenCV só aloca se o tamanho mudar)
+            ok, bgr = self.cap.read(self.pool.acquire(shape)) if shape else self.cap.read()
+            if not ok:
+                self._parar.set() # Fim do vídeo ou câmera desconectada
+                with self._frame_cond:
+                    self._frame_cond.notify_all()
+                break
+            shape = bgr.shape
+            seq += 1
+            if m:
+                t1 = m.clock()
+                m.observe("captura", t1 - t0)
+            rgb = recognition.to_rgb(bgr, dst=self.pool.acquire(shape))
+            if m:
+                m.observe("rgb", m.clock() - t1)
+            frame = Frame(seq, time.monotonic(), bgr, rgb)
+            with self._frame_cond:
+                self._latest_frame = frame
+                self._frame_cond.notify_all()
+            self.captured += 1
+            if self.detector is not None:
+                self.detect_queue.put(frame)
+
+    def _detect(self, frame: Frame):
+        m = self.metrics
+        t0 = m.clock() if m else 0.0
+        rects = self.detect_policy.detect(self.detector, frame.rgb)
+        if m:
+            m.observe("deteccao", m.clock() - t0)
+        self.embed_queue.put((frame, frame.rgb, rects))
+
+    def _embed(self, itens):
+        # Um item (frame, rgb, rects) ou, com embed_batch > 1, uma lista deles:
+        # os recortes de todos os frames vão em uma única chamada à ResNet
+        if not isinstance(itens, list):
+            itens = [itens]
+        m = self.metrics
+        baixa = [None] * len(itens)
+        if self.quality:
+            # Pontos calculados pelo filtro são reaproveitados pelo get_face_chip
+            t0 = m.clock() if m else 0.0
+            filtrados = []
+            for i, (frame, rgb, rects) in enumerate(itens):
+                aprovados, shapes, baixa[i] = self.quality.filter(self.sp, rgb, rects)
+                filtrados.append((frame, rgb, aprovados, shapes))
+            if m:
+                m.observe("qualidade", m.clock() - t0)
+        else:
+            filtrados = [(frame, rgb, rects, None) for frame, rgb, rects in itens]
+        por_frame = recognition.embed_many(self.sp, self.rec, [(rgb, rects, shapes) for _, rgb, rects, shapes in filtrados], m)
+        validar = self.validate()
+        for (frame, _, rects, _), vecs, reprovados in zip(filtrados, por_frame, baixa):
+            matches = None
+            if validar and len(vecs):
+                t0 = m.clock() if m else 0.0
+                matches = [candidatos[0] for candidatos in matcher.match(vecs, k=1, threshold=self.threshold)]
+                if m:
+                    m.observe("match", m.clock() - t0)
+            self._publish(FrameResult(frame.seq, frame.timestamp, list(rects), vecs, matches, low_quality=reprovados))
+
+    def _track(self, frame: Frame):
+        validar = self.validate()
+        tracks = self.tracker.process(frame.rgb, validate=validar)
+        matches = None
+        if validar and tracks:
+            matches = [t.match for t in tracks]
+        self._publish(FrameResult(frame.seq, frame.timestamp, [t.rect for t in tracks],
+                                  self.tracker.vectors(), matches, [t.id for t in tracks], self.tracker.low_quality))
+
+    def _publish(self, result: FrameResult):
+        # Com várias threads por etapa, um frame antigo pode terminar depois de um novo
+        with self._result_lock:
+            if self._latest_result is None or result.seq > self._latest_result.seq:
+                self._latest_result = result
+                self.processed += 1
+        m = self.metrics
+        if m:
+            m.count("faces", len(result.rects))
+            if result.matches:
+                nomes = [r.nome for r in result.matches if r is not None]
+                desconhecidas = nomes.count(matcher.UNKNOWN)
+                m.count("reconhecidas", len(nomes) - desconhecidas)
+                m.count("desconhecidas", desconhecidas)
+
+    # --- Leitura pela Interface ---
+
+    def latest_frame(self) -> Optional[Frame]:
+        with self._frame_cond:
+            return self._latest_frame
+
+    def wait_frame(self, after_seq: int = 0, timeout: Optional[float] = None) -> Optional[Frame]:
+        """Espera um frame mais novo que `after_seq` (ritmo da câmera). None se o tempo acabar."""
+        with self._frame_cond:
+            self._frame_cond.wait_for(
+                lambda: self._parar.is_set() or (self._latest_frame is not None and self._latest_frame.seq > after_seq),
+                timeout)
+            frame = self._latest_frame
+            if frame is None or frame.seq <= after_seq:
+                return None
+            return frame
+
+    def latest_result(self) -> Optional[FrameResult]:
+        with self._result_lock:
+            return self._latest_result
+
+    # --- Cadastro ---
+
+    def capture_burst(self, samples: int = ENROLL_SAMPLES, interval: float = ENROLL_INTERVAL_S,
+                      timeout: float = ENROLL_TIMEOUT_S) -> np.ndarray:
+        """
+        Rajada de cadastro: calcula o vetor facial de `samples` frames novos,
+        espaçados por `interval`, na thread de quem chama (o modo de rastreamento
+        reaproveita vetores entre frames e não serve como amostra). Frames sem
+        exatamente uma face são ignorados. Com o filtro de qualidade, frames
+        reprovados também, e cada amostra é o frame de maior pontuação visto
+        durante o seu intervalo, não o primeiro. Retorna (K, 128) float32, K <= samples.
+        """
+        amostras = []
+        seq = 0
+        inicio = time.monotonic()
+        melhor = None # (pontuacao, rgb, rect, pontos) do intervalo atual
+        fim_intervalo = 0.0
+
+        def calcular():
+            _, rgb, rect, shape = melhor
+            amostras.append(recognition.embed_faces(self.sp, self.rec, rgb, [rect],
+                                                    shapes=[shape] if shape is not None else None)[0])
+
+        while len(amostras) < samples and self.running:
+            agora = time.monotonic()
+            if melhor is not None and agora >= fim_intervalo:
+                calcular()
+                melhor = None
+                continue
+            restante = timeout - (agora - inicio)
+            if restante <= 0:
+                break
+            frame = self.wait_frame(seq, min(restante, fim_intervalo - agora) if melhor is not None else restante)
+            if frame is None:
+                if not self.running:
+                    break
+                continue # Fim do intervalo ou do tempo: tratados no início do laço
+            seq = frame.seq
+            rects = recognition.detect_faces(self.detector, frame.rgb)
+            if len(rects) != 1:
+                continue
+            pontuacao, shape = 0.0, None
+            if self.quality:
+                qualidade, shape = self.quality.assess(self.sp, frame.rgb, rects[0])
+                if not qualidade.ok:
+                    continue
+                pontuacao = qualidade.pontuacao
+            if melhor is None:
+                fim_intervalo = time.monotonic() + interval
+            if melhor is None or pontuacao > melhor[0]:
+                melhor = (pontuacao, frame.rgb, rects[0], shape)
+        if melhor is not None and len(amostras) < samples:
+            calcular()
+        if not amostras:
+            return np.empty((0, db_operations.DESCRIPTOR_DIM), dtype=np.float32)
+        return np.stack(amostras)
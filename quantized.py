@@ -0,0 +1,330 @@
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+import db_operations # Galeria de reconhecimento (cache em memória)
+import matcher # Distâncias exatas e agrupamento por usuário
+
+# --- Parâmetros da Galeria Compacta ---
+COMPACT_MODES = ("float16", "int8")
+RESCORE_TOP = 8 # Linhas por face devolvidas pela busca (no mínimo k * MAX_TEMPLATES)
+BLOCK_ROWS = 1024 # Códigos convertidos por vez para o produto com a consulta (512 KB: ficam no cache)
+CHUNK_ROWS = 65536 # Linhas codificadas por vez na construção
+ROUNDING_SLACK = 1e-3 # Folga para o arredondamento float32 no cálculo das distâncias
+REBUILD_RATIO = 0.5 # Com mais da metade das linhas alteradas, a cópia compacta é refeita do zero
+
+class CompactGallery:
+    """
+    Cópia compacta dos descritores da galeria em um array contíguo: float16
+    (metade da memória) ou int8 com uma escala por dimensão (um quarto). As
+    distâncias de todas as linhas são calculadas sobre os códigos; no int8 a
+    escala vai para a consulta, e os códigos entram no produto como estão.
+
+    A distância aproximada erra no máximo `max_error` (a norma do erro de
+    codificação de uma linha, mais uma folga de arredondamento). Por isso a
+    decisão de uma face só é reavaliada em float32 quando a aproximação não a
+    garante: a melhor distância a menos de `max_error` do threshold, ou a linha
+    de outro usuário a menos de 2 * `max_error` da melhor. Só as linhas que
+    ainda podem ser a melhor são lidas em float32.
+
+    A matriz float32 não fica na memória: com a galeria compacta ligada
+    (matcher.set_compact), o cache de db_operations a mantém em um arquivo
+    mapeado (db_operations.set_gallery_spill).
+    """
+
+    def __init__(self, gallery: db_operations.Gallery, modo: str = "int8"):
+        if modo not in COMPACT_MODES:
+            raise ValueError(f"Modo compacto desconhecido: {modo!r}. Use um de {COMPACT_MODES}.")
+        self.modo = modo
+        self.rescored = 0 # Faces reavaliadas em float32
+        self.rescored_rows = 0 # Linhas float32 lidas nessas reavaliações
+        self.searched = 0
+        self.updated_rows = 0 # Linhas recodificadas por update() (sem refazer tudo)
+        self.rebuilds = 0
+        self._build(gallery)
+
+    def _build(self, gallery: db_operations.Gallery):
+        vetores = gallery.vetores
+        n, dim = vetores.shape
+        if self.modo == "float16":
+            self.scale = None
+            self._codes = np.empty((n, dim), dtype=np.float16)
+        else:
+            # Em blocos: a galeria pode ser um arquivo mapeado, que não é trazido inteiro para a memória
+            self._amax = np.zeros(dim, dtype=np.float32)
+            for inicio in range(0, n, CHUNK_ROWS):
+                np.maximum(self._amax, np.abs(vetores[inicio:inicio + CHUNK_ROWS]).max(axis=0), out=self._amax)
+            self.scale = np.where(self._amax > 0, self._amax / 127.0, 1.0).astype(np.float32)
+            self._codes = np.empty((n, dim), dtype=np.int8)
+        self._normas2 = np.empty(n, dtype=np.float32)
+        # Nome e norma float32 de cada linha codificada: update() compara com a galeria nova
+        self._nomes = np.array(gallery.nomes, dtype=object)
+        self._fonte_normas2 = np.array(gallery.normas2, dtype=np.float32)
+        self._max_norma2 = float(self._fonte_normas2.max()) if n else 0.0
+        self.n = n
+        for inicio in range(0, n, CHUNK_ROWS):
+            self._encode(np.arange(inicio, min(n, inicio + CHUNK_ROWS)), vetores[inicio:inicio + CHUNK_ROWS])
+        self.gallery = gallery
+        self.rebuilds += 1
+
+    def _encode(self, linhas: np.ndarray, vetores: np.ndarray):
+        if self.scale is None:
+            self._codes[linhas] = vetores
+        else:
+            self._codes[linhas] = np.clip(np.rint(vetores / self.scale), -127, 127)
+        bloco = self._codes[linhas].astype(np.float32)
+        if self.scale is not None:
+            bloco *= self.scale
+        self._normas2[linhas] = np.einsum("ij,ij->i", bloco, bloco)
+
+    @property
+    def max_error(self) -> float:
+        """Maior diferença possível entre a distância aproximada de uma linha e a float32."""
+        if self.scale is None:
+            # float16: erro relativo de até 2^-11 por dimensão
+            return float(np.sqrt(self._max_norma2)) * 2.0 ** -11 + ROUNDING_SLACK
+        # int8: erro de até meio passo da escala por dimensão (os vetores nunca saem de _amax)
+        return float(np.linalg.norm(self.scale)) / 2 + ROUNDING_SLACK
+
+    def update(self, gallery: db_operations.Gallery):
+        """
+        Acompanha uma nova versão da galeria recodificando só as linhas que
+        mudaram. O cache de db_operations acrescenta os cadastros no fim e, na
+        exclusão, move a última linha para a posição liberada. Por isso basta
+        comparar o nome e a norma float32 de cada linha. Refaz tudo se a maior
+        parte mudou ou se, no int8, um vetor novo sai da escala.
+        """
+        n = len(gallery.vetores)
+        m = min(n, self.n)
+        mudou = (self._nomes[:m] != gallery.nomes[:m]) | (self._fonte_normas2[:m] != gallery.normas2[:m])
+        linhas = np.concatenate([np.flatnonzero(mudou), np.arange(m, n)])
+        if len(linhas) > REBUILD_RATIO * max(n, 1):
+            self._build(gallery)
+            return
+        vetores = np.asarray(gallery.vetores[linhas], dtype=np.float32)
+        if self.scale is not None and len(linhas) and (np.abs(vetores).max(axis=0) > self._amax).any():
+            self._build(gallery)
+            return
+        if n > self._codes.shape[0]:
+            capacidade = max(n, 2 * self._codes.shape[0], 16)
+            for nome in ("_codes", "_normas2", "_nomes", "_fonte_normas2"):
+                antigo = getattr(self, nome)
+                novo = np.empty((capacidade,) + antigo.shape[1:], dtype=antigo.dtype)
+                novo[:m] = antigo[:m]
+                setattr(self, nome, novo)
+        self._encode(linhas, vetores)
+        self._nomes[linhas] = gallery.nomes[linhas]
+        self._fonte_normas2[linhas] = gallery.normas2[linhas]
+        if len(linhas):
+            # Só cresce: a norma de uma linha removida continua sendo uma cota válida
+            self._max_norma2 = max(self._max_norma2, float(gallery.normas2[linhas].max()))
+        self.n = n
+        self.gallery = gallery
+        self.updated_rows += len(linhas)
+
+    @property
+    def codes(self) -> np.ndarray:
+        return self._codes[:self.n]
+
+    @property
+    def normas2(self) -> np.ndarray:
+        return self._normas2[:self.n]
+
+    @property
+    def nbytes(self) -> int:
+        """Memória da cópia compacta (códigos, normas e o que update() guarda por linha)."""
+        return (self._codes.nbytes + self._normas2.nbytes + self._nomes.nbytes + self._fonte_normas2.nbytes +
+                (self.scale.nbytes if self.scale is not None else 0))
+
+    @property
+    def resident_bytes(self) -> int:
+        """Total em memória: a cópia compacta, as normas float32 e a matriz float32 se ela não for um arquivo mapeado."""
+        vetores = self.gallery.vetores
+        return self.nbytes + self.gallery.normas2.nbytes + (0 if isinstance(vetores, np.memmap) else vetores.nbytes)
+
+    def approx_distances(self, q: np.ndarray) -> np.ndarray:
+        """Distâncias (F, N) aproximadas, calculadas sobre os códigos."""
+        n = self.n
+        # Com int8, q . (c * s) = (q * s) . c: a escala é aplicada uma vez na consulta
+        qs = np.ascontiguousarray(q * self.scale if self.scale is not None else q, dtype=np.float32)
+        produto = np.empty((n, q.shape[0]), dtype=np.float32)
+        # O BLAS só multiplica float32: cada bloco de códigos é convertido em um buffer
+        # pequeno, que fica no cache, em vez de dequantizar a galeria a cada consulta
+        bloco = np.empty((min(BLOCK_ROWS, n), q.shape[1]), dtype=np.float32)
+        for inicio in range(0, n, BLOCK_ROWS):
+            fim = min(n, inicio + BLOCK_ROWS)
+            b = bloco[:fim - inicio]
+            np.copyto(b, self._codes[inicio:fim], casting="unsafe")
+            np.dot(b, qs.T, out=produto[inicio:fim])
+        d2 = produto.T
+        d2 *= -2.0
+        d2 += np.einsum("ij,ij->i", q, q)[:, np.newaxis]
+        d2 += self.normas2[np.newaxis, :]
+        np.maximum(d2, 0.0, out=d2)
+        return np.sqrt(d2, out=d2)
+
+    def nearest_rows(self, q: np.ndarray, linhas: int, threshold: float = matcher.THRESH) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        As `linhas` melhores linhas de cada face, (indices, distancias) em ordem
+        crescente. A decisão (usuário mais próximo, ou desconhecido) é sempre a
+        da busca float32. As distâncias são float32 nas faces reavaliadas; nas
+        demais, a do usuário reconhecido é uma cota superior e as outras são
+        cotas inferiores, a até `max_error` da float32. Assim a folga até o
+        threshold e a distância até o 2º usuário nunca são superestimadas
+        (match_cache usa as duas no raio seguro).
+        """
+        n = self.n
+        linhas = min(linhas, n)
+        if linhas == 0:
+            return np.empty((q.shape[0], 0), dtype=np.intp), np.empty((q.shape[0], 0), dtype=np.float32)
+        dist = self.approx_distances(q)
+        idx = np.argpartition(dist, linhas - 1, axis=1)[:, :linhas] if linhas < n else np.broadcast_to(np.arange(n), dist.shape)
+        top = np.take_along_axis(dist, idx, axis=1)
+        order = np.argsort(top, axis=1)
+        idx, top = np.take_along_axis(idx, order, axis=1), np.take_along_axis(top, order, axis=1)
+        self.searched += q.shape[0]
+
+        g = self.gallery
+        donos = g.donos if g.donos is not None else g.nomes
+        erro = self.max_error
+        resultado = np.maximum(top - erro, 0.0) # Cotas inferiores
+        for f in range(q.shape[0]):
+            melhor = top[f, 0]
+            if melhor - erro > threshold:
+                continue # Desconhecido garantido
+            # Linhas que ainda podem ser a melhor em float32 (a melhor fica a até `erro` de `melhor`)
+            janela = top[f] <= melhor + 2 * erro
+            if janela[-1] and linhas < n:
+                janela = None # Pode haver linhas fora das `linhas`: cai na reavaliação abaixo
+            elif melhor + erro < threshold and (donos[idx[f, janela]] == donos[idx[f, 0]]).all():
+                resultado[f, donos[idx[f]] == donos[idx[f, 0]]] = melhor + erro # Reconhecido garantido
+                continue
+            # Em ordem crescente: no arquivo mapeado, as leituras seguem a ordem das páginas
+            candidatas = np.sort(np.flatnonzero(dist[f] <= melhor + 2 * erro) if janela is None else idx[f, janela])
+            exatas = matcher.pairwise_distances(q[f:f + 1], g.vetores[candidatas], g.normas2[candidatas])[0]
+            self.rescored += 1
+            self.rescored_rows += len(candidatas)
+            # As candidatas (com a distância float32) e o restante das `linhas` (cota inferior), em ordem
+            restantes = ~np.isin(idx[f], candidatas)
+            todas_idx = np.concatenate([candidatas, idx[f, restantes]])
+            todas_dist = np.concatenate([exatas, resultado[f, restantes]])
+            ordem = np.argsort(todas_dist, kind="stable")[:linhas]
+            idx[f], resultado[f] = todas_idx[ordem], todas_dist[ordem]
+        order = np.argsort(resultado, axis=1, kind="stable")
+        return np.take_along_axis(idx, order, axis=1), np.take_along_axis(resultado, order, axis=1)
+
+    def neighbors(self, q: np.ndarray, k: int = 1, threshold: float = matcher.THRESH):
+        """Mesmo formato de matcher._exact_neighbors: [(nome, distancia, perfil)] por face."""
+        g = self.gallery
+        multi = 0 <= g.usuarios < g.vetores.shape[0]
+        idx, dist = self.nearest_rows(q, max(RESCORE_TOP, k * db_operations.MAX_TEMPLATES if multi else k), threshold)
+        return matcher.rows_to_neighbors(g, idx, dist, k, multi)
+
+# --- Instância do Processo ---
+
+_compact: Optional[CompactGallery] = None
+_compact_version: Optional[int] = None
+_compact_lock = threading.Lock()
+
+def get_compact(modo: str) -> CompactGallery:
+    """Galeria compacta do processo, atualizada (só as linhas alteradas) quando a galeria de reconhecimento muda."""
+    global _compact, _compact_version
+    with _compact_lock:
+        gallery = db_operations.get_recognition_gallery()
+        versao = db_operations.get_gallery_version()
+        if _compact is None or _compact.modo != modo:
+            _compact = CompactGallery(gallery, modo)
+        elif _compact_version != versao:
+            _compact.update(gallery)
+        else:
+            _compact.gallery = gallery # Mesma versão: só a referência para a reavaliação
+        _compact_version = versao
+        return _compact
+
+# --- Relatório de Memória e Concordância ---
+
+def compact_report(n_usuarios: int = 100000, n_consultas: int = 1000, ruido: float = 0.4,
+                   threshold: float = matcher.THRESH, seed: int = 0) -> List[Dict[str, float]]:
+    """
+    Compara cada modo compacto com a busca float32 em uma galeria sintética.
+    Metade das consultas são novas amostras de pessoas cadastradas, metade de
+    pessoas desconhecidas. Como no cache de db_operations com a galeria
+    compacta, a matriz float32 dos modos compactos fica em um arquivo mapeado.
+    Informa a memória da cópia percorrida na busca, o total residente, a fração
+    de decisões (nome ou desconhecido) iguais às da busca float32, as faces e
+    linhas reavaliadas e a latência.
+    """
+    import tempfile
+    import time
+    import ann_index
+
+    vetores = ann_index.synthetic_gallery(n_usuarios, seed)
+    nomes = np.array([f"u{i}" for i in range(n_usuarios)], dtype=object)
+    perfis = np.full(n_usuarios, "Usuário", dtype=object)
+    gallery = db_operations.Gallery(nomes, perfis, vetores, np.einsum("ij,ij->i", vetores, vetores))
+
+    rng = np.random.default_rng(seed + 1)
+    metade = n_consultas // 2
+    alvo = rng.choice(n_usuarios, metade, replace=False)
+    ruido_vec = rng.standard_normal((metade, vetores.shape[1])).astype(np.float32)
+    ruido_vec *= ruido / np.linalg.norm(ruido_vec, axis=1, keepdims=True)
+    q = np.concatenate([vetores[alvo] + ruido_vec, ann_index.synthetic_gallery(n_consultas - metade, seed + 2)])
+
+    def decisoes(idx, dist):
+        return [nomes[i[0]] if d[0] <= threshold else None for i, d in zip(idx, dist)]
+
+    def isoladas(buscar, n: int = 50) -> float:
+        """ms por consulta de uma face só (caso comum: uma pessoa diante da câmera)."""
+        t0 = time.perf_counter()
+        for f in range(min(n, len(q))):
+            buscar(q[f:f + 1])
+        return (time.perf_counter() - t0) / min(n, len(q)) * 1000
+
+    t0 = time.perf_counter()
+    idx, dist = matcher.nearest(q, gallery, 1)
+    t_exato = (time.perf_counter() - t0) / len(q)
+    exato = decisoes(idx, dist)
+
+    mb_float32 = (vetores.nbytes + gallery.normas2.nbytes) / 2**20
+    linhas = [{"modo": "float32", "mb": mb_float32, "mb_total": mb_float32, "decisoes_iguais": 1.0,
+               "reavaliadas": 0.0, "linhas_lidas": 0.0, "erro_medio_distancia": 0.0, "ms_por_consulta": t_exato * 1000,
+               "ms_face_isolada": isoladas(lambda x: matcher.nearest(x, gallery, 1))}]
+    mapeada = np.memmap(tempfile.TemporaryFile(), dtype=np.float32, mode="w+", shape=vetores.shape)
+    mapeada[:] = vetores
+    gallery_mapeada = gallery._replace(vetores=mapeada)
+    for modo in COMPACT_MODES:
+        compacta = CompactGallery(gallery_mapeada, modo)
+        erro = float(np.abs(compacta.approx_distances(q[:100])[np.arange(min(100, len(q))), idx[:100, 0]] - dist[:100, 0]).mean())
+        t0 = time.perf_counter()
+        c_idx, c_dist = compacta.nearest_rows(q, RESCORE_TOP, threshold)
+        t_modo = (time.perf_counter() - t0) / len(q)
+        linhas.append({
+            "modo": modo,
+            "mb": compacta.nbytes / 2**20,
+            "mb_total": compacta.resident_bytes / 2**20,
+            "decisoes_iguais": float(np.mean([a == b for a, b in zip(decisoes(c_idx, c_dist), exato)])),
+            "reavaliadas": compacta.rescored / len(q),
+            "linhas_lidas": compacta.rescored_rows / len(q),
+            "erro_medio_distancia": erro,
+            "ms_por_consulta": t_modo * 1000,
+            "ms_face_isolada": isoladas(lambda x: compacta.nearest_rows(x, RESCORE_TOP, threshold)),
+        })
+    return linhas
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Memória e concordância da galeria compacta contra a float32.")
+    parser.add_argument("--usuarios", type=int, default=100000)
+    parser.add_argument("--consultas", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"--- Galeria compacta vs float32 ({args.usuarios} usuários, {args.consultas} consultas, THRESH={matcher.THRESH}) ---")
+    base = None
+    for linha in compact_report(args.usuarios, args.consultas):
+        base = base or linha["mb"]
+        print(f"{linha['modo']:<8} | busca {linha['mb']:8.1f} MB ({linha['mb'] / base:5.1%}) | "
+              f"total {linha['mb_total']:8.1f} MB ({linha['mb_total'] / base:5.1%}) | "
+              f"decisões iguais={linha['decisoes_iguais']:.4f} | erro médio da distância={linha['erro_medio_distancia']:.4f} | "
+              f"reavaliadas em float32={linha['reavaliadas']:.1%} ({linha['linhas_lidas']:.2f} linhas/consulta) | "
+              f"{linha['ms_por_consulta']:.3f} ms/consulta em lote, {linha['ms_face_isolada']:.2f} ms com uma face")
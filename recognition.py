@@ -0,0 +1,246 @@
+import collections
+import os
+import threading
+import cv2
+import dlib
+import numpy as np
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+import db_operations # DESCRIPTOR_DIM
+
+# --- Modelos do Dlib ---
+PREDICTOR = "shape_predictor_5_face_landmarks.dat"
+RECOG = "dlib_face_recognition_resnet_model_v1.dat"
+
+# --- Resolução da Detecção ---
+DETECT_SCALE = float(os.environ.get("RECOG_DETECT_SCALE", "1.0")) # Fração da resolução usada pelo HOG
+DETECT_UPSAMPLE = int(os.environ.get("RECOG_UPSAMPLE", "1")) # Ampliações internas do HOG
+HOG_WINDOW = 80 # Menor face (px) que o HOG encontra sem ampliação
+MIN_DETECT_SCALE = 0.25 # Menor escala escolhida pela política adaptativa
+ADAPT_WINDOW = 15 # Detecções consideradas pela política adaptativa
+ADAPT_MARGIN = 0.7 # Folga para faces um pouco menores que as vistas recentemente
+PROBE_EVERY = 10 # A cada N detecções usa a configuração padrão (faces novas e distantes)
+
+class PerThreadModel:
+    """
+    Modelo do Dlib com uma instância por thread. O detector HOG e a ResNet
+    guardam estado interno durante a chamada e não podem atender duas threads
+    ao mesmo tempo (multicâmera, etapas do pipeline, executor do servidor).
+    A instância carregada em load_models fica com a primeira thread que
+    chamar; as demais carregam a sua na primeira chamada.
+    """
+
+    def __init__(self, carregar: Callable[[], Any]):
+        self._carregar = carregar
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._livre: Any = carregar() # Falha já em load_models se faltar o arquivo .dat
+
+    def get(self) -> Any:
+        modelo = getattr(self._local, "modelo", None)
+        if modelo is None:
+            with self._lock:
+                modelo, self._livre = self._livre, None
+            if modelo is None:
+                modelo = self._carregar()
+            self._local.modelo = modelo
+        return modelo
+
+    def __call__(self, *args):
+        return self.get()(*args)
+
+    def __getattr__(self, nome: str) -> Any:
+        return getattr(self.get(), nome) # Ex.: compute_face_descriptor
+
+def load_models(predictor: str = PREDICTOR, recog: str = RECOG):
+    """
+    Carrega o detector HOG, o preditor de 5 pontos e o modelo ResNet.
+    Retorna (detector, sp, rec). Levanta RuntimeError se faltar um arquivo .dat.
+    O detector e a ResNet são PerThreadModel; o preditor de pontos não guarda
+    estado entre chamadas e é compartilhado.
+    """
+    detector = PerThreadModel(dlib.get_frontal_face_detector)
+    sp = dlib.shape_predictor(predictor)
+    rec = PerThreadModel(lambda: dlib.face_recognition_model_v1(recog))
+    return detector, sp, rec
+
+# --- Etapas do Reconhecimento Facial ---
+# Funções compartilhadas por main.py, main_gui.py e pipeline.py. Os modelos do
+# Dlib são recebidos como parâmetro para que cada ponto de entrada controle
+# quando e como eles são carregados.
+
+def to_rgb(frame: np.ndarray, dst: Optional[np.ndarray] = None) -> np.ndarray:
+    """Converte o frame BGR da câmera para RGB (formato esperado pelo Dlib), opcionalmente em `dst`."""
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=dst)
+
+def detect_faces(detector: Any, rgb: np.ndarray, upsample: Optional[int] = None, scale: Optional[float] = None):
+    """
+    Detecta as faces (HOG) e retorna os retângulos do Dlib em coordenadas do
+    frame original. Com `scale` < 1 o HOG roda em uma cópia reduzida em tons de
+    cinza e os retângulos são remapeados: o custo cai com o número de pixels,
+    e o preditor de pontos e o get_face_chip continuam usando o frame completo.
+    """
+    upsample = DETECT_UPSAMPLE if upsample is None else upsample
+    scale = DETECT_SCALE if scale is None else scale
+    if scale >= 1.0:
+        return list(detector(rgb, upsample))
+
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return [dlib.rectangle(int(round(r.left() / scale)), int(round(r.top() / scale)),
+                           int(round(r.right() / scale)), int(round(r.bottom() / scale)))
+            for r in detector(small, upsample)]
+
+class DetectionPolicy:
+    """
+    Escolhe a escala e o upsample da detecção. Fixa, usa `scale`/`upsample`;
+    adaptativa, reduz o frame o quanto as faces vistas nas últimas detecções
+    permitem (a menor delas ainda precisa cobrir a janela de 80 px do HOG) e
+    volta à configuração padrão quando não há faces ou a cada PROBE_EVERY
+    detecções, para não perder quem acabou de chegar mais longe da câmera.
+    """
+
+    def __init__(self, scale: float = DETECT_SCALE, upsample: int = DETECT_UPSAMPLE, adaptive: bool = False,
+                 window: int = ADAPT_WINDOW, min_scale: float = MIN_DETECT_SCALE):
+        self.scale = scale
+        self.upsample = upsample
+        self.adaptive = adaptive
+        self.min_scale = min_scale
+        self._sizes = collections.deque(maxlen=window) # Menor face (px) de cada detecção, ou None
+        self._calls = 0
+
+    def settings(self) -> Tuple[float, int]:
+        """(escala, upsample) da próxima detecção."""
+        sizes = [s for s in list(self._sizes) if s is not None]
+        if not self.adaptive or not sizes or self._calls % PROBE_EVERY == 0:
+            return self.scale, self.upsample
+        menor = min(sizes) * ADAPT_MARGIN
+        if menor >= HOG_WINDOW:
+            up, scale = 0, HOG_WINDOW / menor
+        else:
+            up, scale = 1, HOG_WINDOW / 2 / menor
+        # Degraus de 0.05 evitam redimensionar para um tamanho diferente a cada frame
+        scale = min(1.0, max(self.min_scale, np.ceil(scale * 20) / 20))
+        return float(scale), up
+
+    def observe(self, rects: Sequence):
+        self._sizes.append(min(r.height() for r in rects) if len(rects) else None)
+
+    def detect(self, detector: Any, rgb: np.ndarray) -> List:
+        scale, up = self.settings()
+        self._calls += 1
+        rects = detect_faces(detector, rgb, up, scale)
+        self.observe(rects)
+        return rects
+
+def face_chips(sp: Any, rgb: np.ndarray, rects: Sequence, shapes: Optional[Sequence] = None) -> List[np.ndarray]:
+    """
+    Alinha e recorta (150x150) cada face a partir dos 5 pontos do preditor.
+    `shapes` são pontos já calculados (ex.: pelo face_quality.QualityGate), na ordem de `rects`.
+    """
+    if not len(rects):
+        return []
+    deteccoes = dlib.full_object_detections()
+    for shape in (shapes if shapes is not None else (sp(rgb, r) for r in rects)):
+        deteccoes.append(shape)
+    return dlib.get_face_chips(rgb, deteccoes)
+
+def embed_chips(rec: Any, chips: Sequence[np.ndarray]) -> np.ndarray:
+    """
+    Vetores faciais de vários recortes em uma única chamada em lote à ResNet,
+    em vez de uma chamada por face. Retorna (F, 128) float32.
+    """
+    if not len(chips):
+        return np.empty((0, db_operations.DESCRIPTOR_DIM), dtype=np.float32)
+    return np.array([np.asarray(d) for d in rec.compute_face_descriptor(list(chips))], dtype=np.float32)
+
+def embed_faces(sp: Any, rec: Any, rgb: np.ndarray, rects: Sequence, metrics: Any = None,
+                shapes: Optional[Sequence] = None) -> np.ndarray:
+    """Calcula o vetor facial de cada retângulo (em lote). Retorna (F, 128) float32."""
+    return embed_many(sp, rec, [(rgb, rects, shapes)], metrics)[0]
+
+def embed_many(sp: Any, rec: Any, itens: Sequence[Tuple], metrics: Any = None) -> List[np.ndarray]:
+    """
+    Como embed_faces, mas para vários frames (rgb, retângulos[, pontos]) com
+    uma única chamada à ResNet. Retorna um array (F_i, 128) por frame, na mesma
+    ordem. Com `metrics` (metrics.Metrics), mede os pontos faciais e a ResNet separadamente.
+    """
+    t0 = metrics.clock() if metrics else 0.0
+    chips, contagens = [], []
+    for rgb, rects, *shapes in itens:
+        recortes = face_chips(sp, rgb, rects, shapes[0] if shapes else None)
+        chips += recortes
+        contagens.append(len(recortes))
+    if metrics:
+        t1 = metrics.clock()
+        metrics.observe("landmarks", t1 - t0)
+    vecs = embed_chips(rec, chips)
+    if metrics and chips:
+        metrics.observe("vetor", metrics.clock() - t1)
+    return np.split(vecs, np.cumsum(contagens)[:-1]) if contagens else []
+
+# --- Benchmark da Detecção ---
+
+def detection_benchmark(imagens: List[np.ndarray], detector: Any, settings: Sequence[Tuple[float, int]],
+                        reference: Tuple[float, int] = (1.0, 1), repeats: int = 3, min_iou: float = 0.5):
+    """
+    Mede a latência e o recall de cada (escala, upsample) em um conjunto fixo de
+    imagens RGB. O recall é relativo às faces encontradas na configuração de
+    `reference` (resolução completa com upsample 1, por padrão). A última linha
+    usa a DetectionPolicy adaptativa percorrendo as imagens em sequência.
+    """
+    import time
+    from tracking import iou
+
+    referencia = [detect_faces(detector, img, reference[1], reference[0]) for img in imagens]
+    total = sum(len(r) for r in referencia)
+
+    def medir(nome: str, detectar):
+        tempos, achadas = [], 0
+        for _ in range(repeats):
+            achadas = 0
+            for img, ref in zip(imagens, referencia):
+                inicio = time.perf_counter()
+                rects = detectar(img)
+                tempos.append((time.perf_counter() - inicio) * 1000)
+                livres = list(rects)
+                for r in ref:
+                    melhor = max(livres, key=lambda d: iou(d, r), default=None)
+                    if melhor is not None and iou(melhor, r) >= min_iou:
+                        livres.remove(melhor)
+                        achadas += 1
+        return {
+            "config": nome,
+            "ms_media": float(np.mean(tempos)),
+            "ms_p95": float(np.percentile(tempos, 95)),
+            "recall": achadas / total if total else 1.0,
+        }
+
+    linhas = [medir(f"escala={sc:g} upsample={up}", lambda img, sc=sc, up=up: detect_faces(detector, img, up, sc))
+              for sc, up in settings]
+    politica = DetectionPolicy(*reference, adaptive=True)
+    linhas.append(medir("adaptativa", lambda img: politica.detect(detector, img)))
+    return {"imagens": len(imagens), "faces_referencia": total, "resultados": linhas}
+
+if __name__ == "__main__":
+    import argparse
+    import glob
+
+    parser = argparse.ArgumentParser(description="Latência e recall da detecção por escala/upsample.")
+    parser.add_argument("imagens", help="Pasta com as imagens de teste (jpg/png).")
+    parser.add_argument("--escalas", type=float, nargs="+", default=[1.0, 0.75, 0.5, 0.33, 0.25])
+    parser.add_argument("--upsample", type=int, nargs="+", default=[0, 1])
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args()
+
+    arquivos = sorted(f for ext in ("*.jpg", "*.jpeg", "*.png") for f in glob.glob(os.path.join(args.imagens, ext)))
+    imagens = [to_rgb(img) for img in map(cv2.imread, arquivos) if img is not None]
+    if not imagens:
+        raise SystemExit(f"Nenhuma imagem encontrada em '{args.imagens}'.")
+
+    relatorio = detection_benchmark(imagens, dlib.get_frontal_face_detector(),
+                                    [(sc, up) for sc in args.escalas for up in args.upsample],
+                                    repeats=args.repeticoes)
+    print(f"--- {relatorio['imagens']} imagens, {relatorio['faces_referencia']} faces na referência ---")
+    for linha in relatorio["resultados"]:
+        print(f"{linha['config']:<26} média {linha['ms_media']:7.1f} ms | p95 {linha['ms_p95']:7.1f} ms | recall {linha['recall']:.3f}")
@@ -0,0 +1,228 @@
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import db_operations # Log de alterações e aplicação dos registros
+
+# --- Parâmetros da Replicação ---
+SYNC_INTERVAL_S = 2.0 # Intervalo entre consultas aos outros quiosques
+BATCH = 500 # Registros por consulta
+SYNC_PEERS = os.environ.get("RECOG_SYNC_PEERS", "") # Ex.: "/mnt/quiosque-b,tcp://10.0.0.7:8765"
+SYNC_PORT = int(os.environ.get("RECOG_SYNC_PORT", "0")) # Porta para servir o log deste quiosque (0 = não serve)
+SYNC_HOST = os.environ.get("RECOG_SYNC_HOST", "127.0.0.1") # Interface do serve(); sem autenticação, só local por padrão
+
+def read_changes(path: str, desde: int, limite: int = BATCH, offset: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Registros do log com seq > `desde`, começando a leitura em `offset` (bytes)
+    quando ele é conhecido. Retorna (registros, offset logo após o último lido).
+    Uma última linha incompleta (escrita em andamento) fica para a próxima leitura.
+    """
+    registros = []
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if offset > f.tell():
+                offset = 0 # Log recriado do outro lado: lê do início
+            f.seek(offset)
+            for linha in f:
+                if not linha.endswith(b"\n"):
+                    break
+                registro = json.loads(linha)
+                if registro["seq"] > desde:
+                    registros.append(registro)
+                    if len(registros) == limite:
+                        offset = f.tell()
+                        break
+                offset = f.tell()
+    except FileNotFoundError:
+        return [], 0
+    return registros, offset
+
+# --- Fontes (outros quiosques) ---
+
+class DirectoryPeer:
+    """Log de outro quiosque em uma pasta local ou compartilhada (rede, pendrive, rsync)."""
+
+    def __init__(self, caminho: str):
+        if os.path.isdir(caminho):
+            caminho = os.path.join(caminho, os.path.basename(db_operations.change_log_path()))
+        self.path = caminho
+        self.key = "dir:" + os.path.abspath(caminho)
+        self._offset = (0, 0) # (seq, offset) da última leitura: evita reler o arquivo do início
+
+    def fetch(self, desde: int, limite: int = BATCH) -> List[Dict[str, Any]]:
+        offset = self._offset[1] if self._offset[0] == desde else 0
+        registros, novo = read_changes(self.path, desde, limite, offset)
+        self._offset = (registros[-1]["seq"] if registros else desde, novo)
+        return registros
+
+class SocketPeer:
+    """Log de outro quiosque servido por serve() (uma linha "desde limite" por conexão)."""
+
+    def __init__(self, host: str, porta: int, timeout: float = 5.0):
+        self.host, self.porta, self.timeout = host, porta, timeout
+        self.key = f"tcp://{host}:{porta}"
+
+    def fetch(self, desde: int, limite: int = BATCH) -> List[Dict[str, Any]]:
+        with socket.create_connection((self.host, self.porta), self.timeout) as conn:
+            conn.sendall(f"{desde} {limite}\n".encode())
+            with conn.makefile("rb") as f:
+                return [json.loads(linha) for linha in f if linha.strip()]
+
+def parse_peer(texto: str):
+    """"tcp://host:porta" ou caminho de uma pasta/arquivo de log."""
+    if texto.startswith("tcp://"):
+        host, _, porta = texto[len("tcp://"):].rpartition(":")
+        return SocketPeer(host, int(porta))
+    return DirectoryPeer(texto)
+
+def serve(porta: int = SYNC_PORT, host: str = SYNC_HOST) -> socketserver.ThreadingTCPServer:
+    """
+    Serve o log deste quiosque em segundo plano para os SocketPeer dos outros.
+    Não há autenticação e o log contém os vetores faciais: por padrão só
+    atende a própria máquina (ex.: túnel SSH); abrir para a rede com
+    RECOG_SYNC_HOST=0.0.0.0 só em uma rede isolada dos quiosques.
+    """
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            try:
+                desde, limite = (int(x) for x in self.rfile.readline().split())
+            except ValueError:
+                return
+            registros, _ = read_changes(db_operations.change_log_path(), desde, min(limite, BATCH))
+            self.wfile.write(b"".join(json.dumps(r, ensure_ascii=False).encode("utf-8") + b"\n" for r in registros))
+
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    servidor = socketserver.ThreadingTCPServer((host, porta), Handler)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="replicacao-servidor", daemon=True).start()
+    return servidor
+
+# --- Sincronização ---
+
+def state_path() -> str:
+    return os.path.splitext(db_operations.DB_FILE)[0] + ".sync.json"
+
+class Replicator:
+    """
+    Puxa os registros novos de cada fonte e os aplica localmente. O estado
+    (<DB>.sync.json) guarda a última sequência lida de cada fonte e, por
+    origem, a última sequência já aplicada: um registro que chega por dois
+    caminhos (ex.: quiosque B repassando o que veio de A) é aplicado uma vez,
+    e os registros deste próprio quiosque que voltam são ignorados.
+    """
+
+    def __init__(self, peers: List[Any]):
+        self.peers = peers
+        self.applied = 0
+        self.errors = 0
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        try:
+            with open(state_path(), encoding="utf-8") as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {"fontes": {}, "origens": {}}
+
+    def _save(self):
+        tmp = state_path() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, state_path())
+
+    def pull(self, peer: Any) -> int:
+        """Aplica tudo o que a fonte tem de novo. Retorna o número de registros que alteraram o DB."""
+        aplicados = 0
+        while True:
+            desde = self.state["fontes"].get(peer.key, 0)
+            registros = peer.fetch(desde)
+            if not registros:
+                break
+            novos, origens = [], dict(self.state["origens"])
+            for registro in registros:
+                origem, origem_seq = registro["origem"], registro["origem_seq"]
+                if origem != db_operations.SITE_ID and origem_seq > origens.get(origem, 0):
+                    novos.append(registro)
+                    origens[origem] = origem_seq
+            # O estado só avança depois de aplicar: se o lote falhar no meio, ele é
+            # lido de novo na próxima consulta (reaplicar um registro é inofensivo)
+            aplicados += db_operations.apply_changes(novos)
+            self.state["origens"] = origens
+            self.state["fontes"][peer.key] = registros[-1]["seq"]
+            self._save()
+            if len(registros) < BATCH:
+                break
+        self.applied += aplicados
+        return aplicados
+
+    def sync_once(self) -> int:
+        total = 0
+        for peer in self.peers:
+            try:
+                total += self.pull(peer)
+            except (OSError, ValueError, KeyError) as e:
+                self.errors += 1
+                print(f"Replicação: falha ao ler {peer.key}: {e}")
+        return total
+
+    def run_forever(self, intervalo: float = SYNC_INTERVAL_S, parar: Optional[threading.Event] = None):
+        parar = parar or self._parar
+        while not parar.is_set():
+            self.sync_once()
+            parar.wait(intervalo)
+
+    def start(self, intervalo: float = SYNC_INTERVAL_S) -> threading.Thread:
+        self._thread = threading.Thread(target=self.run_forever, args=(intervalo,), name="replicacao", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout: float = 5.0):
+        """Encerra a thread de start() depois da consulta em andamento: um lote não é cortado no meio do apply_changes."""
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        return {"replicacao_aplicados": self.applied, "replicacao_erros": self.errors}
+
+def from_env() -> Optional[Replicator]:
+    """Inicia a replicação configurada por RECOG_SYNC_PEERS/RECOG_SYNC_PORT, ou None se desligada."""
+    if SYNC_PORT:
+        serve(SYNC_PORT)
+        print(f"Log de alterações servido na porta {SYNC_PORT} ({db_operations.SITE_ID})")
+    if not SYNC_PEERS:
+        return None
+    replicador = Replicator([parse_peer(p.strip()) for p in SYNC_PEERS.split(",") if p.strip()])
+    replicador.start()
+    return replicador
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replica cadastros entre quiosques pelo log de alterações.")
+    parser.add_argument("fontes", nargs="*", help='Pastas/arquivos de log de outros quiosques ou "tcp://host:porta".')
+    parser.add_argument("--servir", type=int, default=0, help="Serve o log deste quiosque nesta porta.")
+    parser.add_argument("--intervalo", type=float, default=SYNC_INTERVAL_S)
+    parser.add_argument("--uma-vez", action="store_true", help="Sincroniza uma vez e sai.")
+    args = parser.parse_args()
+
+    if args.servir:
+        serve(args.servir)
+        print(f"Servindo {db_operations.change_log_path()} na porta {args.servir} ({db_operations.SITE_ID})")
+    replicador = Replicator([parse_peer(f) for f in args.fontes])
+    if args.uma_vez:
+        print(f"{replicador.sync_once()} alterações aplicadas.")
+        raise SystemExit
+    try:
+        while True:
+            aplicados = replicador.sync_once()
+            if aplicados:
+                print(f"{time.strftime('%H:%M:%S')} {aplicados} alterações aplicadas.")
+            time.sleep(args.intervalo)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,500 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import struct
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import db_operations # CRUD compartilhado com main.py e main_gui.py
+import matcher # Comparação com a galeria
+
+# --- Parâmetros do Servidor ---
+HOST = "127.0.0.1" # API local e sem autenticação; --host 0.0.0.0 expõe o CRUD na rede
+PORT = 8080
+WORKERS = os.cpu_count() or 1 # Threads do executor para o Dlib (o C++ libera o GIL)
+BATCH_MAX = 16 # Requisições agrupadas em um único lote
+BATCH_WINDOW_S = 0.005 # Espera máxima para completar um lote
+MAX_PENDING = 256 # Requisições aguardando/em processamento antes de responder 503
+MAX_BODY = 8 * 1024 * 1024 # Maior corpo/mensagem aceito (bytes)
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+class Busy(Exception):
+    """Fila de reconhecimento cheia: o cliente deve tentar de novo mais tarde."""
+
+class HTTPError(Exception):
+    def __init__(self, status: int, mensagem: str):
+        super().__init__(mensagem)
+        self.status = status
+        self.mensagem = mensagem
+
+# --- Agrupamento em Lotes ---
+
+class Batcher:
+    """
+    Agrupa requisições que chegam juntas (até `max_batch` ou `window` segundos)
+    e processa cada lote com uma única chamada bloqueante no executor. No
+    máximo `concurrency` lotes rodam ao mesmo tempo e no máximo `max_pending`
+    requisições esperam; além disso, submit() levanta Busy.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor, process: Callable[[List[Any]], List[Any]],
+                 max_batch: int = BATCH_MAX, window: float = BATCH_WINDOW_S,
+                 concurrency: int = WORKERS, max_pending: int = MAX_PENDING):
+        self.executor = executor
+        self.process = process
+        self.max_batch = max_batch
+        self.window = window
+        self.max_pending = max_pending
+        self._sem = asyncio.Semaphore(concurrency)
+        self._queue: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.pending = 0
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item: Any) -> Any:
+        if self.pending >= self.max_pending:
+            raise Busy()
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self.pending += 1
+        self._queue.append((item, fut))
+        if len(self._queue) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        try:
+            return await fut
+        finally:
+            self.pending -= 1
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._queue:
+            lote, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+            asyncio.get_running_loop().create_task(self._run(lote))
+
+    async def _run(self, lote: List[Tuple[Any, asyncio.Future]]):
+        async with self._sem:
+            loop = asyncio.get_running_loop()
+            try:
+                resultados = await loop.run_in_executor(self.executor, self.process, [item for item, _ in lote])
+            except Exception as exc:
+                for _, fut in lote:
+                    if not fut.done():
+                        fut.set_exception(exc)
+                return
+            self.batches += 1
+            self.items += len(lote)
+            for (_, fut), resultado in zip(lote, resultados):
+                if not fut.done():
+                    fut.set_result(resultado)
+
+# --- Reconhecimento (roda no executor) ---
+
+def _match_json(m: matcher.Match) -> Dict[str, Any]:
+    return {"nome": m.nome, "distancia": m.distancia if np.isfinite(m.distancia) else None, "perfil": m.perfil}
+
+class RecognitionService:
+    """Funções bloqueantes do servidor: decodificação, Dlib e matcher, sempre em lote."""
+
+    def __init__(self, load_models: bool = True):
+        self.models = None
+        if load_models:
+            import recognition # Importado sob demanda: o modo só-vetores não precisa do Dlib
+            self.models = recognition.load_models()
+
+    def _require_models(self):
+        if self.models is None:
+            raise HTTPError(503, "Modelos do Dlib não carregados; envie vetores faciais em vez de imagens.")
+
+    def decode(self, imagem: bytes):
+        import cv2
+        import recognition
+        bgr = cv2.imdecode(np.frombuffer(imagem, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if bgr is None:
+            return None
+        return recognition.to_rgb(bgr)
+
+    def detect_and_embed(self, imagens: List[bytes]) -> List[Optional[Tuple[list, np.ndarray]]]:
+        """Para cada JPEG: (retângulos, vetores (F, 128)), ou None se não decodificar. Um só lote na ResNet."""
+        self._require_models()
+        import recognition
+        detector, sp, rec = self.models
+        frames = []
+        for imagem in imagens:
+            rgb = self.decode(imagem)
+            frames.append(None if rgb is None else (rgb, recognition.detect_faces(detector, rgb)))
+        validos = [f for f in frames if f is not None]
+        vecs = iter(recognition.embed_many(sp, rec, validos))
+        return [None if f is None else (f[1], next(vecs)) for f in frames]
+
+    def recognize_frames(self, imagens: List[bytes]) -> List[Dict[str, Any]]:
+        """Lote de JPEGs -> um resultado JSON por imagem, com um único matcher.match para todas as faces."""
+        por_imagem = self.detect_and_embed(imagens)
+        todos = [vecs for r in por_imagem if r is not None for vecs in [r[1]] if len(vecs)]
+        matches = iter(c[0] for c in matcher.match(np.concatenate(todos), k=1)) if todos else iter(())
+        resultados = []
+        for r in por_imagem:
+            if r is None:
+                resultados.append({"erro": "Imagem inválida (JPEG/PNG esperado)."})
+                continue
+            rects, vecs = r
+            resultados.append({"faces": [
+                {"box": [rect.left(), rect.top(), rect.right(), rect.bottom()], **_match_json(next(matches))}
+                for rect in rects
+            ]})
+        return resultados
+
+    def recognize_descriptors(self, lotes: List[np.ndarray]) -> List[Dict[str, Any]]:
+        """Lote de requisições com vetores (F_i, 128) -> um único matcher.match para todas."""
+        contagens = [len(vecs) for vecs in lotes]
+        todos = matcher.match(np.concatenate(lotes), k=1) if sum(contagens) else []
+        resultados, pos = [], 0
+        for n in contagens:
+            resultados.append({"faces": [_match_json(c[0]) for c in todos[pos:pos + n]]})
+            pos += n
+        return resultados
+
+    def templates_from_images(self, imagens: List[bytes]) -> np.ndarray:
+        """Vetores de cadastro a partir de fotos com exatamente uma face cada."""
+        vecs = []
+        for i, r in enumerate(self.detect_and_embed(imagens)):
+            if r is None:
+                raise HTTPError(400, f"Imagem {i} inválida.")
+            if len(r[1]) != 1:
+                raise HTTPError(400, f"A imagem {i} deve ter exatamente uma face (encontradas: {len(r[1])}).")
+            vecs.append(r[1][0])
+        return np.stack(vecs)
+
+def _parse_descriptors(dados: Any) -> np.ndarray:
+    try:
+        vecs = np.asarray(dados, dtype=np.float32)
+    except (TypeError, ValueError):
+        raise HTTPError(400, "Vetores inválidos.")
+    if vecs.ndim == 1:
+        vecs = vecs[np.newaxis, :]
+    if vecs.ndim != 2 or vecs.shape[1] != db_operations.DESCRIPTOR_DIM:
+        raise HTTPError(400, f"São esperados vetores de {db_operations.DESCRIPTOR_DIM} valores.")
+    return vecs
+
+# --- Servidor ---
+
+class RecognitionServer:
+    """
+    Servidor HTTP/WebSocket (asyncio, sem dependências externas).
+
+    HTTP:
+      POST   /recognize          JPEG (image/jpeg) ou JSON {"descritores": [[...128], ...]}
+      GET    /users              página de nomes e perfis (?after=&limit=&prefixo=&perfil=)
+      GET    /users/<nome>       perfil de um usuário
+      POST   /users              JSON {"nome", "perfil", "vetor" | "imagens": [JPEG base64, ...]}
+      PATCH  /users/<nome>       JSON {"perfil"}
+      DELETE /users/<nome>
+      GET    /health             estado das filas
+    WebSocket (/ws): mensagem binária = JPEG; texto = JSON {"descritores": ...}.
+    Cada mensagem recebe uma resposta JSON na mesma ordem.
+    """
+
+    def __init__(self, service: RecognitionService, workers: int = WORKERS,
+                 max_batch: int = BATCH_MAX, max_pending: int = MAX_PENDING):
+        self.service = service
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="reconhecimento")
+        # Escritas no DB em uma única thread: o backend pickle relê e regrava o arquivo
+        self.db_executor = ThreadPoolExecutor(1, thread_name_prefix="db")
+        self.frames = Batcher(self.executor, service.recognize_frames, max_batch, concurrency=workers, max_pending=max_pending)
+        self.descriptors = Batcher(self.executor, service.recognize_descriptors, max_batch, concurrency=workers,
+                                   max_pending=max_pending)
+        self.started = time.monotonic()
+
+    async def _db(self, funcao, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.db_executor, funcao, *args)
+
+    # --- Rotas HTTP ---
+
+    async def route(self, metodo: str, caminho: str, query: Dict[str, List[str]],
+                    headers: Dict[str, str], corpo: bytes) -> Tuple[int, Any]:
+        partes = [unquote(p) for p in caminho.strip("/").split("/") if p]
+        if metodo == "POST" and partes == ["recognize"]:
+            resultado = await self.recognize(headers.get("content-type", ""), corpo)
+            if "erro" in resultado:
+                raise HTTPError(400, resultado["erro"])
+            return 200, resultado
+        if partes == ["health"] and metodo == "GET":
+            return 200, self.health()
+        if partes[:1] == ["users"]:
+            if len(partes) == 1 and metodo == "GET":
+                return 200, await self.list_users(query)
+            if len(partes) == 1 and metodo == "POST":
+                return await self.create_user(_json(corpo))
+            if len(partes) == 2:
+                return await self.user(metodo, partes[1], corpo)
+        raise HTTPError(404, "Rota não encontrada.")
+
+    async def list_users(self, query: Dict[str, List[str]]) -> Dict[str, Any]:
+        def param(nome: str, padrao=None):
+            return query.get(nome, [padrao])[0]
+        try:
+            limite = min(int(param("limit", db_operations.PAGE_SIZE)), 1000)
+        except ValueError:
+            raise HTTPError(400, "limit deve ser um número inteiro.")
+        pagina = await self._db(db_operations.list_users, param("after"), limite, param("prefixo", ""), param("perfil"))
+        return {"usuarios": [{"nome": nome, "perfil": perfil} for nome, perfil in pagina.itens],
+                "cursor": pagina.cursor}
+
+    async def recognize(self, content_type: str, corpo: bytes) -> Dict[str, Any]:
+        if content_type.startswith("application/json"):
+            dados = _json(corpo)
+            return await self.descriptors.submit(_parse_descriptors(dados.get("descritores")))
+        return await self.frames.submit(corpo)
+
+    async def create_user(self, dados: Dict[str, Any]) -> Tuple[int, Any]:
+        nome = str(dados.get("nome") or "").strip()
+        perfil = dados.get("perfil")
+        if not nome:
+            raise HTTPError(400, "Nome inválido.")
+        if perfil not in db_operations.get_available_profiles().values():
+            raise HTTPError(400, f"Perfil inválido. Use um de {sorted(db_operations.get_available_profiles().values())}.")
+        if dados.get("imagens"):
+            try:
+                imagens = [base64.b64decode(i) for i in dados["imagens"]]
+            except (TypeError, ValueError):
+                raise HTTPError(400, "Imagens devem estar em base64.")
+            amostras = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.service.templates_from_images, imagens)
+            vetor = matcher.aggregate_templates(amostras)
+        else:
+            vetor = db_operations._as_templates(dados.get("vetor"))
+            if vetor is None:
+                raise HTTPError(400, f"Vetor inválido: envie 1 a {db_operations.MAX_TEMPLATES} vetores de "
+                                     f"{db_operations.DESCRIPTOR_DIM} valores.")
+        if not await self._db(db_operations.create_user, nome, vetor, perfil):
+            raise HTTPError(409, f"O usuário '{nome}' já existe.")
+        return 201, {"nome": nome, "perfil": perfil}
+
+    async def user(self, metodo: str, nome: str, corpo: bytes) -> Tuple[int, Any]:
+        if metodo == "GET":
+            user = await self._db(db_operations.read_user, nome)
+            if not user:
+                raise HTTPError(404, f"Usuário '{nome}' não encontrado.")
+            return 200, {"nome": nome, "perfil": user.get("perfil")}
+        if metodo in ("PATCH", "PUT"):
+            perfil = _json(corpo).get("perfil")
+            if perfil not in db_operations.get_available_profiles().values():
+                raise HTTPError(400, "Perfil inválido.")
+            if not await self._db(db_operations.update_user_profile, nome, perfil):
+                raise HTTPError(404, f"Usuário '{nome}' não encontrado.")
+            return 200, {"nome": nome, "perfil": perfil}
+        if metodo == "DELETE":
+            if not await self._db(db_operations.delete_user, nome):
+                raise HTTPError(404, f"Usuário '{nome}' não encontrado.")
+            return 200, {"nome": nome}
+        raise HTTPError(405, "Método não permitido.")
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "modelos": self.service.models is not None,
+            "uptime_s": round(time.monotonic() - self.started, 1),
+            "pendentes": self.frames.pending + self.descriptors.pending,
+            "lotes": self.frames.batches + self.descriptors.batches,
+            "itens_por_lote": round((self.frames.items + self.descriptors.items)
+                                    / max(1, self.frames.batches + self.descriptors.batches), 2),
+        }
+
+    # --- Conexões ---
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    cabecalho = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                linhas = cabecalho.decode("latin-1").split("\r\n")
+                try:
+                    metodo, alvo, _ = linhas[0].split(" ", 2)
+                except ValueError:
+                    break
+                headers = {}
+                for linha in linhas[1:]:
+                    if ":" in linha:
+                        chave, valor = linha.split(":", 1)
+                        headers[chave.strip().lower()] = valor.strip()
+                url = urlsplit(alvo)
+
+                if headers.get("upgrade", "").lower() == "websocket" and url.path == "/ws":
+                    await self.websocket(reader, writer, headers)
+                    break
+
+                tamanho = int(headers.get("content-length", "0") or 0)
+                if tamanho > MAX_BODY:
+                    await _send_json(writer, 413, {"erro": "Corpo grande demais."}, fechar=True)
+                    break
+                corpo = await reader.readexactly(tamanho) if tamanho else b""
+                try:
+                    status, resposta = await self.route(metodo.upper(), url.path, parse_qs(url.query), headers, corpo)
+                except HTTPError as exc:
+                    status, resposta = exc.status, {"erro": exc.mensagem}
+                except Busy:
+                    status, resposta = 503, {"erro": "Servidor ocupado, tente novamente."}
+                except Exception as exc: # Erro inesperado: o cliente recebe um 500 em vez de a conexão cair
+                    print(f"Erro em {metodo} {url.path}: {exc!r}")
+                    status, resposta = 500, {"erro": "Erro interno do servidor."}
+                fechar = headers.get("connection", "").lower() == "close"
+                await _send_json(writer, status, resposta, fechar)
+                if fechar:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def websocket(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, headers: Dict[str, str]):
+        chave = headers.get("sec-websocket-key", "")
+        aceite = base64.b64encode(hashlib.sha1((chave + WS_GUID).encode()).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {aceite}\r\n\r\n").encode())
+        await writer.drain()
+
+        # As respostas saem na ordem das mensagens, mas várias podem estar em processamento
+        respostas: asyncio.Queue = asyncio.Queue(maxsize=BATCH_MAX)
+
+        async def enviar():
+            while True:
+                tarefa = await respostas.get()
+                if tarefa is None:
+                    return
+                try:
+                    resposta = await tarefa
+                except HTTPError as exc:
+                    resposta = {"erro": exc.mensagem}
+                except Busy:
+                    resposta = {"erro": "Servidor ocupado, tente novamente."}
+                except Exception as exc:
+                    print(f"Erro no WebSocket: {exc!r}")
+                    resposta = {"erro": "Erro interno do servidor."}
+                _ws_send(writer, 0x1, json.dumps(resposta, ensure_ascii=False).encode("utf-8"))
+                await writer.drain()
+
+        enviador = asyncio.get_running_loop().create_task(enviar())
+        try:
+            while True:
+                mensagem = await _ws_read(reader, writer)
+                if mensagem is None:
+                    break
+                opcode, dados = mensagem
+                if opcode == 0x2:
+                    tarefa = self.frames.submit(dados)
+                else:
+                    tarefa = self._ws_text(dados)
+                await respostas.put(asyncio.ensure_future(tarefa))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            await respostas.put(None)
+            await asyncio.gather(enviador, return_exceptions=True)
+
+    async def _ws_text(self, dados: bytes) -> Dict[str, Any]:
+        return await self.descriptors.submit(_parse_descriptors(_json(dados).get("descritores")))
+
+    async def serve(self, host: str = HOST, port: int = PORT):
+        servidor = await asyncio.start_server(self.handle, host, port, limit=64 * 1024)
+        print(f"Servidor de reconhecimento em http://{host}:{port} ({self.executor._max_workers} threads)")
+        async with servidor:
+            await servidor.serve_forever()
+
+# --- Protocolo ---
+
+_STATUS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+def _json(corpo: bytes) -> Dict[str, Any]:
+    try:
+        dados = json.loads(corpo or b"{}")
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise HTTPError(400, "JSON inválido.")
+    if not isinstance(dados, dict):
+        raise HTTPError(400, "Objeto JSON esperado.")
+    return dados
+
+async def _send_json(writer: asyncio.StreamWriter, status: int, dados: Any, fechar: bool = False):
+    corpo = json.dumps(dados, ensure_ascii=False).encode("utf-8")
+    writer.write((f"HTTP/1.1 {status} {_STATUS.get(status, '')}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                  f"Content-Length: {len(corpo)}\r\nConnection: {'close' if fechar else 'keep-alive'}\r\n\r\n").encode()
+                 + corpo)
+    await writer.drain()
+
+def _ws_send(writer: asyncio.StreamWriter, opcode: int, dados: bytes):
+    n = len(dados)
+    if n < 126:
+        cabecalho = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < 1 << 16:
+        cabecalho = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        cabecalho = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    writer.write(cabecalho + dados)
+
+async def _ws_read(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> Optional[Tuple[int, bytes]]:
+    """Lê uma mensagem completa (juntando fragmentos). None quando o cliente fecha."""
+    partes, opcode_msg = [], None
+    total = 0 # Bytes já recebidos da mensagem (soma dos fragmentos)
+    while True:
+        b1, b2 = await reader.readexactly(2)
+        fin, opcode = b1 & 0x80, b1 & 0x0F
+        n = b2 & 0x7F
+        if n == 126:
+            n = struct.unpack("!H", await reader.readexactly(2))[0]
+        elif n == 127:
+            n = struct.unpack("!Q", await reader.readexactly(8))[0]
+        # O limite vale para a mensagem inteira: fragmentos pequenos não podem somar mais que MAX_BODY
+        if total + n > MAX_BODY:
+            _ws_send(writer, 0x8, struct.pack("!H", 1009))
+            return None
+        mascara = await reader.readexactly(4) if b2 & 0x80 else None
+        dados = await reader.readexactly(n)
+        if mascara:
+            dados = (np.frombuffer(dados, dtype=np.uint8) ^ np.resize(np.frombuffer(mascara, dtype=np.uint8), n)).tobytes()
+        if opcode == 0x8:
+            _ws_send(writer, 0x8, dados[:2])
+            return None
+        if opcode == 0x9:
+            _ws_send(writer, 0xA, dados)
+            continue
+        if opcode == 0xA:
+            continue
+        if opcode != 0x0:
+            opcode_msg = opcode
+        partes.append(dados)
+        total += n
+        if fin:
+            return opcode_msg, b"".join(partes)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Servidor de reconhecimento facial sem interface (HTTP/WebSocket).")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--porta", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Threads do executor para o Dlib.")
+    parser.add_argument("--lote", type=int, default=BATCH_MAX, help="Máximo de requisições por lote.")
+    parser.add_argument("--sem-modelos", action="store_true",
+                        help="Não carrega o Dlib: só CRUD e reconhecimento a partir de vetores.")
+    args = parser.parse_args()
+
+    try:
+        service = RecognitionService(load_models=not args.sem_modelos)
+    except RuntimeError as e:
+        print(f"Erro ao carregar modelos do Dlib: {e}")
+        print("Use --sem-modelos para aceitar apenas vetores faciais.")
+        exit()
+    try:
+        asyncio.run(RecognitionServer(service, args.workers, args.lote).serve(args.host, args.porta))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,167 @@
+import os
+import pickle
+import sqlite3
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import db_operations # DESCRIPTOR_DIM e validação dos vetores
+
+BUSY_TIMEOUT_S = 10.0 # Espera por outro escritor antes de desistir
+
+class SQLiteStore:
+    """
+    Backend "sqlite" de db_operations. Uma única conexão por processo, em modo
+    WAL: vários processos (ex.: quiosques que compartilham o arquivo) leem em
+    paralelo com um escritor, e cada consulta por nome usa o índice da chave
+    primária em vez de carregar o DB inteiro.
+    """
+
+    def __init__(self, path: str, migrate_from: Optional[str] = None):
+        self.path = path
+        self._lock = threading.RLock()
+        novo = not os.path.exists(path)
+        self._conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_S, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS usuarios ("
+            " nome TEXT PRIMARY KEY,"
+            " perfil TEXT,"
+            " vetor BLOB NOT NULL)"
+        )
+        self._writes = 0 # Escritas desta conexão (PRAGMA data_version só vê as de outras)
+        self.last_write: Optional[Tuple[Any, Any]] = None # Assinaturas logo antes e logo depois da última escrita
+        if novo and migrate_from and os.path.exists(migrate_from):
+            self._migrate_from_pickle(migrate_from)
+
+    @contextmanager
+    def transaction(self):
+        """Transação de escrita; as operações dentro dela são gravadas juntas."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            antes = self.signature() # Já com o lock de escrita: nenhum outro processo grava até o COMMIT
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            self._writes += 1
+            self.last_write = (antes, self.signature())
+
+    def signature(self) -> Optional[Tuple[int, int]]:
+        with self._lock:
+            versao = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            return (versao, self._writes)
+
+    @staticmethod
+    def _blob(nome: str, vetor: Any) -> bytes:
+        vecs = db_operations._as_templates(vetor)
+        if vecs is None:
+            raise ValueError(f"Vetor facial inválido para '{nome}': são esperados 1 a {db_operations.MAX_TEMPLATES} "
+                             f"vetores de {db_operations.DESCRIPTOR_DIM} valores.")
+        return vecs.tobytes()
+
+    @staticmethod
+    def _vector(blob: bytes) -> np.ndarray:
+        """(128,) para um único template, (T, 128) para um conjunto."""
+        vec = np.frombuffer(blob, dtype=np.float32)
+        if vec.shape[0] == db_operations.DESCRIPTOR_DIM:
+            return vec
+        return vec.reshape(-1, db_operations.DESCRIPTOR_DIM)
+
+    # --- Escrita ---
+
+    def create_many(self, itens: Iterable[Tuple[str, Any, str]]) -> List[str]:
+        """
+        Cadastra vários usuários em uma única transação.
+        Retorna os nomes efetivamente criados (nomes já existentes são ignorados).
+        """
+        criados = []
+        with self.transaction() as conn:
+            for nome, vetor, perfil in itens:
+                cur = conn.execute("INSERT OR IGNORE INTO usuarios (nome, perfil, vetor) VALUES (?, ?, ?)",
+                                   (nome, perfil, self._blob(nome, vetor)))
+                if cur.rowcount:
+                    criados.append(nome)
+        return criados
+
+    def create(self, nome: str, vetor: Any, perfil: str) -> bool:
+        return bool(self.create_many([(nome, vetor, perfil)]))
+
+    def update_profile(self, nome: str, perfil: str) -> bool:
+        with self.transaction() as conn:
+            return conn.execute("UPDATE usuarios SET perfil = ? WHERE nome = ?", (perfil, nome)).rowcount > 0
+
+    def delete(self, nome: str) -> bool:
+        with self.transaction() as conn:
+            return conn.execute("DELETE FROM usuarios WHERE nome = ?", (nome,)).rowcount > 0
+
+    # --- Consultas ---
+
+    def get(self, nome: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT perfil, vetor FROM usuarios WHERE nome = ?", (nome,)).fetchone()
+        if row is None:
+            return None
+        return {"vetor": self._vector(row[1]), "perfil": row[0]}
+
+    def load(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute("SELECT nome, perfil, vetor FROM usuarios ORDER BY rowid").fetchall()
+        return {nome: {"vetor": self._vector(vetor), "perfil": perfil} for nome, perfil, vetor in rows}
+
+    def list_page(self, after: Optional[str], limit: int, prefix: str = "",
+                  perfil: Optional[str] = None) -> List[Tuple[str, Optional[str]]]:
+        """Página da listagem por nome: percorre o índice da chave primária sem ler a coluna dos vetores."""
+        condicoes, params = [], []
+        if after is not None:
+            condicoes.append("nome > ?")
+            params.append(after)
+        if prefix:
+            # Intervalo [prefixo, prefixo + maior caractere) em vez de LIKE: usa o índice
+            condicoes.append("nome >= ? AND nome < ?")
+            params += [prefix, prefix + "\U0010ffff"]
+        if perfil is not None:
+            condicoes.append("perfil = ?")
+            params.append(perfil)
+        where = f" WHERE {' AND '.join(condicoes)}" if condicoes else ""
+        with self._lock:
+            return self._conn.execute(f"SELECT nome, perfil FROM usuarios{where} ORDER BY nome LIMIT ?",
+                                      (*params, limit)).fetchall()
+
+    def gallery_arrays(self):
+        """(nomes, perfis, vetores (N, 128) float32) montados direto dos BLOBs, uma linha por template."""
+        with self._lock:
+            rows = self._conn.execute("SELECT nome, perfil, vetor FROM usuarios ORDER BY rowid").fetchall()
+        bytes_linha = db_operations.DESCRIPTOR_DIM * 4
+        templates = [len(r[2]) // bytes_linha for r in rows]
+        nomes = [r[0] for r, t in zip(rows, templates) for _ in range(t)]
+        perfis = [r[1] for r, t in zip(rows, templates) for _ in range(t)]
+        vetores = np.frombuffer(b"".join(r[2] for r in rows), dtype=np.float32)
+        return nomes, perfis, vetores.reshape(len(nomes), db_operations.DESCRIPTOR_DIM).copy()
+
+    def paths(self) -> List[str]:
+        return [self.path, self.path + "-wal", self.path + "-shm"]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # --- Migração ---
+
+    def _migrate_from_pickle(self, pkl_path: str):
+        """Importa um db.pkl existente na criação do banco (o pickle não é alterado)."""
+        try:
+            with open(pkl_path, "rb") as f:
+                db = pickle.load(f)
+        except EOFError:
+            db = {}
+        validos = [(nome, dados["vetor"], dados.get("perfil")) for nome, dados in db.items()
+                   if db_operations._as_templates(dados.get("vetor")) is not None]
+        if len(validos) != len(db):
+            print(f"Aviso: {len(db) - len(validos)} usuário(s) sem vetor facial válido não foram migrados.")
+        self.create_many(validos)
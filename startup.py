@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Início do processo (aproximado): este módulo é o primeiro importado pelos pontos de entrada
+PROCESS_START = time.perf_counter()
+
+def parse_source(fonte: str) -> Any:
+    """Índice da câmera ("0", "1", ...) ou caminho/URL (arquivo de vídeo, rtsp://...)."""
+    return int(fonte) if fonte.isdigit() else fonte
+
+# --- Parâmetros da Inicialização ---
+CAMERA_INDEX = parse_source(os.environ.get("RECOG_CAMERA", "0")) # Câmera dos pontos de entrada
+HEAVY_MODULES = ("cv2", "dlib") # Não podem ser importados pelos caminhos só de CRUD
+IMPORT_BUDGET_MS = 300.0 # Limite da verificação de importação (python -X importtime)
+
+_marks: Dict[str, float] = {}
+
+def mark(evento: str) -> float:
+    """Registra (uma vez) o tempo desde o início do processo até `evento`. Retorna os segundos."""
+    if evento not in _marks:
+        _marks[evento] = time.perf_counter() - PROCESS_START
+    return _marks[evento]
+
+def marks() -> Dict[str, float]:
+    return dict(_marks)
+
+class BackgroundLoader:
+    """
+    Abre a câmera e carrega os modelos do Dlib em duas threads, em paralelo,
+    enquanto a interface já está na tela. A interface consulta `status()` e os
+    eventos `camera_ready`/`models_ready`, que são sinalizados mesmo em caso de
+    falha: `cap` ou `models` ficam None e `error` guarda a mensagem. Os módulos
+    pesados (cv2, dlib) só são importados aqui, fora da thread da interface.
+    """
+
+    def __init__(self, camera: Any = CAMERA_INDEX, load_models: bool = True,
+                 predictor: Optional[str] = None, recog: Optional[str] = None):
+        self.camera = camera
+        self.predictor, self.recog = predictor, recog
+        self.cap = None
+        self.models: Optional[Tuple[Any, Any, Any]] = None
+        self.error: Optional[str] = None
+        self.remote = False # Modelos servidos pelo host de modelos
+        self.camera_ready = threading.Event()
+        self.models_ready = threading.Event()
+        self._status = {"camera": "Abrindo câmera...", "modelos": "Carregando modelos..." if load_models else ""}
+        self._threads = [threading.Thread(target=self._open_camera, name="abrir-camera", daemon=True)]
+        if load_models:
+            self._threads.append(threading.Thread(target=self._load_models, name="carregar-modelos", daemon=True))
+        else:
+            self.models_ready.set()
+
+    def start(self) -> "BackgroundLoader":
+        for t in self._threads:
+            t.start()
+        return self
+
+    def status(self) -> str:
+        return " | ".join(s for s in self._status.values() if s)
+
+    def _open_camera(self):
+        try:
+            import cv2 # Só o cv2: uma falha do Dlib é informada pela thread dos modelos
+            self.cap = cv2.VideoCapture(self.camera)
+            self._status["camera"] = "" if self.cap.isOpened() else "Câmera indisponível."
+        except Exception as e: # ImportError do cv2 inclusive: quem espera o evento não pode travar
+            self.cap = None
+            self.error = str(e)
+            self._status["camera"] = "ERRO: Câmera não aberta."
+        finally:
+            mark("camera")
+            self.camera_ready.set()
+
+    def _load_models(self):
+        try:
+            import pipeline # Importado aqui (puxa o Dlib) para a interface não esperar
+            # Com o host de modelos rodando (model_host.py), só conecta: nada é carregado aqui
+            import model_host
+            client = model_host.connect()
+            if client is not None:
+                self.models = client.models()
+                self.remote = True
+            else:
+                import recognition
+                self.models = recognition.load_models(self.predictor or recognition.PREDICTOR,
+                                                      self.recog or recognition.RECOG)
+            self._status["modelos"] = ""
+        except Exception as e:
+            self.models = None
+            self.error = str(e)
+            self._status["modelos"] = "ERRO: Modelos Dlib não carregados."
+        finally:
+            mark("modelos")
+            self.models_ready.set()
+
+def report() -> str:
+    """Resumo dos tempos de inicialização registrados com mark()."""
+    return " | ".join(f"{evento} {segundos:.2f} s" for evento, segundos in sorted(_marks.items(), key=lambda i: i[1]))
+
+# --- Verificação do Tempo de Importação ---
+
+def import_times(modulo: str) -> Tuple[float, List[str]]:
+    """
+    Roda `python -X importtime -c "import <modulo>"` em um processo novo.
+    Retorna (ms cumulativos da importação, módulos de topo importados).
+    """
+    import subprocess
+    import sys
+    saida = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {modulo}"], capture_output=True,
+                           text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if saida.returncode != 0:
+        raise RuntimeError(saida.stderr.strip().splitlines()[-1])
+    total_us, importados = 0, []
+    for linha in saida.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        partes = linha.split("|")
+        if not linha.startswith("import time:") or len(partes) != 3 or not partes[1].strip().isdigit():
+            continue
+        nome = partes[2].strip()
+        importados.append(nome.split(".")[0])
+        if nome == modulo:
+            total_us = int(partes[1])
+    return total_us / 1000, importados
+
+def import_check(modulos: Sequence[str] = ("db_operations", "main_gui"), budget_ms: float = IMPORT_BUDGET_MS,
+                 proibidos: Sequence[str] = HEAVY_MODULES) -> List[str]:
+    """Falhas encontradas: módulo pesado importado ou importação acima de `budget_ms`."""
+    falhas = []
+    for modulo in modulos:
+        ms, importados = import_times(modulo)
+        pesados = sorted(set(proibidos) & set(importados))
+        print(f"{modulo:<15} {ms:8.1f} ms  {'(importa ' + ', '.join(pesados) + ')' if pesados else ''}")
+        if pesados:
+            falhas.append(f"{modulo} importa {', '.join(pesados)}")
+        if ms > budget_ms:
+            falhas.append(f"{modulo} leva {ms:.0f} ms para importar (limite {budget_ms:.0f} ms)")
+    return falhas
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Verifica o custo de importação dos caminhos de inicialização.")
+    parser.add_argument("modulos", nargs="*", default=["db_operations", "main_gui"])
+    parser.add_argument("--limite-ms", type=float, default=IMPORT_BUDGET_MS)
+    args = parser.parse_args()
+
+    falhas = import_check(args.modulos, args.limite_ms)
+    for falha in falhas:
+        print(f"FALHA: {falha}")
+    if falhas:
+        raise SystemExit(1)
+    print("OK: nenhum caminho de inicialização importa cv2/dlib.")
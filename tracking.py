@@ -0,0 +1,164 @@
+import itertools
+import dlib
+import numpy as np
+from typing import Any, List, Optional
+
+import db_operations # DESCRIPTOR_DIM
+import matcher # Comparação com a galeria
+import recognition # Detecção e vetor facial
+
+# --- Parâmetros do Rastreamento ---
+DETECT_EVERY = 10 # Detecção completa a cada N frames
+MIN_CONFIDENCE = 7.0 # Confiança (PSR) mínima do correlation_tracker antes de redetectar
+MIN_IOU = 0.4 # Sobreposição mínima para uma detecção continuar um rastro existente
+
+def iou(a: Any, b: Any) -> float:
+    """Interseção sobre união de dois retângulos do Dlib."""
+    inter = a.intersect(b)
+    area_inter = max(0, inter.width()) * max(0, inter.height()) if not inter.is_empty() else 0
+    uniao = a.area() + b.area() - area_inter
+    return area_inter / uniao if uniao else 0.0
+
+class Track:
+    """Uma face acompanhada entre frames, com identidade e vetor em cache."""
+
+    def __init__(self, track_id: int, rect: Any, vec: np.ndarray, match: Optional[matcher.Match]):
+        self.id = track_id
+        self.rect = rect
+        self.vec = vec
+        self.match = match
+        self.confidence = float("inf")
+        self.tracker = dlib.correlation_tracker()
+
+    def start(self, rgb: np.ndarray, rect: Any):
+        self.rect = rect
+        self.tracker.start_track(rgb, rect)
+        self.confidence = float("inf")
+
+    def update(self, rgb: np.ndarray):
+        self.confidence = self.tracker.update(rgb)
+        pos = self.tracker.get_position()
+        self.rect = dlib.rectangle(int(pos.left()), int(pos.top()), int(pos.right()), int(pos.bottom()))
+
+class FaceTracker:
+    """
+    Detecta e calcula o vetor facial só a cada `detect_every` frames (ou quando
+    a confiança de algum rastro cai abaixo de `min_confidence`). Entre as
+    detecções, as faces são seguidas com dlib.correlation_tracker e a
+    identidade fica em cache por rastro: uma pessoa parada diante da câmera não
+    é redetectada nem tem o vetor recalculado a cada frame. A cada detecção,
+    o vetor de todas as faces é recalculado e a identidade conferida de novo.
+    """
+
+    def __init__(self, detector: Any, sp: Any, rec: Any, detect_every: int = DETECT_EVERY,
+                 min_confidence: float = MIN_CONFIDENCE, threshold: float = matcher.THRESH,
+                 policy: Optional[recognition.DetectionPolicy] = None, metrics: Any = None, quality: Any = None):
+        self.detector, self.sp, self.rec = detector, sp, rec
+        self.metrics = metrics # metrics.Metrics opcional (tempo de cada etapa)
+        self.quality = quality # face_quality.QualityGate opcional: faces novas ruins não viram rastro
+        self.policy = policy or recognition.DetectionPolicy()
+        self.detect_every = detect_every
+        self.min_confidence = min_confidence
+        self.threshold = threshold
+        self.tracks: List[Track] = []
+        self.low_quality: List = [] # Faces reprovadas pelo filtro na última detecção
+        self._ids = itertools.count(1)
+        self._frames_since_detect = 0
+        self._gallery_version = None
+        self.detections = 0
+        self.embeddings = 0
+
+    def _needs_detection(self) -> bool:
+        if not self.tracks or self._frames_since_detect >= self.detect_every:
+            return True
+        return any(t.confidence < self.min_confidence for t in self.tracks)
+
+    def process(self, rgb: np.ndarray, validate: bool = False) -> List[Track]:
+        """Processa um frame RGB e retorna os rastros ativos."""
+        if self._needs_detection():
+            self._detect(rgb)
+        else:
+            self._frames_since_detect += 1
+            m = self.metrics
+            t0 = m.clock() if m else 0.0
+            for t in self.tracks:
+                t.update(rgb)
+            if m:
+                m.observe("rastreamento", m.clock() - t0)
+        if validate:
+            self._identify()
+        return self.tracks
+
+    def _identify(self):
+        # Cadastro alterado: as identidades em cache podem estar desatualizadas
+        versao = db_operations.get_gallery_version()
+        if versao != self._gallery_version:
+            self._gallery_version = versao
+            self.invalidate_identities()
+        # Rastros sem identidade (novos, invalidados ou de antes da validação
+        # ser ligada) são comparados com o vetor em cache, sem recalculá-lo
+        sem_identidade = [t for t in self.tracks if t.match is None]
+        if sem_identidade:
+            m = self.metrics
+            t0 = m.clock() if m else 0.0
+            vecs = np.stack([t.vec for t in sem_identidade])
+            for t, c in zip(sem_identidade, matcher.match(vecs, k=1, threshold=self.threshold)):
+                t.match = c[0]
+            if m:
+                m.observe("match", m.clock() - t0)
+
+    def _detect(self, rgb: np.ndarray):
+        self._frames_since_detect = 0
+        self.detections += 1
+        m = self.metrics
+        t0 = m.clock() if m else 0.0
+        rects = self.policy.detect(self.detector, rgb)
+        if m:
+            m.observe("deteccao", m.clock() - t0)
+
+        # Associa cada detecção ao rastro com maior sobreposição (guloso)
+        livres = list(self.tracks)
+        pares = [] # (rastro existente ou None, retângulo)
+        for r in rects:
+            melhor = max(livres, key=lambda t: iou(t.rect, r), default=None)
+            if melhor is not None and iou(melhor.rect, r) >= MIN_IOU:
+                livres.remove(melhor)
+                pares.append((melhor, r))
+            else:
+                pares.append((None, r))
+
+        # Toda face detectada passa de novo pelo vetor facial: um rastro mantido
+        # só pela posição não pode conservar a identidade (outra pessoa pode ter
+        # ocupado o mesmo lugar). Faces reprovadas pela qualidade não podem ser
+        # conferidas e deixam de ser rastreadas até a próxima detecção.
+        shapes = None
+        self.low_quality = []
+        if pares and self.quality:
+            t0 = m.clock() if m else 0.0
+            aprovados, shapes, self.low_quality = self.quality.filter(self.sp, rgb, [r for _, r in pares])
+            aprovados_ids = {id(r) for r in aprovados}
+            pares = [(t, r) for t, r in pares if id(r) in aprovados_ids]
+            if m:
+                m.observe("qualidade", m.clock() - t0)
+        self.tracks = []
+        if pares:
+            vecs = recognition.embed_faces(self.sp, self.rec, rgb, [r for _, r in pares], m, shapes)
+            self.embeddings += len(pares)
+            for (t, r), vec in zip(pares, vecs):
+                if t is None:
+                    t = Track(next(self._ids), r, vec, None)
+                else:
+                    t.vec = vec
+                    t.match = None # Conferida de novo com o vetor novo em _identify
+                t.start(rgb, r)
+                self.tracks.append(t)
+
+    def invalidate_identities(self):
+        """Descarta as identidades em cache (ex.: após alterar o cadastro)."""
+        for t in self.tracks:
+            t.match = None
+
+    def vectors(self) -> np.ndarray:
+        if not self.tracks:
+            return np.empty((0, db_operations.DESCRIPTOR_DIM), dtype=np.float32)
+        return np.stack([t.vec for t in self.tracks])
@@ -0,0 +1,292 @@
+import heapq
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import numpy as np
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import db_operations # DESCRIPTOR_DIM
+import matcher # Comparação com a galeria (feita no processo principal)
+
+# --- Parâmetros do Serviço ---
+MAX_FRAME_SHAPE = (1080, 1920, 3) # Maior frame BGR aceito em um slot de memória compartilhada
+SLOTS_PER_WORKER = 2 # Frames em voo por processo
+TASK_TIMEOUT_S = 30.0 # Sem resposta nesse prazo o frame é dado como perdido (processo encerrado à força)
+
+class PoolResult(NamedTuple):
+    """Resultado de um frame processado pelo pool, entregue na ordem da câmera."""
+    camera: Any
+    seq: int
+    boxes: List[Tuple[int, int, int, int]] # (left, top, right, bottom)
+    vecs: np.ndarray # (F, 128) float32
+    matches: Optional[List[matcher.Match]]
+    error: Optional[str]
+
+# --- Lado do Processo de Trabalho ---
+# Cada processo carrega os modelos do Dlib uma única vez (initializer) e se
+# conecta ao bloco de memória compartilhada onde o processo principal copia os frames.
+
+_worker_models = None
+_worker_shm = None
+_worker_owners = None # pid do processo que pegou cada slot (ver RecognitionWorkerPool._watch)
+_worker_error: Optional[str] = None
+
+def _init_worker(shm_name: str, owners: Any, predictor: str, recog: str):
+    # Uma exceção no initializer faria o Pool recriar o processo em ciclo, sem
+    # nunca responder: a falha fica guardada e volta como erro de cada frame
+    global _worker_models, _worker_shm, _worker_owners, _worker_error
+    _worker_owners = owners
+    try:
+        import recognition
+        _worker_models = recognition.load_models(predictor, recog)
+    except Exception as e:
+        _worker_error = f"{type(e).__name__}: {e}"
+    # Processos "spawn" compartilham o resource_tracker do principal, que cria e remove o bloco
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+
+def _process_slot(slot: int, slot_bytes: int, shape: Tuple[int, int, int]):
+    _worker_owners[slot] = os.getpid()
+    if _worker_models is None:
+        raise RuntimeError(f"Modelos do Dlib não carregados no processo de trabalho ({_worker_error}).")
+    import recognition
+    detector, sp, rec = _worker_models
+    frame = np.ndarray(shape, dtype=np.uint8, buffer=_worker_shm.buf, offset=slot * slot_bytes)
+    rgb = recognition.to_rgb(frame) # Cópia: o slot pode ser liberado assim que retornarmos
+    rects = recognition.detect_faces(detector, rgb)
+    vecs = recognition.embed_faces(sp, rec, rgb, rects)
+    return [(r.left(), r.top(), r.right(), r.bottom()) for r in rects], vecs
+
+# --- Lado do Processo Principal ---
+
+class _CameraOrder:
+    """Reordena os resultados de uma câmera pela sequência em que os frames foram enviados."""
+
+    def __init__(self):
+        self.next_submit = 0
+        self.next_emit = 0
+        self.pending: List[Tuple[int, PoolResult]] = []
+        self.output: "queue.Queue[PoolResult]" = queue.Queue()
+
+class RecognitionWorkerPool:
+    """
+    Serviço de reconhecimento multiprocesso. Os frames são copiados para slots
+    de memória compartilhada (multiprocessing.shared_memory) e só o índice do
+    slot trafega entre processos. Aceita várias câmeras ao mesmo tempo, com os
+    resultados de cada uma entregues na ordem de envio.
+
+    Um processo que morre no meio de um frame (falha no Dlib, falta de
+    memória) não devolve nada ao Pool. Uma thread de vigia entrega esses
+    frames como erro após TASK_TIMEOUT_S, para a fila ordenada da câmera não
+    travar. O slot fica em quarentena: um processo só lento ainda pode ler o
+    frame. Ele só volta a ficar livre quando a resposta atrasada chega ou
+    quando o processo que pegou o frame não existe mais.
+    """
+
+    def __init__(self, workers: Optional[int] = None, validate: bool = False,
+                 max_frame_shape: Tuple[int, int, int] = MAX_FRAME_SHAPE,
+                 predictor: Optional[str] = None, recog: Optional[str] = None,
+                 on_result: Optional[Callable[[PoolResult], None]] = None, timeout: float = TASK_TIMEOUT_S):
+        import recognition
+        self.workers = workers or os.cpu_count() or 1
+        self.validate = validate
+        self.on_result = on_result
+        self.timeout = timeout
+        self.slot_bytes = int(np.prod(max_frame_shape))
+        n_slots = self.workers * SLOTS_PER_WORKER
+        self._shm = shared_memory.SharedMemory(create=True, size=self.slot_bytes * n_slots)
+        self._free_slots: "queue.Queue[int]" = queue.Queue()
+        for slot in range(n_slots):
+            self._free_slots.put(slot)
+        self._cameras: Dict[Any, _CameraOrder] = {}
+        self._lock = threading.Lock()
+        self._inflight: Dict[Tuple[Any, int], Tuple[int, float]] = {} # (câmera, seq) -> (slot, prazo)
+        self._quarantine: Dict[Tuple[Any, int], int] = {} # (câmera, seq) -> slot de um frame dado como perdido
+        self.submitted = 0
+        self.completed = 0
+        self.lost = 0 # Frames sem resposta no prazo
+        # "spawn": o Dlib não é seguro após fork e este é o padrão no Windows
+        contexto = mp.get_context("spawn")
+        self._owners = contexto.RawArray("q", n_slots) # pid do processo que pegou cada slot (0: nenhum ainda)
+        self._pool = contexto.Pool(
+            self.workers, initializer=_init_worker,
+            initargs=(self._shm.name, self._owners, predictor or recognition.PREDICTOR, recog or recognition.RECOG))
+        self._parar = threading.Event()
+        self._vigia = threading.Thread(target=self._watch, name="vigia-pool", daemon=True)
+        self._vigia.start()
+
+    def _camera(self, camera: Any) -> _CameraOrder:
+        with self._lock:
+            if camera not in self._cameras:
+                self._cameras[camera] = _CameraOrder()
+            return self._cameras[camera]
+
+    def submit(self, camera: Any, frame: np.ndarray, block: bool = True, timeout: Optional[float] = None) -> Optional[int]:
+        """
+        Envia um frame BGR (uint8) de uma câmera. Retorna o número de sequência
+        do frame, ou None se não houver slot livre (com block=False ou no timeout).
+        """
+        if frame.nbytes > self.slot_bytes:
+            raise ValueError(f"Frame {frame.shape} maior que o slot de memória compartilhada ({self.slot_bytes} bytes).")
+        try:
+            slot = self._free_slots.get(block, timeout)
+        except queue.Empty:
+            return None
+        destino = np.ndarray(frame.shape, dtype=np.uint8, buffer=self._shm.buf, offset=slot * self.slot_bytes)
+        destino[...] = frame
+
+        ordem = self._camera(camera)
+        with self._lock:
+            seq = ordem.next_submit
+            ordem.next_submit += 1
+            self.submitted += 1
+            self._inflight[(camera, seq)] = (slot, time.monotonic() + self.timeout)
+        self._owners[slot] = 0
+        self._pool.apply_async(
+            _process_slot, (slot, self.slot_bytes, frame.shape),
+            callback=lambda res: self._done(camera, seq, slot, res, None),
+            error_callback=lambda exc: self._done(camera, seq, slot, None, repr(exc)))
+        return seq
+
+    def _done(self, camera: Any, seq: int, slot: int, res, error: Optional[str], vencido: bool = False) -> bool:
+        # Roda na thread de resultados do Pool (ou na vigia, para um frame perdido, com vencido=True)
+        with self._lock:
+            if self._inflight.pop((camera, seq), None) is None:
+                # Já entregue como perdido: a resposta atrasada é ignorada, mas
+                # agora o slot pode voltar a ser usado (se ainda estava em quarentena)
+                if self._quarantine.pop((camera, seq), None) is not None:
+                    self._free_slots.put(slot)
+                return False
+            if vencido:
+                self._quarantine[(camera, seq)] = slot # O processo ainda pode estar lendo o slot
+            else:
+                self._free_slots.put(slot)
+        boxes, vecs = res if res is not None else ([], np.empty((0, db_operations.DESCRIPTOR_DIM), dtype=np.float32))
+        matches = None
+        if self.validate and len(vecs):
+            matches = [candidatos[0] for candidatos in matcher.match(vecs, k=1)]
+        result = PoolResult(camera, seq, boxes, vecs, matches, error)
+
+        ordem = self._camera(camera)
+        prontos = []
+        with self._lock:
+            self.completed += 1
+            heapq.heappush(ordem.pending, (seq, result))
+            while ordem.pending and ordem.pending[0][0] == ordem.next_emit:
+                prontos.append(heapq.heappop(ordem.pending)[1])
+                ordem.next_emit += 1
+        for r in prontos:
+            if self.on_result is not None:
+                self.on_result(r)
+            else:
+                ordem.output.put(r)
+        return True
+
+    def _watch(self):
+        while not self._parar.wait(min(1.0, self.timeout)):
+            agora = time.monotonic()
+            with self._lock:
+                vencidos = [(chave, slot) for chave, (slot, prazo) in self._inflight.items() if prazo <= agora]
+            for (camera, seq), slot in vencidos:
+                if self._done(camera, seq, slot, None, f"Sem resposta em {self.timeout:g} s (processo encerrado?)", vencido=True):
+                    with self._lock:
+                        self.lost += 1
+            self._release_orphans()
+
+    def _release_orphans(self):
+        """
+        Libera os slots em quarentena cujo processo morreu: o Pool o substitui,
+        mas a tarefa nunca responde. Um slot ainda sem dono (0) é de uma tarefa
+        que continua na fila do Pool e vai rodar, então continua em quarentena.
+        """
+        # Pool._pool: processos atuais do Pool (não há API pública para os pids)
+        vivos = {p.pid for p in self._pool._pool if p.is_alive()}
+        with self._lock:
+            orfaos = [chave for chave, slot in self._quarantine.items()
+                      if self._owners[slot] and self._owners[slot] not in vivos]
+            for chave in orfaos:
+                self._free_slots.put(self._quarantine.pop(chave))
+
+    def get_result(self, camera: Any, timeout: Optional[float] = None) -> Optional[PoolResult]:
+        """Próximo resultado da câmera, na ordem de envio (sem on_result configurado)."""
+        try:
+            return self._camera(camera).output.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        """Espera os frames em voo, encerra os processos e libera a memória compartilhada."""
+        self._pool.close()
+        while True:
+            with self._lock:
+                if not self._inflight:
+                    break
+            time.sleep(0.05) # Os perdidos saem pela vigia
+        self._parar.set()
+        if self.lost:
+            self._pool.terminate() # O join esperaria para sempre pelas tarefas perdidas
+        self._pool.join()
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def run_cameras(sources: List[Any], workers: Optional[int] = None, duration: float = 10.0, validate: bool = False):
+    """
+    Modo serviço: lê várias fontes (índices de câmera, URLs RTSP ou arquivos) em
+    paralelo, distribui os frames pelo pool e informa o throughput por câmera.
+    """
+    import cv2
+
+    contagem = {src: 0 for src in sources}
+
+    def on_result(result: PoolResult):
+        contagem[result.camera] += 1
+
+    parar = threading.Event()
+
+    with RecognitionWorkerPool(workers, validate=validate, on_result=on_result) as pool:
+        def ler(src):
+            cap = cv2.VideoCapture(src)
+            while not parar.is_set():
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                # Sem slot livre o frame é descartado: a câmera nunca espera o pool
+                pool.submit(src, frame, block=False)
+            cap.release()
+
+        leitores = [threading.Thread(target=ler, args=(src,), daemon=True) for src in sources]
+        inicio = time.monotonic()
+        for t in leitores:
+            t.start()
+        for t in leitores:
+            t.join(max(0.0, duration - (time.monotonic() - inicio)))
+        parar.set()
+        for t in leitores:
+            t.join()
+    decorrido = time.monotonic() - inicio
+
+    print(f"--- {pool.workers} processo(s), {decorrido:.1f} s ---")
+    for src, n in contagem.items():
+        print(f"Câmera {src}: {n} frames reconhecidos ({n / decorrido:.1f} FPS)")
+    return contagem
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serviço de reconhecimento com um pool de processos.")
+    parser.add_argument("fontes", nargs="*", default=["0"], help="Índices de câmera, URLs RTSP ou arquivos de vídeo.")
+    parser.add_argument("--workers", type=int, default=None, help="Número de processos (padrão: núcleos da CPU).")
+    parser.add_argument("--duracao", type=float, default=10.0, help="Segundos de execução.")
+    parser.add_argument("--validar", action="store_true", help="Compara as faces com a galeria.")
+    args = parser.parse_args()
+
+    fontes = [int(f) if f.isdigit() else f for f in args.fontes]
+    run_cameras(fontes, args.workers, args.duracao, args.validar)